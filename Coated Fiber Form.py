@@ -1,10 +1,14 @@
 # === IMPORTS ===
-import json
 import streamlit as st
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
 import pandas as pd
+from gsheets import open_spreadsheet, ensure_tabs
+from write_queue import enqueue_row, show_queue_status
+from api_trace import show_render_cost
+from sequences import peek_id, next_id
+from snapshots import snapshot_records
+from date_index import read_recent
+from dates import parse_dates
 
 # === DISABLE ENTER KEY FORM SUBMIT ===
 st.markdown("""
@@ -18,49 +22,41 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # === GOOGLE SHEET SETUP ===
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(st.secrets["gcp_service_account"]), scope)
-client = gspread.authorize(creds)
-sheet = client.open("R&D Data Form")
+sheet = open_spreadsheet("R&D Data Form")
+cs_headers = ["CoatedSpool_ID", "UnCoatedSpool_ID", "Date"]
+fpcr_headers = [
+    "FiberCoat_ID", "PCoating_ID", "CoatedSpool_ID",
+    "Payout_Position", "Length_Coated", "Label", "Notes", "Date"
+]
+tabs = ensure_tabs(sheet, {
+    "Coated Spool Tbl": cs_headers,
+    "UnCoatedSpool ID Tbl": ["UncoatedSpool_ID", "Type", "C_Length", "Date_Time"],
+    "Fiber per Coating Run Tbl (Coating)": fpcr_headers,
+    "Pilot Coating Process Tbl": ["PCoating ID"],
+})
 
 # === HELPERS ===
-def get_or_create_worksheet(sheet, title, headers):
-    try:
-        ws = sheet.worksheet(title)
-    except gspread.exceptions.WorksheetNotFound:
-        ws = sheet.add_worksheet(title=title, rows="1000", cols="50")
-        ws.append_row(headers)
-    return ws
-
-def get_next_id(worksheet, id_column):
-    records = worksheet.get_all_records()
-    if records:
-        last_id = max([int(r[id_column]) for r in records if str(r.get(id_column, '')).isdigit()])
-        return last_id + 1
-    return 1
-
 def get_last_7_days_df(ws, date_col_name):
-    df = pd.DataFrame(ws.get_all_records())
+    df = pd.DataFrame(read_recent(ws, date_col_name, 7))
     if not df.empty:
         df.columns = df.columns.str.strip()
         if date_col_name in df.columns:
-            df[date_col_name] = pd.to_datetime(df[date_col_name], errors="coerce")
+            df[date_col_name] = parse_dates(df[date_col_name])
             return df[df[date_col_name] >= datetime.today() - timedelta(days=7)]
     return pd.DataFrame()
 
 # === COATED SPOOL FORM ===
 st.header("Coated Spool Entry")
-cs_headers = ["CoatedSpool_ID", "UnCoatedSpool_ID", "Date"]
-cs_sheet = get_or_create_worksheet(sheet, "Coated Spool Tbl", cs_headers)
+cs_sheet = tabs["Coated Spool Tbl"]
 
-uncoated_sheet = get_or_create_worksheet(sheet, "UnCoatedSpool ID Tbl", ["UncoatedSpool_ID", "Type", "C_Length", "Date_Time"])
-uncoated_df = pd.DataFrame(uncoated_sheet.get_all_records())
+uncoated_sheet = tabs["UnCoatedSpool ID Tbl"]
+uncoated_df = pd.DataFrame(snapshot_records(uncoated_sheet))
 uncoated_df.columns = uncoated_df.columns.str.strip()
 
 used_uncoated = set(str(uid).strip() for uid in cs_sheet.col_values(2)[1:] if uid.strip())
 
 with st.form("coated_spool_form"):
-    next_cs_id = get_next_id(cs_sheet, "CoatedSpool_ID")
+    next_cs_id = peek_id(cs_sheet)
     st.markdown(f"**Next CoatedSpool_ID:** `{next_cs_id}`")
 
     uncoated_choices = []
@@ -81,7 +77,8 @@ with st.form("coated_spool_form"):
 
         if cs_submit:
             if create_new == "No":
-                cs_sheet.append_row([next_cs_id, uncoated_selected, datetime.today().strftime("%Y-%m-%d")])
+                next_cs_id = next_id(cs_sheet)
+                enqueue_row(cs_sheet, [next_cs_id, uncoated_selected, datetime.today().strftime("%Y-%m-%d")])
                 st.success(f"✅ Coated Spool ID {next_cs_id} submitted.")
             else:
                 st.warning("Please scroll down to create a new UnCoatedSpool_ID entry.")
@@ -94,14 +91,15 @@ st.markdown("---")
 st.subheader("Create New UnCoatedSpool_ID Entry")
 
 with st.form("create_uncoated_form"):
-    new_id = get_next_id(uncoated_sheet, "UncoatedSpool_ID")
+    new_id = peek_id(uncoated_sheet)
     st.markdown(f"**Next UnCoatedSpool_ID:** `{new_id}`")
     new_type = st.selectbox("Type (As received / Combined)", ["As received", "Combined"])
     new_length = st.number_input("C_Length (m)", min_value=0.0)
     new_submit = st.form_submit_button("Create UnCoatedSpool_ID")
 
     if new_submit:
-        uncoated_sheet.append_row([new_id, new_type, new_length, datetime.today().strftime("%Y-%m-%d %H:%M:%S")])
+        new_id = next_id(uncoated_sheet)
+        enqueue_row(uncoated_sheet, [new_id, new_type, new_length, datetime.today().strftime("%Y-%m-%d %H:%M:%S")])
         st.success(f"✅ New UnCoatedSpool_ID {new_id} created. You can now use it in the dropdown above.")
 
 # === SHOW LAST 7 DAYS OF COATED SPOOL ENTRIES ===
@@ -114,17 +112,13 @@ else:
 
 # === FIBER PER COATING RUN FORM ===
 st.header("Fiber Per Coating Run Entry")
-fpcr_headers = [
-    "FiberCoat_ID", "PCoating_ID", "CoatedSpool_ID",
-    "Payout_Position", "Length_Coated", "Label", "Notes", "Date"
-]
-fpcr_sheet = get_or_create_worksheet(sheet, "Fiber per Coating Run Tbl (Coating)", fpcr_headers)
+fpcr_sheet = tabs["Fiber per Coating Run Tbl (Coating)"]
 
-pcoating_sheet = get_or_create_worksheet(sheet, "Pilot Coating Process Tbl", ["PCoating ID"])
-pcoating_records = pcoating_sheet.get_all_records()
+pcoating_sheet = tabs["Pilot Coating Process Tbl"]
+pcoating_records = snapshot_records(pcoating_sheet)
 pcoating_ids = [str(r.get("PCoating ID", "")).strip() for r in pcoating_records if r.get("PCoating ID")]
 
-coated_records = cs_sheet.get_all_records()
+coated_records = snapshot_records(cs_sheet)
 coated_ids = [str(r.get("CoatedSpool_ID", "")).strip() for r in coated_records if r.get("CoatedSpool_ID")]
 
 with st.form("Fiber Per Coating Run Form"):
@@ -137,8 +131,8 @@ with st.form("Fiber Per Coating Run Form"):
         notes = st.text_area("Notes")
         fpcr_submit = st.form_submit_button("Submit")
         if fpcr_submit:
-            fibercoat_id = get_next_id(fpcr_sheet, "FiberCoat_ID")
-            fpcr_sheet.append_row([
+            fibercoat_id = next_id(fpcr_sheet)
+            enqueue_row(fpcr_sheet, [
                 fibercoat_id, pcoating_selected, coated_selected,
                 payout_pos, length_coated, label, notes, datetime.today().strftime("%Y-%m-%d")
             ])
@@ -153,3 +147,7 @@ if not recent_fpcr.empty:
     st.dataframe(recent_fpcr)
 else:
     st.info("No recent fiber coating entries in the last 7 days.")
+
+# === UPLOAD QUEUE STATUS ===
+show_queue_status()
+show_render_cost()
@@ -1,28 +1,27 @@
-import json
 import streamlit as st
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
 import pandas as pd
-import re
+import time
+from gsheets import open_spreadsheet, ensure_tabs
+from write_queue import enqueue_row, enqueue_rows, show_queue_status
+from api_trace import show_render_cost
+from sequences import peek_id, next_id, next_ids
+from snapshots import snapshot_values
+from date_index import read_recent_values
+from dates import parse_dates
 
 # ------------- GOOGLE SHEETS SETUP -------------
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(st.secrets["gcp_service_account"]), scope)
-client = gspread.authorize(creds)
-spreadsheet = client.open("R&D Data Form")
-
-def get_or_create_worksheet(sheet, title, headers):
-    try:
-        worksheet = sheet.worksheet(title)
-    except gspread.exceptions.WorksheetNotFound:
-        worksheet = sheet.add_worksheet(title=title, rows="1000", cols="50")
-        worksheet.append_row(headers)
-    return worksheet
+spreadsheet = open_spreadsheet("R&D Data Form")
 
 def get_safe_all_records(worksheet, headers):
     """Get only records that match the expected number of columns (headers)."""
-    all_values = worksheet.get_all_values()
+    return safe_records(snapshot_values(worksheet), headers)
+
+def get_safe_recent_records(worksheet, headers, date_col, days=7):
+    """Like get_safe_all_records, but only reads the rows around the last `days` days."""
+    return safe_records(read_recent_values(worksheet, date_col, days), headers)
+
+def safe_records(all_values, headers):
     if not all_values or len(all_values) < 2:
         return []
     sheet_headers = all_values[0][:len(headers)]
@@ -53,31 +52,30 @@ csm_headers = [
 ]
 
 # --------- WORKSHEET OBJECTS ---------
-pcp_sheet = get_or_create_worksheet(spreadsheet, "Pilot Coating Process Tbl", pcp_headers)
-dcp_sheet = get_or_create_worksheet(spreadsheet, "Dip Coating Process Tbl", dcp_headers)
-ct_sheet = get_or_create_worksheet(spreadsheet, "Coater Tension Tbl", ct_headers)
-csm_sheet = get_or_create_worksheet(spreadsheet, "Coating Solution Mass Tbl", csm_headers)
+tabs = ensure_tabs(spreadsheet, {
+    "Pilot Coating Process Tbl": pcp_headers,
+    "Dip Coating Process Tbl": dcp_headers,
+    "Coater Tension Tbl": ct_headers,
+    "Coating Solution Mass Tbl": csm_headers,
+    "Solution ID Tbl": ["Solution ID"],
+})
+pcp_sheet = tabs["Pilot Coating Process Tbl"]
+dcp_sheet = tabs["Dip Coating Process Tbl"]
+ct_sheet = tabs["Coater Tension Tbl"]
+csm_sheet = tabs["Coating Solution Mass Tbl"]
 
 # --------- REFERENCE SHEETS FOR FK DROPDOWNS ---------
-solution_sheet = get_or_create_worksheet(spreadsheet, "Solution ID Tbl", ["Solution ID"])
+solution_sheet = tabs["Solution ID Tbl"]
 solution_ids = [record["Solution ID"] for record in get_safe_all_records(solution_sheet, ["Solution ID"]) if record.get("Solution ID")]
 
-# --------- PK GENERATION UTILITIES ---------
-def get_next_numeric_id(worksheet, id_column, headers):
-    records = get_safe_all_records(worksheet, headers)
-    nums = [int(record[id_column]) for record in records if str(record.get(id_column, "")).isdigit()]
-    return max(nums) + 1 if nums else 1
-
-def get_next_prefixed_id(worksheet, id_column, prefix, headers):
-    records = get_safe_all_records(worksheet, headers)
-    nums = []
-    for record in records:
-        val = str(record.get(id_column, ""))
-        m = re.match(rf"^{prefix}-(\d+)$", val)
-        if m:
-            nums.append(int(m.group(1)))
-    next_id = (max(nums) + 1 if nums else 1)
-    return f"{prefix}-{next_id:03d}"
+# --------- BATCH SUBMIT TIMING ---------
+# IDs come from the in-memory allocator and rows go to the local write queue
+# as one batch, so none of these numbers grow with the size of the tab.
+def show_submit_timing(n_rows, id_seconds, build_seconds, write_seconds):
+    st.caption(
+        f"⏱️ {n_rows} rows · ID range {id_seconds * 1000:.1f} ms · "
+        f"build {build_seconds * 1000:.1f} ms · queue write {write_seconds * 1000:.1f} ms"
+    )
 
 # --------- UI LAYOUT ---------
 st.title("🧪 Coating Process Data Entry")
@@ -87,7 +85,7 @@ tabs = st.tabs(["Pilot Coating", "Dip Coating", "Coater Tension", "Solution Mass
 with tabs[0]:
     st.subheader("Pilot Coating Process Entry")
     with st.form("pilot_form"):
-        pcoating_id = get_next_prefixed_id(pcp_sheet, "PCoating ID", "PCOAT", pcp_headers)
+        pcoating_id = peek_id(pcp_sheet, "PCOAT")
         st.markdown(f"**Auto-generated PCoating ID:** `{pcoating_id}`")
         pilot = {
             "solution_id": st.selectbox("Solution ID", solution_ids, key="p_solution"),
@@ -109,7 +107,8 @@ with tabs[0]:
             "notes": st.text_area("Notes", key="p_notes")
         }
         if st.form_submit_button("Submit Pilot Coating"):
-            pcp_sheet.append_row([
+            pcoating_id = next_id(pcp_sheet, "PCOAT")
+            enqueue_row(pcp_sheet, [
                 pcoating_id, pilot["solution_id"], pilot["date"].strftime("%Y-%m-%d"),
                 pilot["box_temp"], pilot["box_rh"], pilot["n2_flow"], pilot["load_cell_slope"],
                 pilot["num_fibers"], pilot["coating_speed"], pilot["tower1_set"],
@@ -123,7 +122,7 @@ with tabs[0]:
 with tabs[1]:
     st.subheader("Dip Coating Process Entry")
     with st.form("dip_form"):
-        dcoating_id = get_next_numeric_id(dcp_sheet, "DCoating_ID", dcp_headers)
+        dcoating_id = peek_id(dcp_sheet)
         st.markdown(f"**Auto-generated DCoating ID:** `{dcoating_id}`")
         dip = {
             "solution_id": st.selectbox("Solution_ID", solution_ids, key="d_solution"),
@@ -142,7 +141,8 @@ with tabs[1]:
             "notes": st.text_area("Notes", key="d_notes"),
         }
         if st.form_submit_button("Submit Dip Coating"):
-            dcp_sheet.append_row([
+            dcoating_id = next_id(dcp_sheet)
+            enqueue_row(dcp_sheet, [
                 dcoating_id, dip["solution_id"], dip["date"].strftime("%Y-%m-%d"), dip["box_temp"], dip["box_rh"], dip["n2_flow"],
                 dip["num_fibers"], dip["coating_speed"], dip["anneal_time"], dip["anneal_temp"],
                 dip["layer_type"], dip["operator"], dip["ambient_temp"], dip["ambient_rh"], dip["notes"]
@@ -166,12 +166,20 @@ with tabs[2]:
     if st.session_state.tension_list:
         st.write("### Preview Entries")
         st.table(pd.DataFrame(st.session_state.tension_list, columns=["PCoating ID", "Payout Location", "Tension (g)", "Notes"]))
-    if st.button("Submit All Tension Data"):
-        for entry in st.session_state.tension_list:
-            tid = get_next_prefixed_id(ct_sheet, "Tension ID", "TENSION", ct_headers)
-            ct_sheet.append_row([tid] + list(entry))
-        st.session_state.tension_list.clear()
-        st.success(":white_check_mark: All entries saved!")
+    if st.button("Submit All Tension Data") and st.session_state.tension_list:
+        started = time.perf_counter()
+        tension_ids = next_ids(ct_sheet, "TENSION", len(st.session_state.tension_list))
+        id_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        rows = [[tid] + list(entry) for tid, entry in zip(tension_ids, st.session_state.tension_list)]
+        build_seconds = time.perf_counter() - started
+        try:
+            elapsed = enqueue_rows(ct_sheet, rows)
+            st.session_state.tension_list.clear()
+            st.success(f":white_check_mark: All {len(rows)} entries saved ({tension_ids[0]} to {tension_ids[-1]})!")
+            show_submit_timing(len(rows), id_seconds, build_seconds, elapsed)
+        except Exception as e:
+            st.error(f":x: No tension entries were saved: {e}")
 
 # --------- COATING SOLUTION MASS FORM WITH MULTI-ENTRY ---------
 with tabs[3]:
@@ -201,34 +209,30 @@ with tabs[3]:
             st.session_state.mass_list,
             columns=["Solution ID", "Date & Time", "DCoating ID", "Pcoating ID", "Solution Mass", "Operators Initials", "Notes"]
         ))
-    if st.button("Submit All Mass Entries"):
-        for entry in st.session_state.mass_list:
-            mid = get_next_numeric_id(csm_sheet, "SolutionMass ID", csm_headers)
+    if st.button("Submit All Mass Entries") and st.session_state.mass_list:
+        started = time.perf_counter()
+        mass_ids = next_ids(csm_sheet, count=len(st.session_state.mass_list))
+        id_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        rows = []
+        for mid, entry in zip(mass_ids, st.session_state.mass_list):
             formatted_entry = list(entry)
             formatted_entry[1] = formatted_entry[1].strftime("%Y-%m-%d %H:%M")
-            csm_sheet.append_row([mid] + formatted_entry)
-        st.session_state.mass_list.clear()
-        st.success(":white_check_mark: All mass entries saved!")
+            rows.append([mid] + formatted_entry)
+        build_seconds = time.perf_counter() - started
+        try:
+            elapsed = enqueue_rows(csm_sheet, rows)
+            st.session_state.mass_list.clear()
+            st.success(f":white_check_mark: All {len(rows)} mass entries saved (IDs {mass_ids[0]} to {mass_ids[-1]})!")
+            show_submit_timing(len(rows), id_seconds, build_seconds, elapsed)
+        except Exception as e:
+            st.error(f":x: No mass entries were saved: {e}")
 
 # --------- RECENT 7-DAY ENTRIES PREVIEW ---------
 def filter_last_7_days(records, date_key):
-    today = datetime.today()
-    filtered = []
-    for record in records:
-        date_str = record.get(date_key, "").strip()
-        try:
-            if not date_str:
-                continue
-            # Try datetime with time first, then just date
-            try:
-                date_val = datetime.strptime(date_str, "%Y-%m-%d %H:%M")
-            except:
-                date_val = datetime.strptime(date_str, "%Y-%m-%d")
-            if date_val.date() >= (today - timedelta(days=7)).date():
-                filtered.append(record)
-        except Exception:
-            continue
-    return filtered
+    parsed = parse_dates([record.get(date_key, "") for record in records])
+    recent = parsed.dt.normalize() >= pd.Timestamp((datetime.today() - timedelta(days=7)).date())
+    return [record for record, keep in zip(records, recent) if keep]
 
 def safe_preview(title, records, key, use_latest_if_no_date=False):
     st.markdown(f"### :white_check_mark: {title}")
@@ -243,7 +247,11 @@ def safe_preview(title, records, key, use_latest_if_no_date=False):
             st.write("No entries in the last 7 days.")
 
 st.markdown("## :date: Recent Entries (Last 7 Days)")
-safe_preview("Pilot Coating", get_safe_all_records(pcp_sheet, pcp_headers), "Date")
-safe_preview("Dip Coating", get_safe_all_records(dcp_sheet, dcp_headers), "Date")
+safe_preview("Pilot Coating", get_safe_recent_records(pcp_sheet, pcp_headers, "Date"), "Date")
+safe_preview("Dip Coating", get_safe_recent_records(dcp_sheet, dcp_headers, "Date"), "Date")
 safe_preview("Coater Tension", get_safe_all_records(ct_sheet, ct_headers), "Tension ID", use_latest_if_no_date=True)  # Just shows latest 7 if no date
-safe_preview("Coating Solution Mass", get_safe_all_records(csm_sheet, csm_headers), "Date & Time")
+safe_preview("Coating Solution Mass", get_safe_recent_records(csm_sheet, csm_headers, "Date & Time"), "Date & Time")
+
+# --------- UPLOAD QUEUE STATUS ---------
+show_queue_status()
+show_render_cost()
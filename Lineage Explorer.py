@@ -0,0 +1,74 @@
+import time
+
+import pandas as pd
+import streamlit as st
+
+from lineage import get_index
+from write_queue import show_queue_status
+from api_trace import show_render_cost
+
+# --- CONFIG ---
+KIND_LABELS = {
+    "batch": "Fiber Batch", "received_spool": "As Received Spool", "combined_spool": "Combined Spool",
+    "uncoated_spool": "Uncoated Spool", "coated_spool": "Coated Spool", "solution": "Solution",
+    "pcoating": "Pilot Coating Run", "dcoating": "Dip Coating Run", "fiber_coat": "Fiber per Coating Run",
+    "spool_per_wind": "Spool per Wind", "wound_module": "Wound Module", "mini_module": "Mini Module",
+    "module": "Module", "pressure_test": "Pressure Test", "pure_gas_test": "Pure Gas Test",
+    "mixed_gas_test": "Mixed Gas Test", "leak_test": "Leak Test", "module_failure": "Module Failure",
+}
+
+
+def results_df(nodes):
+    rows = [{"Kind": KIND_LABELS.get(kind, kind), "ID": node_id, "Hops": hops}
+            for (kind, node_id), hops in nodes.items()]
+    return pd.DataFrame(rows, columns=["Kind", "ID", "Hops"]).sort_values(["Hops", "Kind", "ID"])
+
+
+# --- INDEX ---
+st.title("🧬 Material Lineage Explorer")
+st.markdown("Trace any ID upstream (what it was made from) or downstream (what was made from it).")
+
+if st.sidebar.button("🔄 Reload lineage now"):
+    get_index(force=True)
+try:
+    index = get_index()
+except Exception as e:
+    st.error(f"❌ Error building lineage index: {e}")
+    st.stop()
+
+stats = index.stats()
+st.caption(f"{stats['nodes']} IDs, {stats['edges']} links from {stats['tabs']} tabs; "
+           f"last refresh took {stats['build_seconds'] * 1000:.0f} ms")
+if stats["missing_tabs"]:
+    st.warning(f"⚠️ Tabs not found (skipped): {', '.join(stats['missing_tabs'])}")
+
+# --- QUERY ---
+node_id = st.text_input("ID to trace (e.g. a Batch_Fiber_ID, CoatedSpool_ID or MOD-123)").strip()
+if node_id:
+    matches = index.find(node_id)
+    if not matches:
+        st.info(f"`{node_id}` does not appear in any lineage tab.")
+    else:
+        node = matches[0]
+        if len(matches) > 1:
+            node = st.selectbox("This ID exists in several tables; pick one", matches,
+                                format_func=lambda n: f"{KIND_LABELS.get(n[0], n[0])}: {n[1]}")
+        only = st.multiselect("Only show", sorted(KIND_LABELS.values()))
+
+        started = time.perf_counter()
+        upstream = index.upstream(node)
+        downstream = index.downstream(node)
+        elapsed = time.perf_counter() - started
+
+        col1, col2 = st.columns(2)
+        for col, title, nodes in ((col1, "⬆️ Upstream", upstream), (col2, "⬇️ Downstream", downstream)):
+            df = results_df(nodes)
+            if only:
+                df = df[df["Kind"].isin(only)]
+            col.subheader(f"{title} ({len(df)})")
+            col.dataframe(df, hide_index=True)
+        st.caption(f"Query answered in {elapsed * 1000:.3f} ms")
+
+# --- UPLOAD QUEUE ---
+show_queue_status()
+show_render_cost()
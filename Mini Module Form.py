@@ -1,9 +1,14 @@
 import streamlit as st
 import pandas as pd
 import gspread
-import json
 from datetime import datetime, timedelta
-from oauth2client.service_account import ServiceAccountCredentials
+from gsheets import open_spreadsheet, get_worksheet, ensure_tabs
+from write_queue import enqueue_row, show_queue_status
+from api_trace import show_render_cost
+from sequences import peek_id, next_id
+from snapshots import snapshot_records
+from row_index import RowConflict, current_version, upsert_row
+from dates import parse_dates
 
 # ---------- CONFIG ----------
 GOOGLE_SHEET_NAME = "R&D Data Form"
@@ -15,28 +20,6 @@ TAB_COATED_SPOOL = "Coated Spool Tbl"
 TAB_DCOATING = "Dip Coating Process Tbl"
 
 # ---------- UTILS ----------
-def connect_google_sheet(sheet_name):
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(
-        json.loads(st.secrets["gcp_service_account"]), scope)
-    return gspread.authorize(creds).open(sheet_name)
-
-def get_or_create_tab(spreadsheet, tab_name, headers):
-    try:
-        worksheet = spreadsheet.worksheet(tab_name)
-        if not worksheet.get_all_values():
-            worksheet.insert_row(headers, 1)
-    except gspread.exceptions.WorksheetNotFound:
-        worksheet = spreadsheet.add_worksheet(title=tab_name, rows="1000", cols="50")
-        worksheet.insert_row(headers, 1)
-    return worksheet
-
-def get_last_id(worksheet, prefix):
-    records = worksheet.col_values(1)[1:]
-    nums = [int(r.split('-')[-1]) for r in records if r.startswith(prefix) and r.split('-')[-1].isdigit()]
-    next_num = max(nums) + 1 if nums else 1
-    return f"{prefix}-{str(next_num).zfill(3)}"
-
 def generate_c_module_label(operator_initials):
     today = datetime.today().strftime("%Y%m%d")
     base = today + operator_initials.upper()
@@ -46,19 +29,31 @@ def generate_c_module_label(operator_initials):
     return base + next_letter
 
 # ---------- LOAD SHEETS ----------
-sheet = connect_google_sheet(GOOGLE_SHEET_NAME)
-
-mini_sheet = get_or_create_tab(sheet, TAB_MINI_MODULE, [
-    "Mini Module ID", "Module ID", "Batch_Fiber_ID", "UncoatedSpool_ID", "CoatedSpool_ID", "DCoating_ID",
-    "Number of Fibers", "Fiber Length", "Active Area", "Operator Initials", "Module Label", "Notes", "Date"
-])
-
-module_sheet = get_or_create_tab(sheet, TAB_MODULE, ["Module ID", "Module Type", "Notes"])
-batch_sheet = get_or_create_tab(sheet, TAB_BATCH_FIBER, ["Batch_Fiber_ID"])
-uncoated_sheet = get_or_create_tab(sheet, TAB_UNCOATED_SPOOL, ["UncoatedSpool_ID"])
+sheet = open_spreadsheet(GOOGLE_SHEET_NAME)
+
+tabs = ensure_tabs(sheet, {
+    TAB_MINI_MODULE: [
+        "Mini Module ID", "Module ID", "Batch_Fiber_ID", "UncoatedSpool_ID", "CoatedSpool_ID", "DCoating_ID",
+        "Number of Fibers", "Fiber Length", "Active Area", "Operator Initials", "Module Label", "Notes", "Date"
+    ],
+    TAB_MODULE: ["Module ID", "Module Type", "Notes"],
+    TAB_BATCH_FIBER: ["Batch_Fiber_ID"],
+    TAB_UNCOATED_SPOOL: ["UncoatedSpool_ID"],
+    # ✅ FIXED HEADERS
+    TAB_DCOATING: [
+        "DCoating_ID", "Solution_ID", "Date", "Box_Temperature", "Box_RH", "N2_Flow",
+        "Number_of_Fibers", "Coating_Speed", "Annealing_Time", "Annealing_Temperature",
+        "Coating_Layer_Type", "Operator_Initials", "Ambient_Temperature", "Ambient_RH", "Notes"
+    ],
+})
+mini_sheet = tabs[TAB_MINI_MODULE]
+module_sheet = tabs[TAB_MODULE]
+batch_sheet = tabs[TAB_BATCH_FIBER]
+uncoated_sheet = tabs[TAB_UNCOATED_SPOOL]
+dcoating_sheet = tabs[TAB_DCOATING]
 try:
-    coated_sheet = sheet.worksheet(TAB_COATED_SPOOL)
-    coated_data = coated_sheet.get_all_records()
+    coated_sheet = get_worksheet(sheet, TAB_COATED_SPOOL)
+    coated_data = snapshot_records(coated_sheet)
     if coated_data:
         coated_df = pd.DataFrame(coated_data)
         coated_ids = coated_df.get("CoatedSpool_ID", pd.Series()).dropna().tolist()
@@ -69,20 +64,13 @@ except gspread.exceptions.WorksheetNotFound:
     st.warning("⚠️ 'Coated Spool Tbl' not found. Skipping dropdown.")
     coated_ids = []
 
-  # ✅ FIXED HEADERS
-dcoating_sheet = get_or_create_tab(sheet, TAB_DCOATING, [
-    "DCoating_ID", "Solution_ID", "Date", "Box_Temperature", "Box_RH", "N2_Flow",
-    "Number_of_Fibers", "Coating_Speed", "Annealing_Time", "Annealing_Temperature",
-    "Coating_Layer_Type", "Operator_Initials", "Ambient_Temperature", "Ambient_RH", "Notes"
-    ])
-
 # ---------- LOAD DATA ----------
-module_df = pd.DataFrame(module_sheet.get_all_records())
-mini_df = pd.DataFrame(mini_sheet.get_all_records())
-batch_df = pd.DataFrame(batch_sheet.get_all_records())
-uncoated_df = pd.DataFrame(uncoated_sheet.get_all_records())
-coated_df = pd.DataFrame(coated_sheet.get_all_records())
-dcoating_df = pd.DataFrame(dcoating_sheet.get_all_records())
+module_df = pd.DataFrame(snapshot_records(module_sheet))
+mini_df = pd.DataFrame(snapshot_records(mini_sheet))
+batch_df = pd.DataFrame(snapshot_records(batch_sheet))
+uncoated_df = pd.DataFrame(snapshot_records(uncoated_sheet))
+coated_df = pd.DataFrame(snapshot_records(coated_sheet))
+dcoating_df = pd.DataFrame(snapshot_records(dcoating_sheet))
 
 mini_modules = module_df[module_df["Module Type"].str.lower() == "mini"]["Module ID"].tolist()
 batch_ids = batch_df.get("Batch_Fiber_ID", pd.Series()).dropna().tolist()
@@ -100,35 +88,43 @@ with st.form("mini_module_form", clear_on_submit=True):
     existing = mini_df[mini_df["Module ID"] == selected_module]
     prefill = existing.iloc[0] if not existing.empty else None
 
-    mini_module_id = prefill["Mini Module ID"] if prefill is not None else get_last_id(mini_sheet, "MINIMOD")
+    mini_module_id = prefill["Mini Module ID"] if prefill is not None else peek_id(mini_sheet, "MINIMOD")
+    # (ID, row version) as the previous render showed it is what a save checks against;
+    # every render records what it shows, so a later visit starts from the current row
+    shown_version = st.session_state.get("mini_edit_version")
+    st.session_state["mini_edit_version"] = (
+        (mini_module_id, current_version(mini_sheet, mini_module_id, "Mini Module ID")) if prefill is not None else None
+    )
     st.markdown(f"**Mini Module ID:** `{mini_module_id}`")
 
-    batch_fiber_id = st.selectbox("Batch_Fiber_ID", batch_ids, index=batch_ids.index(prefill["Batch_Fiber_ID"]) if prefill else 0)
-    uncoated_spool_id = st.selectbox("UncoatedSpool_ID", uncoated_ids, index=uncoated_ids.index(prefill["UncoatedSpool_ID"]) if prefill else 0)
+    batch_fiber_id = st.selectbox("Batch_Fiber_ID", batch_ids, index=batch_ids.index(prefill["Batch_Fiber_ID"]) if prefill is not None else 0)
+    uncoated_spool_id = st.selectbox("UncoatedSpool_ID", uncoated_ids, index=uncoated_ids.index(prefill["UncoatedSpool_ID"]) if prefill is not None else 0)
     if coated_ids:
         coated_spool_id = st.selectbox(
             "CoatedSpool_ID",
             coated_ids,
-            index=coated_ids.index(prefill["CoatedSpool_ID"]) if prefill and prefill["CoatedSpool_ID"] in coated_ids else 0)
+            index=coated_ids.index(prefill["CoatedSpool_ID"]) if prefill is not None and prefill["CoatedSpool_ID"] in coated_ids else 0)
     else:
         st.warning("⚠️ No Coated Spool IDs found. Please add them to the 'Coated Spool Tbl' sheet.")
         coated_spool_id = ""
 
-    dcoating_id = st.selectbox("DCoating_ID", dcoating_ids, index=dcoating_ids.index(prefill["DCoating_ID"]) if prefill and prefill["DCoating_ID"] in dcoating_ids else 0)
+    dcoating_id = st.selectbox("DCoating_ID", dcoating_ids, index=dcoating_ids.index(prefill["DCoating_ID"]) if prefill is not None and prefill["DCoating_ID"] in dcoating_ids else 0)
 
-    num_fibers = st.number_input("Number of Fibers", step=1, value=int(prefill["Number of Fibers"]) if prefill else 0)
-    fiber_length = st.number_input("Fiber Length (inches)", format="%.2f", value=float(prefill["Fiber Length"]) if prefill else 0.0)
-    active_area = st.number_input("C - Active Area", format="%.2f", value=float(prefill["Active Area"]) if prefill else 0.0)
-    operator_initials = st.text_input("Operator Initials", value=prefill["Operator Initials"] if prefill else "")
+    num_fibers = st.number_input("Number of Fibers", step=1, value=int(prefill["Number of Fibers"]) if prefill is not None else 0)
+    fiber_length = st.number_input("Fiber Length (inches)", format="%.2f", value=float(prefill["Fiber Length"]) if prefill is not None else 0.0)
+    active_area = st.number_input("C - Active Area", format="%.2f", value=float(prefill["Active Area"]) if prefill is not None else 0.0)
+    operator_initials = st.text_input("Operator Initials", value=prefill["Operator Initials"] if prefill is not None else "")
     auto_label = st.checkbox("Auto-generate C-Module Label?", value=True)
-    module_label = generate_c_module_label(operator_initials) if auto_label and operator_initials else st.text_input("C-Module Label", value=prefill["Module Label"] if prefill else "")
-    notes = st.text_area("Notes", value=prefill["Notes"] if prefill else "")
+    module_label = generate_c_module_label(operator_initials) if auto_label and operator_initials else st.text_input("C-Module Label", value=prefill["Module Label"] if prefill is not None else "")
+    notes = st.text_area("Notes", value=prefill["Notes"] if prefill is not None else "")
     date_val = st.date_input("Date", value=datetime.today().date() if prefill is None else datetime.strptime(prefill["Date"], "%Y-%m-%d").date())
 
     submit = st.form_submit_button("💾 Save Entry")
 
 # ---------- SAVE ----------
 if submit:
+    if prefill is None:
+        mini_module_id = next_id(mini_sheet, "MINIMOD")
     row = [
         mini_module_id, selected_module, batch_fiber_id, uncoated_spool_id,
         coated_spool_id, dcoating_id, num_fibers, fiber_length, active_area,
@@ -136,20 +132,24 @@ if submit:
     ]
     try:
         if prefill is not None:
-            idx = mini_df[mini_df["Mini Module ID"] == mini_module_id].index[0] + 2
-            mini_sheet.delete_rows(idx)
-            mini_sheet.insert_row(row, idx)
+            if shown_version is not None and shown_version[0] == mini_module_id:
+                version = shown_version[1]
+            else:
+                version = st.session_state["mini_edit_version"][1]
+            upsert_row(mini_sheet, mini_module_id, row, version=version, key_column="Mini Module ID")
             st.success("✅ Entry updated.")
         else:
-            mini_sheet.append_row(row)
-            st.success("✅ Entry saved.")
+            enqueue_row(mini_sheet, row)
+            st.success(f"✅ Entry {mini_module_id} saved.")
+    except RowConflict as e:
+        st.error(f"❌ Not saved: {e}. Reload the entry and apply your changes again.")
     except Exception as e:
         st.error(f"❌ Error saving: {e}")
 
 # ---------- LAST 7 DAYS ----------
 st.subheader("📅 Mini Modules: Last 7 Days")
 if not mini_df.empty:
-    mini_df["Date"] = pd.to_datetime(mini_df["Date"], errors="coerce")
+    mini_df["Date"] = parse_dates(mini_df["Date"])
     recent = mini_df[mini_df["Date"] >= datetime.today() - timedelta(days=7)]
     if not recent.empty:
         st.dataframe(recent)
@@ -158,3 +158,6 @@ if not mini_df.empty:
 else:
     st.info("No data yet.")
 
+# ---------- UPLOAD QUEUE ----------
+show_queue_status()
+show_render_cost()
@@ -1,17 +1,18 @@
 # === IMPORTS ===
 import streamlit as st
-import pandas as pd
-import gspread
-import json
 from datetime import datetime, timedelta
-from oauth2client.service_account import ServiceAccountCredentials
+from gsheets import open_spreadsheet, ensure_tabs
+from write_queue import enqueue_row, enqueue_rows, show_queue_status
+from api_trace import show_render_cost
+from sequences import peek_id, next_id, next_ids
+from module_index import module_label_index
+from dates import snapshot_frame
+from gas_calc import mixed_gas_derived
+from instrument_import import MIXED_COLUMNS, MIXED_REQUIRED, read_export, missing_columns, map_modules, mixed_gas_results, mixed_gas_rows
 
 
 # === CONFIG ===
 GOOGLE_SHEET_NAME = "R&D Data Form"
-TAB_MODULE = "Module Tbl"
-TAB_WOUND = "Wound Module Tbl"
-TAB_MINI = "Mini Module Tbl"
 TAB_MIXED = "Mixed Gas Test Tbl"
 
 # Prevent accidental form submit on Enter
@@ -25,55 +26,18 @@ st.markdown("""
     </script>
 """, unsafe_allow_html=True)
 
-# === UTILS ===
-def connect_google_sheet(sheet_name):
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    json_key = json.loads(st.secrets["gcp_service_account"])
-    json_key["private_key"] = json_key["private_key"].replace("\\n", "\n")
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(json_key, scope)
-    return gspread.authorize(creds).open(sheet_name)
-
-def get_or_create_tab(sheet, name, headers):
-    try:
-        tab = sheet.worksheet(name)
-        if not tab.get_all_values():
-            tab.insert_row(headers, 1)
-    except gspread.exceptions.WorksheetNotFound:
-        tab = sheet.add_worksheet(title=name, rows="1000", cols="50")
-        tab.insert_row(headers, 1)
-    return tab
-
-def get_last_id(sheet, prefix):
-    ids = sheet.col_values(1)[1:]
-    nums = [int(i.split("-")[-1]) for i in ids if i.startswith(prefix)]
-    return f"{prefix}-{str(max(nums)+1).zfill(3)}" if nums else f"{prefix}-001"
-
-def get_display_label(row, wound_df, mini_df):
-    mid = row["Module ID"]
-    mtype = row["Module Type"].strip().lower()
-    if mtype == "mini":
-        label = mini_df[mini_df["Module ID"] == mid]["Module Label"].values[0] if not mini_df[mini_df["Module ID"] == mid].empty else "—"
-    elif mtype == "wound":
-        label = wound_df[wound_df["Module ID (FK)"] == mid]["Wound Module ID"].values[0] if not wound_df[wound_df["Module ID (FK)"] == mid].empty else "—"
-    else:
-        label = "—"
-    return f"{mid} | {mtype.capitalize()} | {label}", mtype, label
-
 # === SHEET SETUP ===
-sheet = connect_google_sheet(GOOGLE_SHEET_NAME)
-mixed_sheet = get_or_create_tab(sheet, TAB_MIXED, [
+sheet = open_spreadsheet(GOOGLE_SHEET_NAME)
+mixed_sheet = ensure_tabs(sheet, {TAB_MIXED: [
     "Mixed Gas Test ID", "Mixed Gas Test Date", "Module ID", "Module Type", "Temperature", "Feed Pressure",
     "Retentate Pressure", "Retentate Flow", "Retentate CO2 Comp", "Permeate Pressure",
     "Permeate Flow", "Permeate CO2 Composition", "Permeate O2 Composition", "Ambient Temperature",
     "CO2 Analyzer ID", "Test Rig", "Operator Initials", "Notes", "Passed",
     "C-CO2 Perm", "C - N2 perm", "C - Selectivity", "C - CO2 Flux", "C - stage cut"
-])
-module_df = pd.DataFrame(sheet.worksheet(TAB_MODULE).get_all_records())
-wound_df = pd.DataFrame(sheet.worksheet(TAB_WOUND).get_all_records())
-mini_df = pd.DataFrame(sheet.worksheet(TAB_MINI).get_all_records())
+]})[TAB_MIXED]
+module_df = module_label_index(sheet)
 
 # === DISPLAY SETUP ===
-module_df["Display"], module_df["Type"], module_df["Label"] = zip(*module_df.apply(lambda row: get_display_label(row, wound_df, mini_df), axis=1))
 module_options = dict(zip(module_df["Display"], module_df["Module ID"]))
 
 # === FORM STATE ===
@@ -83,7 +47,7 @@ if "previewed" not in st.session_state:
 # === FORM ===
 st.title(":test_tube: Mixed Gas Test Form")
 with st.form("mixed_form"):
-    test_id = get_last_id(mixed_sheet, "MIXG")
+    test_id = peek_id(mixed_sheet, "MIXG")
     st.markdown(f"**Test ID:** `{test_id}`")
     test_date = st.date_input("Test Date", datetime.today())
 
@@ -91,7 +55,6 @@ with st.form("mixed_form"):
     module_id = module_options[module_display]
     selected_row = module_df[module_df["Display"] == module_display].iloc[0]
     module_type = selected_row["Type"]
-    label = selected_row["Label"]
 
     st.write(f"**Module Type:** {module_type}")
 
@@ -119,14 +82,8 @@ if preview:
     st.session_state.previewed = True
 
 if st.session_state.previewed:
-    if area > 0 and feed > 0 and r_co2 > 0:
-        co2_perm = round((p_co2 / 100) * p_flow / area, 6)
-        n2_perm = round(((100 - p_co2) / 100) * p_flow / area, 6)
-        selectivity = round(co2_perm / n2_perm, 6) if n2_perm != 0 else 0.0
-        co2_flux = round(p_flow / area, 6)
-        stage_cut = round(p_flow / feed, 6)
-    else:
-        co2_perm = n2_perm = selectivity = co2_flux = stage_cut = 0.0
+    co2_perm, n2_perm, selectivity, co2_flux, stage_cut = (
+        float(v) for v in mixed_gas_derived(feed, r_co2, p_flow, p_co2, area).values())
 
     st.markdown("### :bulb: Calculated Values")
     st.write("**C - CO2 Perm:**", co2_perm)
@@ -137,21 +94,59 @@ if st.session_state.previewed:
 
 if submit and st.session_state.previewed:
     try:
-        mixed_sheet.append_row([
-            test_id, str(test_date), module_id, module_type, label,
+        test_id = next_id(mixed_sheet, "MIXG")
+        enqueue_row(mixed_sheet, [
+            test_id, str(test_date), module_id, module_type,
             temp, feed, r_press, r_flow, r_co2, p_press, p_flow,
             p_co2, p_o2, amb_temp, analyzer, rig, initials, notes, passed,
             co2_perm, n2_perm, selectivity, co2_flux, stage_cut
         ])
-        st.success(":white_check_mark: Mixed Gas Test record saved successfully!")
+        st.success(f":white_check_mark: Mixed Gas Test record {test_id} saved successfully!")
         st.session_state.previewed = False
     except Exception as e:
         st.error(f":x: Failed to save: {e}")
 
+# === IMPORT FROM RIG FILE ===
+with st.expander(":open_file_folder: Import tests from a rig export (CSV/XLSX)"):
+    st.caption("One test per row with Module (ID or label), Feed Pressure, Retentate CO2, Permeate Flow and "
+               "Permeate CO2; the other form fields (Temperature, Test Rig, Area, Passed, ...) are read when present.")
+    rig_file = st.file_uploader("Rig export", type=["csv", "xlsx"], key="mg_rig_file")
+    import_date = st.date_input("Test Date (when the file has none)", datetime.today(), key="mg_import_date")
+    import_area = st.number_input("Module Area (cm²) (when the file has none)", min_value=0.001, format="%.3f", key="mg_import_area")
+    import_initials = st.text_input("Operator Initials", key="mg_import_initials")
+    import_notes = st.text_input("Notes", value="Imported from rig file", key="mg_import_notes")
+    import_passed = st.radio("Passed? (when the file has no Passed column)", ["Yes", "No"], key="mg_import_passed")
+    if rig_file is not None:
+        try:
+            readings = read_export(rig_file, MIXED_COLUMNS)
+        except Exception as e:
+            st.error(f":x: Could not read {rig_file.name}: {e}")
+            readings = None
+        if readings is not None:
+            missing = missing_columns(readings, MIXED_REQUIRED)
+            if missing:
+                st.error(f":x: {rig_file.name} has no column for: {', '.join(missing)}")
+            else:
+                readings = map_modules(readings, module_df)
+                unmatched = readings[readings["Module ID"] == ""]
+                if not unmatched.empty:
+                    st.warning(f":warning: Skipping {len(unmatched)} rows with unknown modules: "
+                               f"{', '.join(sorted(unmatched['Module'].astype(str).unique())[:10])}")
+                results = mixed_gas_results(readings[readings["Module ID"] != ""].reset_index(drop=True), import_area)
+                st.dataframe(results, hide_index=True)
+                if len(results) and st.button(f":rocket: Import {len(results)} tests", key="mg_import"):
+                    try:
+                        test_ids = next_ids(mixed_sheet, "MIXG", count=len(results))
+                        rows = mixed_gas_rows(results, test_ids, import_date, import_initials, import_notes, import_passed)
+                        elapsed = enqueue_rows(mixed_sheet, rows)
+                        st.success(f":white_check_mark: Imported {len(rows)} tests as {test_ids[0]} to {test_ids[-1]} "
+                                   f"(queued in {elapsed * 1000:.0f} ms)")
+                    except Exception as e:
+                        st.error(f":x: No tests were imported: {e}")
+
 st.subheader(":date: Last 7 Days of Mixed Gas Tests")
 try:
-    df = pd.DataFrame(mixed_sheet.get_all_records())
-    df["Mixed Gas Test Date"] = pd.to_datetime(df["Mixed Gas Test Date"], errors="coerce")
+    df = snapshot_frame(mixed_sheet, ["Mixed Gas Test Date"])
     recent = df[df["Mixed Gas Test Date"] >= datetime.today() - timedelta(days=7)]
     if not recent.empty:
         st.dataframe(recent)
@@ -159,3 +154,7 @@ try:
         st.info("No data in the last 7 days.")
 except Exception as e:
     st.error(f":x: Could not load recent data: {e}")
+
+# === UPLOAD QUEUE ===
+show_queue_status()
+show_render_cost()
@@ -1,13 +1,16 @@
 import streamlit as st
 import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import json
 from datetime import datetime, timedelta
+from gsheets import open_spreadsheet, get_worksheet, ensure_tabs
+from write_queue import enqueue_row, enqueue_rows, show_queue_status
+from api_trace import show_render_cost
+from sequences import peek_id, next_id
+from snapshots import snapshot_records
+from date_index import read_recent
+from dates import parse_dates
 
 # --- CONFIGURATION ---
 GOOGLE_SHEET_NAME = "R&D Data Form"
-GOOGLE_CREDENTIALS = json.loads(st.secrets["gcp_service_account"])
 
 # Tab Names
 TAB_MODULE = "Module Tbl"
@@ -26,52 +29,22 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- Google Sheet Functions ---
-def connect_google_sheet(sheet_name):
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(GOOGLE_CREDENTIALS, scope)
-    client = gspread.authorize(creds)
-    return client.open(sheet_name)
-
-@st.cache_resource(show_spinner=False)
-def cached_connect_google_sheet(sheet_name):
-    return connect_google_sheet(sheet_name)
-
-def get_or_create_tab(spreadsheet, tab_name, headers):
-    try:
-        worksheet = spreadsheet.worksheet(tab_name)
-        # Check headers. Only re-insert if misaligned.
-        first_row = worksheet.row_values(1)
-        if [h.strip() for h in first_row] != [h.strip() for h in headers]:
-            worksheet.insert_row(headers, 1)
-    except gspread.exceptions.WorksheetNotFound:
-        worksheet = spreadsheet.add_worksheet(title=tab_name, rows="1000", cols="50")
-        worksheet.insert_row(headers, 1)
-    return worksheet
-
-def get_col_values(sheet_name, col_index):
-    sheet = cached_connect_google_sheet(GOOGLE_SHEET_NAME)
-    worksheet = sheet.worksheet(sheet_name)
-    return worksheet.col_values(col_index)
-
 def get_all_records(sheet_name):
-    sheet = cached_connect_google_sheet(GOOGLE_SHEET_NAME)
-    worksheet = sheet.worksheet(sheet_name)
-    return worksheet.get_all_records()
+    sheet = open_spreadsheet(GOOGLE_SHEET_NAME)
+    worksheet = get_worksheet(sheet, sheet_name)
+    return snapshot_records(worksheet)
 
-def get_last_id(sheet_name, prefix):
-    records = get_col_values(sheet_name, 1)[1:]
-    nums = [int(r.split('-')[-1]) for r in records if r.startswith(prefix) and r.split('-')[-1].isdigit()]
-    next_num = max(nums) + 1 if nums else 1
-    return f"{prefix}-{str(next_num).zfill(3)}"
+def get_recent_records(sheet_name, date_col, days):
+    sheet = open_spreadsheet(GOOGLE_SHEET_NAME)
+    worksheet = get_worksheet(sheet, sheet_name)
+    return read_recent(worksheet, date_col, days)
 
 # --- Start Streamlit App ---
 st.title("🛠 Module Management Form")
 
-# --- Connect & Show Tabs (for debug!) ---
+# --- Connect ---
 try:
-    spreadsheet = cached_connect_google_sheet(GOOGLE_SHEET_NAME)
-    tab_names = [ws.title for ws in spreadsheet.worksheets()]
-    #st.info(f"Tabs found: {tab_names}")
+    spreadsheet = open_spreadsheet(GOOGLE_SHEET_NAME)
 except Exception as e:
     st.error(f"Failed to load sheet: {e}")
     st.stop()
@@ -86,9 +59,13 @@ LEAK_HEADERS = [
     "Leak Test ID", "Module ID", "Module Type", "End", "Leak Test Type", "Leak Location",
     "Repaired", "Operator Initials", "Notes", "Date/Time"
 ]
-module_sheet = get_or_create_tab(spreadsheet, TAB_MODULE, MODULE_HEADERS)
-leak_sheet = get_or_create_tab(spreadsheet, TAB_LEAK, LEAK_HEADERS)
-failure_sheet = get_or_create_tab(spreadsheet, TAB_FAILURES, FAILURE_HEADERS)
+# Check headers. Only re-insert if misaligned.
+tabs = ensure_tabs(spreadsheet, {
+    TAB_MODULE: MODULE_HEADERS, TAB_LEAK: LEAK_HEADERS, TAB_FAILURES: FAILURE_HEADERS,
+}, on_mismatch="insert")
+module_sheet = tabs[TAB_MODULE]
+leak_sheet = tabs[TAB_LEAK]
+failure_sheet = tabs[TAB_FAILURES]
 
 # --- Load DataFrames ---
 try:
@@ -116,13 +93,14 @@ else:
 # --- MODULE ENTRY FORM ---
 st.subheader("🔹 Module Entry")
 with st.form("module_entry_form", clear_on_submit=True):
-    module_id = get_last_id(TAB_MODULE, "MOD")
+    module_id = peek_id(module_sheet, "MOD")
     st.markdown(f"**Auto-generated Module ID:** `{module_id}`")
     module_type = st.selectbox("Module Type", ["Wound", "Mini"])
     label = st.text_input("Label (e.g. batch, serial #, etc.)")
     module_notes = st.text_area("Notes")
     if st.form_submit_button("🚀 Submit Module"):
-        module_sheet.append_row([module_id, module_type, label, module_notes])
+        module_id = next_id(module_sheet, "MOD")
+        enqueue_row(module_sheet, [module_id, module_type, label, module_notes])
         st.success(f"✅ Module {module_id} saved successfully!")
 
 # --- MODULE FAILURE FORM ---
@@ -131,7 +109,7 @@ st.subheader("🔹 Module Failure Entry")
 used_module_ids = set(failures_df["Module ID"].tolist()) if not failures_df.empty and "Module ID" in failures_df else set()
 unused_module_options = [opt for opt in module_options if opt.split(" / ")[0] not in used_module_ids]
 with st.form("failure_entry_form", clear_on_submit=True):
-    failure_id = get_last_id(TAB_FAILURES, "FAIL")
+    failure_id = peek_id(failure_sheet, "FAIL")
     st.markdown(f"**Auto-generated Failure ID:** `{failure_id}`")
     failure_module_fk = st.selectbox("Module ID (unique)", unused_module_options)
     description = st.text_area("Description of Failure")
@@ -153,7 +131,8 @@ with st.form("failure_entry_form", clear_on_submit=True):
             st.table(prev_details)
     if st.form_submit_button("🚨 Submit Failure Entry"):
         mod_id = failure_module_fk.split(' / ')[0]
-        failure_sheet.append_row([
+        failure_id = next_id(failure_sheet, "FAIL")
+        enqueue_row(failure_sheet, [
             failure_id, mod_id, description, autopsy, autopsy_notes,
             microscopy, microscopy_notes, failure_mode, operator_initials,
             str(failure_date), label_fail
@@ -162,7 +141,7 @@ with st.form("failure_entry_form", clear_on_submit=True):
 
 # --- LEAK TEST FORM ---
 st.subheader("🔹 Leak Test Entry")
-leak_id = get_last_id(TAB_LEAK, "LEAK")
+leak_id = peek_id(leak_sheet, "LEAK")
 st.markdown(f"**Auto-generated Leak Test ID:** `{leak_id}`")
 if "leak_points" not in st.session_state:
     st.session_state["leak_points"] = []
@@ -189,24 +168,28 @@ if st.session_state.leak_points:
         mod_id = module_selection.split(' / ')[0]
         mod_type = module_selection.split(' / ')[1] if len(module_selection.split(' / ')) > 1 else ""
         date_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        for point in st.session_state.leak_points:
-            leak_sheet.append_row([leak_id, mod_id, mod_type, point["End"], leak_test_type,
-                                   point["Leak Location"], point["Repaired"], operator_initials,
-                                   point["Notes"], date_now])
-        st.success(f"✅ Leak points saved under Leak ID {leak_id}")
-        st.session_state.leak_points = []
+        leak_id = next_id(leak_sheet, "LEAK")
+        rows = [[leak_id, mod_id, mod_type, point["End"], leak_test_type,
+                 point["Leak Location"], point["Repaired"], operator_initials,
+                 point["Notes"], date_now] for point in st.session_state.leak_points]
+        try:
+            elapsed = enqueue_rows(leak_sheet, rows)
+            st.success(f"✅ {len(rows)} leak points saved under Leak ID {leak_id} (queued in {elapsed * 1000:.0f} ms)")
+            st.session_state.leak_points = []
+        except Exception as e:
+            st.error(f"❌ No leak points were saved: {e}")
 
 # --- 30-DAYS DATA REVIEW ---
 st.subheader("📅 Records (Last 30 Days)")
 for tab_name, date_col in [(TAB_MODULE, None), (TAB_LEAK, "Date/Time"), (TAB_FAILURES, "Date")]:
     try:
-        df = pd.DataFrame(get_all_records(tab_name))
+        df = pd.DataFrame(get_recent_records(tab_name, date_col, 30) if date_col else get_all_records(tab_name))
         df.columns = [col.strip() for col in df.columns]
         if not df.empty:
             if date_col:
                 date_col_clean = date_col.strip()
                 if date_col_clean in df.columns:
-                    df[date_col_clean] = pd.to_datetime(df[date_col_clean], errors="coerce")
+                    df[date_col_clean] = parse_dates(df[date_col_clean])
                     df = df[df[date_col_clean].notna()]
                     df = df[df[date_col_clean].dt.date >= (datetime.now().date() - timedelta(days=30))]
                 else:
@@ -221,3 +204,7 @@ for tab_name, date_col in [(TAB_MODULE, None), (TAB_LEAK, "Date/Time"), (TAB_FAI
             st.info(f"No data found in `{tab_name}`.")
     except Exception as e:
         st.error(f"Error loading `{tab_name}`: {e}")
+
+# --- UPLOAD QUEUE ---
+show_queue_status()
+show_render_cost()
@@ -1,16 +1,18 @@
 import streamlit as st
 import pandas as pd
-import gspread
-import json
 from datetime import datetime, timedelta
-from oauth2client.service_account import ServiceAccountCredentials
+from gsheets import open_spreadsheet, ensure_tabs
+from write_queue import enqueue_rows, show_queue_status
+from api_trace import show_render_cost
+from sequences import peek_id, next_id, next_ids
+from module_index import module_label_index
+from dates import snapshot_frame
+from gas_calc import permeance, test_selectivity
+from instrument_import import PURE_COLUMNS, PURE_REQUIRED, read_export, missing_columns, map_modules, pure_gas_results, pure_gas_rows
 
 # --- CONFIG ---
 GOOGLE_SHEET_NAME = "R&D Data Form"
 TAB_PURE_GAS = "Pure Gas Test Tbl"
-TAB_MODULE = "Module Tbl"
-TAB_WOUND = "Wound Module Tbl"
-TAB_MINI = "Mini Module Tbl"
 
 # --- Prevent accidental submit on Enter ---
 st.markdown("""
@@ -23,63 +25,16 @@ st.markdown("""
     </script>
 """, unsafe_allow_html=True)
 
-# --- UTILS ---
-def connect_google_sheet(sheet_name):
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    json_key = json.loads(st.secrets["gcp_service_account"])
-    json_key["private_key"] = json_key["private_key"].replace("\\n", "\n")
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(json_key, scope)
-    return gspread.authorize(creds).open(sheet_name)
-
-def get_or_create_tab(sheet, name, headers):
-    try:
-        tab = sheet.worksheet(name)
-        if not tab.get_all_values():
-            tab.insert_row(headers, 1)
-    except gspread.exceptions.WorksheetNotFound:
-        tab = sheet.add_worksheet(title=name, rows="1000", cols="50")
-        tab.insert_row(headers, 1)
-    return tab
-
-def get_last_id(sheet, prefix):
-    ids = sheet.col_values(1)[1:]
-    nums = [int(i.split("-")[-1]) for i in ids if i.startswith(prefix)]
-    return f"{prefix}-{str(max(nums)+1).zfill(3)}" if nums else f"{prefix}-001"
-
-def compute_permeance(flow_mL_min, area_cm2, feed_psi, perm_psi):
-    if feed_psi == perm_psi or area_cm2 == 0:
-        return 0
-    dp_cmhg = (feed_psi - perm_psi) * 5.174
-    flow_mL_s = flow_mL_min / 60
-    return flow_mL_s / (area_cm2 * dp_cmhg)
-
 # --- SETUP ---
-sheet = connect_google_sheet(GOOGLE_SHEET_NAME)
-pure_sheet = get_or_create_tab(sheet, TAB_PURE_GAS, [
+sheet = open_spreadsheet(GOOGLE_SHEET_NAME)
+pure_sheet = ensure_tabs(sheet, {TAB_PURE_GAS: [
     "Pure Gas Test ID", "Test Date", "Module ID", "Module Type", "Display Module Label", "Gas",
     "Feed Pressure (psi)", "Perm Pressure (psi)", "Flow (mL/min)", "Operator Initials", "Notes",
     "Permeance", "Selectivity", "Passed (y/n)?"
-])
-
-module_df = pd.DataFrame(sheet.worksheet(TAB_MODULE).get_all_records())
-wound_df = pd.DataFrame(sheet.worksheet(TAB_WOUND).get_all_records())
-mini_df = pd.DataFrame(sheet.worksheet(TAB_MINI).get_all_records())
+]})[TAB_PURE_GAS]
 
 # --- DISPLAY LABELS ---
-def get_display_label(row):
-    mid = row["Module ID"]
-    mtype = row["Module Type"].strip().lower()
-    if mtype == "mini":
-        match = mini_df[mini_df["Module ID"] == mid]
-        label = match["Module Label"].values[0] if not match.empty else "—"
-    elif mtype == "wound":
-        match = wound_df[wound_df["Module ID (FK)"] == mid]
-        label = match["Wound Module ID"].values[0] if not match.empty else "—"
-    else:
-        label = "—"
-    return f"{mid} | {mtype.capitalize()} | {label}"
-
-module_df["Display"] = module_df.apply(get_display_label, axis=1)
+module_df = module_label_index(sheet)
 module_options = dict(zip(module_df["Display"], module_df["Module ID"]))
 
 # --- SESSION STATE FOR READINGS ---
@@ -107,7 +62,7 @@ You can enter multiple gas readings per module. Selectivity and pass/fail will b
 """, unsafe_allow_html=True)
 
 with st.form("pure_gas_test_form", clear_on_submit=False):
-    pg_id = get_last_id(pure_sheet, "PGT")
+    pg_id = peek_id(pure_sheet, "PGT")
     st.markdown(f"**Pure Gas Test ID:** `{pg_id}`")
     test_date = st.date_input("Test Date", datetime.today())
     module_display = st.selectbox("Select Module", list(module_options.keys()))
@@ -136,24 +91,18 @@ with st.form("pure_gas_test_form", clear_on_submit=False):
 
 # --- PREVIEW & SUBMIT LOGIC ---
 def calc_results():
-    co2_perm, n2_perm = None, None
-    rows = []
-    for r in st.session_state.readings:
-        perm = compute_permeance(r["Flow"], area_cm2, r["Feed"], r["Perm"])
-        if r["Gas"] == "CO2":
-            co2_perm = perm
-        if r["Gas"] == "N2":
-            n2_perm = perm
-        rows.append({
-            "Gas": r["Gas"],
-            "Feed Pressure (psi)": r["Feed"],
-            "Perm Pressure (psi)": r["Perm"],
-            "Flow (mL/min)": r["Flow"],
-            "Permeance": round(perm, 6)
-        })
-    selectivity = round(co2_perm / n2_perm, 6) if co2_perm and n2_perm else 0
-    passed = "Yes" if co2_perm and n2_perm else "No"
-    return rows, selectivity, passed
+    readings = st.session_state.readings
+    perms = permeance([r["Flow"] for r in readings], area_cm2,
+                      [r["Feed"] for r in readings], [r["Perm"] for r in readings])
+    selectivity, passed = test_selectivity([pg_id] * len(readings), [r["Gas"] for r in readings], perms)
+    rows = [{
+        "Gas": r["Gas"],
+        "Feed Pressure (psi)": r["Feed"],
+        "Perm Pressure (psi)": r["Perm"],
+        "Flow (mL/min)": r["Flow"],
+        "Permeance": round(float(perm), 6)
+    } for r, perm in zip(readings, perms)]
+    return rows, float(selectivity[0]) if len(readings) else 0, str(passed[0]) if len(readings) else "No"
 
 if preview or submit:
     calc_rows, selectivity, passed = calc_results()
@@ -164,13 +113,14 @@ if preview or submit:
 if submit:
     calc_rows, selectivity, passed = calc_results()
     try:
-        for i, r in enumerate(st.session_state.readings):
-            permeance = pd.DataFrame(calc_rows).iloc[i]["Permeance"]
-            pure_sheet.append_row([
-                pg_id, str(test_date), module_id, module_type, module_display, r["Gas"],
-                r["Feed"], r["Perm"], r["Flow"], initials, notes, permeance, selectivity, passed
-            ])
-        st.success(f"✅ Submitted {len(st.session_state.readings)} gas readings with selectivity: `{selectivity}` and Pass: {passed}")
+        pg_id = next_id(pure_sheet, "PGT")
+        rows = [
+            [pg_id, str(test_date), module_id, module_type, module_display, r["Gas"],
+             r["Feed"], r["Perm"], r["Flow"], initials, notes, calc["Permeance"], selectivity, passed]
+            for r, calc in zip(st.session_state.readings, calc_rows)
+        ]
+        elapsed = enqueue_rows(pure_sheet, rows)
+        st.success(f"✅ Submitted {len(rows)} gas readings as {pg_id} (queued in {elapsed * 1000:.0f} ms) with selectivity: `{selectivity}` and Pass: {passed}")
         # Just reset readings, then rerun to clear the form!
         st.session_state.readings = [
             {"Gas": "CO2", "Feed": 0.0, "Perm": 0.0, "Flow": 0.0},
@@ -178,13 +128,53 @@ if submit:
         ]
         st.rerun()   # <--- This works in latest Streamlit!
     except Exception as e:
-        st.error(f"❌ Failed to save entries: {e}")
+        st.error(f"❌ No readings were saved: {e}")
+
+# --- IMPORT FROM RIG FILE ---
+with st.expander("📂 Import readings from a rig export (CSV/XLSX)"):
+    st.caption("One reading per row with Module (ID or label), Gas, Feed/Perm Pressure (psi) and Flow (mL/min); "
+               "optional Test Date, Area (cm²) and Test columns. Readings of one module on one date (or one Test) "
+               "become one Pure Gas Test ID.")
+    rig_file = st.file_uploader("Rig export", type=["csv", "xlsx"], key="pg_rig_file")
+    import_date = st.date_input("Test Date (when the file has none)", datetime.today(), key="pg_import_date")
+    import_area = st.number_input("Module Area (cm²) (when the file has none)", min_value=0.001, format="%.3f", value=1.000, key="pg_import_area")
+    import_initials = st.text_input("Operator Initials", key="pg_import_initials")
+    import_notes = st.text_input("Notes", value="Imported from rig file", key="pg_import_notes")
+    if rig_file is not None:
+        try:
+            readings = read_export(rig_file, PURE_COLUMNS)
+        except Exception as e:
+            st.error(f"❌ Could not read {rig_file.name}: {e}")
+            readings = None
+        if readings is not None:
+            missing = missing_columns(readings, PURE_REQUIRED)
+            if missing:
+                st.error(f"❌ {rig_file.name} has no column for: {', '.join(missing)}")
+            else:
+                readings = map_modules(readings, module_df)
+                unmatched = readings[readings["Module ID"] == ""]
+                if not unmatched.empty:
+                    st.warning(f"⚠️ Skipping {len(unmatched)} readings with unknown modules: "
+                               f"{', '.join(sorted(unmatched['Module'].astype(str).unique())[:10])}")
+                results = pure_gas_results(readings[readings["Module ID"] != ""].reset_index(drop=True), import_area)
+                n_tests = int(results["_test"].nunique())
+                st.dataframe(results.drop(columns=["_test"]), hide_index=True)
+                st.markdown(f"**{len(results)} readings in {n_tests} tests**, "
+                            f"{int((results.groupby('_test')['Passed (y/n)?'].first() == 'Yes').sum())} passed.")
+                if n_tests and st.button(f"💾 Import {len(results)} readings", key="pg_import"):
+                    try:
+                        test_ids = next_ids(pure_sheet, "PGT", count=n_tests)
+                        rows = pure_gas_rows(results, test_ids, import_date, import_initials, import_notes)
+                        elapsed = enqueue_rows(pure_sheet, rows)
+                        st.success(f"✅ Imported {len(rows)} readings as {test_ids[0]} to {test_ids[-1]} "
+                                   f"(queued in {elapsed * 1000:.0f} ms)")
+                    except Exception as e:
+                        st.error(f"❌ No readings were imported: {e}")
 
 # --- LAST 7 DAYS ---
 st.subheader("📅 Last 7 Days of Pure Gas Tests")
 try:
-    pg_df = pd.DataFrame(pure_sheet.get_all_records())
-    pg_df["Test Date"] = pd.to_datetime(pg_df["Test Date"], errors="coerce")
+    pg_df = snapshot_frame(pure_sheet, ["Test Date"])
     recent = pg_df[pg_df["Test Date"] >= datetime.today() - timedelta(days=7)]
     if not recent.empty:
         st.dataframe(recent)
@@ -192,3 +182,7 @@ try:
         st.info("No entries in the last 7 days.")
 except Exception as e:
     st.error(f"❌ Failed to load 7-day data: {e}")
+
+# --- UPLOAD QUEUE ---
+show_queue_status()
+show_render_cost()
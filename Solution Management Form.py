@@ -1,10 +1,15 @@
 import streamlit as st
 import pandas as pd
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import json
 from datetime import datetime, timedelta
 import time
+from gsheets import open_spreadsheet, get_worksheet, ensure_tabs
+from write_queue import enqueue_row, enqueue_update, show_queue_status
+from api_trace import show_render_cost
+from sequences import peek_id, next_id
+from snapshots import snapshot_records
+from dates import parse_dates
+from solution_conc import concentration_graph, prep_index
 
 # --- Google Sheets Config ---
 SPREADSHEET_KEY = "1uPdUWiiwMdJCYJaxZ5TneFa9h6tbSrs327BVLT5GVPY"
@@ -21,18 +26,13 @@ COMBINED_HEADERS = [
     "Combined Date", "Initials", "Notes", "Date"
 ]
 
-@st.cache_resource(ttl=600)
 def connect_google_sheet(sheet_key):
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(
-        json.loads(st.secrets["gcp_service_account"]), scope)
-    client = gspread.authorize(creds)
-    return client.open_by_key(sheet_key)
+    return open_spreadsheet(key=sheet_key)
 
 def retry_open_worksheet(spreadsheet, tab_name, retries=3, wait=2):
     for i in range(retries):
         try:
-            return spreadsheet.worksheet(tab_name)
+            return get_worksheet(spreadsheet, tab_name)
         except gspread.exceptions.APIError as e:
             if i < retries - 1:
                 time.sleep(wait)
@@ -40,54 +40,19 @@ def retry_open_worksheet(spreadsheet, tab_name, retries=3, wait=2):
                 st.error(f":rotating_light: API Error while accessing tab {tab_name}: {str(e)}")
                 st.stop()
 
-def get_or_create_tab(spreadsheet, tab_name, headers):
-    try:
-        worksheet = retry_open_worksheet(spreadsheet, tab_name)
-    except gspread.exceptions.WorksheetNotFound:
-        worksheet = spreadsheet.add_worksheet(title=tab_name, rows="1000", cols=str(len(headers)))
-        worksheet.insert_row(headers, 1)
-        return worksheet
+def date_last(actual_headers, headers):
     # Ensure Date column is present and last
-    actual_headers = worksheet.row_values(1)
     if "Date" not in actual_headers:
-        actual_headers.append("Date")
-        worksheet.update('A1', [actual_headers])
-    elif actual_headers[-1] != "Date":
-        actual_headers = [h for h in actual_headers if h != "Date"] + ["Date"]
-        worksheet.update('A1', [actual_headers])
-    return worksheet
+        return actual_headers + ["Date"]
+    if actual_headers[-1] != "Date":
+        return [h for h in actual_headers if h != "Date"] + ["Date"]
+    return None
 
 @st.cache_data(ttl=120)
 def cached_get_all_records(sheet_key, tab_name):
     spreadsheet = connect_google_sheet(sheet_key)
     worksheet = retry_open_worksheet(spreadsheet, tab_name)
-    return worksheet.get_all_records()
-
-def get_last_id_from_records(records, id_prefix):
-    ids = set()
-    for r in records:
-        val = None
-        if isinstance(r, dict):
-            for k, v in r.items():
-                vstr = str(v).strip()
-                if vstr.startswith(id_prefix):
-                    val = vstr
-                    break
-        elif isinstance(r, str):
-            if r.startswith(id_prefix):
-                val = r.strip()
-        if val:
-            ids.add(val)
-    nums = []
-    for rid in ids:
-        try:
-            suffix = rid.split('-')[-1]
-            if suffix.isdigit():
-                nums.append(int(suffix))
-        except Exception:
-            continue
-    next_num = max(nums) + 1 if nums else 1
-    return f"{id_prefix}-{str(next_num).zfill(3)}"
+    return snapshot_records(worksheet)
 
 def safe_get(record, key, default=""):
     if isinstance(record, dict):
@@ -96,17 +61,6 @@ def safe_get(record, key, default=""):
                 return v
     return default
 
-def parse_date(date_val):
-    if isinstance(date_val, datetime):
-        return date_val
-    elif isinstance(date_val, str):
-        for fmt in ("%Y-%m-%d", "%m/%d/%Y", "%d-%m-%Y", "%Y/%m/%d"):
-            try:
-                return datetime.strptime(date_val.strip(), fmt)
-            except:
-                continue
-    return None
-
 def label_status(row):
     label = row["Solution ID"]
     if row.get("Expired", "No") == "Yes":
@@ -131,28 +85,18 @@ def display_table_with_date_filter(records, headers, table_title, date_col="Date
     # Clean up the Date column
     if "Date" in df.columns:
         df["Date"] = df["Date"].astype(str).replace("nan", "")
-    # Date filter setup
-    valid_dates = []
-    for idx, d in enumerate(df["Date"]):
-        parsed = parse_date(d)
-        if parsed:
-            valid_dates.append(parsed)
-    if valid_dates:
-        min_date = min(valid_dates).date()
-        max_date = max(valid_dates).date()
+    # Date filter setup; parsed once for both the range defaults and the filter
+    parsed = parse_dates(df["Date"])
+    if parsed.notna().any():
+        min_date = parsed.min().date()
+        max_date = parsed.max().date()
     else:
         today = datetime.today().date()
         min_date, max_date = today - timedelta(days=default_days), today
     filter_start, filter_end = st.date_input(f"Select {table_title} date range", (min_date, max_date), key=f"{table_title}_date_range")
     # Filtering rows with valid dates only
-    bool_index = []
-    for d in df["Date"]:
-        parsed = parse_date(d)
-        if parsed and filter_start <= parsed.date() <= filter_end:
-            bool_index.append(True)
-        else:
-            bool_index.append(False)
-    filtered = df[bool_index]
+    days = parsed.dt.normalize()
+    filtered = df[(days >= pd.Timestamp(filter_start)) & (days <= pd.Timestamp(filter_end))]
     if not filtered.empty:
         st.dataframe(filtered)
     else:
@@ -179,9 +123,14 @@ st.markdown("# 📄 Solution Management Form")
 st.markdown("Manage creation, preparation, and combination of solutions.")
 
 spreadsheet = connect_google_sheet(SPREADSHEET_KEY)
-solution_sheet = get_or_create_tab(spreadsheet, "Solution ID Tbl", SOLUTION_ID_HEADERS)
-prep_sheet = get_or_create_tab(spreadsheet, "Solution Prep Data Tbl", PREP_HEADERS)
-combined_sheet = get_or_create_tab(spreadsheet, "Combined Solution Tbl", COMBINED_HEADERS)
+tabs = ensure_tabs(spreadsheet, {
+    "Solution ID Tbl": SOLUTION_ID_HEADERS,
+    "Solution Prep Data Tbl": PREP_HEADERS,
+    "Combined Solution Tbl": COMBINED_HEADERS,
+}, on_mismatch=date_last)
+solution_sheet = tabs["Solution ID Tbl"]
+prep_sheet = tabs["Solution Prep Data Tbl"]
+combined_sheet = tabs["Combined Solution Tbl"]
 
 # -- Always load records FRESH, at this point --
 solution_records = cached_get_all_records(SPREADSHEET_KEY, "Solution ID Tbl")
@@ -201,27 +150,28 @@ with st.expander("View / Update Existing Solution IDs", expanded=False):
             expired_val = st.selectbox("Expired?", ["No", "Yes"], index=0 if df.at[idx,"Expired"]=="No" else 1, key="edit_expired")
             consumed_val = st.selectbox("Consumed?", ["No", "Yes"], index=0 if df.at[idx,"Consumed"]=="No" else 1, key="edit_consumed")
             if st.button("Update Status", key="update_status_btn"):
-                row_number = idx+2
-                solution_sheet.update(f"C{row_number}:D{row_number}", [[expired_val, consumed_val]])
+                # Expired/Consumed are columns C:D of the Solution ID row
+                enqueue_update(solution_sheet, to_edit, [expired_val, consumed_val], column=3)
                 st.cache_data.clear()
-                st.success("Status updated!")
+                st.success("Status update queued.")
                 st.rerun()
     else:
         st.info("No Solution IDs yet.")
 
 with st.form("solution_id_form", clear_on_submit=True):
-    next_id = get_last_id_from_records([rec["Solution ID"] for rec in solution_records], "SOL")
-    st.markdown(f"**Auto-generated Solution ID:** `{next_id}` _(will only be saved on submit)_")
+    new_solution_id = peek_id(solution_sheet, "SOL")
+    st.markdown(f"**Auto-generated Solution ID:** `{new_solution_id}` _(will only be saved on submit)_")
     solution_type = st.selectbox("Type", ['New', 'Combined'])
     expired = st.selectbox("Expired?", ['No', 'Yes'], index=0)
     consumed = st.selectbox("Consumed?", ['No', 'Yes'], index=0)
     sol_date = st.date_input("Solution ID Creation Date", value=datetime.today())
     submit_solution = st.form_submit_button("Submit New Solution ID")
     if submit_solution:
-        data = [next_id, solution_type, expired, consumed, "", sol_date.strftime("%Y-%m-%d")]
-        solution_sheet.append_row(data)
+        new_solution_id = next_id(solution_sheet, "SOL")
+        data = [new_solution_id, solution_type, expired, consumed, "", sol_date.strftime("%Y-%m-%d")]
+        enqueue_row(solution_sheet, data)
         st.cache_data.clear()
-        st.success(":white_check_mark: Solution ID saved!")
+        st.success(":white_check_mark: Solution ID queued for saving!")
         st.rerun()
 
 # Reload records after possible rerun
@@ -243,16 +193,14 @@ prep_valid_df = df_solution[
 prep_valid_ids = prep_valid_df["Solution ID"].tolist()
 
 selected_solution_fk = st.selectbox("Select Solution ID", options=prep_valid_ids, key="prep_solution_fk")
-prep_entries = prep_records
-existing_record = next((r for r in prep_entries if r.get("Solution ID (FK)", "") == selected_solution_fk), None)
+existing_record = prep_index(spreadsheet).latest(selected_solution_fk)
 if existing_record:
     st.info("⚠️ Existing prep entry found. Fields prefilled for update.")
 else:
     st.success("✅ No prep entry found. Enter new details.")
 
 with st.form("prep_data_form"):
-    all_prep_ids = [r.get("Solution Prep ID") for r in prep_entries if r.get("Solution Prep ID")]
-    prep_id = safe_get(existing_record, "Solution Prep ID", get_last_id_from_records(all_prep_ids, "PREP"))
+    prep_id = safe_get(existing_record, "Solution Prep ID", peek_id(prep_sheet, "PREP"))
     st.markdown(f"**Prep ID:** `{prep_id}`")
     desired_conc = st.number_input(
         "Desired Solution Concentration (%)",
@@ -301,6 +249,8 @@ with st.form("prep_data_form"):
     this_row_date = st.date_input("Date (Record Creation/Update)", value=datetime.today().date(), key="prep_row_date")
     submit_prep = st.form_submit_button("Submit/Update Prep Details")
     if submit_prep:
+        if not existing_record:
+            prep_id = next_id(prep_sheet, "PREP")
         data = [
             prep_id, selected_solution_fk, desired_conc, final_volume, solvent, solvent_lot,
             solvent_weight, polymer, polymer_conc, polymer_lot, polymer_weight, str(prep_date),
@@ -308,20 +258,16 @@ with st.form("prep_data_form"):
         ]
         try:
             if existing_record:
-                cell = prep_sheet.find(selected_solution_fk)
-                row_number = cell.row
-                prep_sheet.update(f"A{row_number}:Q{row_number}", [data])
-                sol_row = df_solution[df_solution["Solution ID"]==selected_solution_fk].index[0] + 2
-                solution_sheet.update(f"E{sol_row}", [[c_sol_conc_value]])
+                enqueue_update(prep_sheet, prep_id, data)
+                enqueue_update(solution_sheet, selected_solution_fk, [c_sol_conc_value], column=5)
                 st.cache_data.clear()
-                st.success(":white_check_mark: Prep Data updated! Dropdowns and tables updated.")
+                st.success(":white_check_mark: Prep Data update queued! Dropdowns and tables refresh once it is written.")
                 st.rerun()
             else:
-                prep_sheet.append_row(data)
-                sol_row = df_solution[df_solution["Solution ID"]==selected_solution_fk].index[0] + 2
-                solution_sheet.update(f"E{sol_row}", [[c_sol_conc_value]])
+                enqueue_row(prep_sheet, data)
+                enqueue_update(solution_sheet, selected_solution_fk, [c_sol_conc_value], column=5)
                 st.cache_data.clear()
-                st.success(":white_check_mark: Prep Data submitted! Dropdowns and tables updated.")
+                st.success(":white_check_mark: Prep Data queued! Dropdowns and tables refresh once it is written.")
                 st.rerun()
         except Exception as e:
             st.error(f":x: Error while writing to Google Sheet: {e}")
@@ -337,25 +283,20 @@ combined_records = cached_get_all_records(SPREADSHEET_KEY, "Combined Solution Tb
 st.markdown("---")
 st.markdown("## 🔹 Combined Solution Entry")
 
-combined_id = get_last_id_from_records(combined_records, "COMB")
+combined_id = peek_id(combined_sheet, "COMB")
 valid_comb_df = df_solution[
     (df_solution["Type"] == "Combined") &
     ((df_solution['Consumed'] == "No") | (df_solution['Expired'] == "No"))
 ]
 valid_comb_ids = valid_comb_df["Solution ID"].unique().tolist()
 
-solution_options = []
-sid_to_conc = {}
-for sid in valid_comb_ids:
-    preps = [p for p in prep_records if p.get("Solution ID (FK)", "") == sid]
-    c = 0.0
-    if preps:
-        preps = sorted(preps, key=lambda p: parse_date(p.get("Prep Date", "")) or datetime.min, reverse=True)
-        latest_prep = preps[0]
-        c = float(latest_prep.get("C-Solution Concentration", 0) or 0)
-    label = f"{sid} | Conc: {c:.4f}"
-    solution_options.append(label)
-    sid_to_conc[sid] = c
+# Earlier combinations can be combined again; the graph resolves them through their inputs
+conc_graph = concentration_graph(spreadsheet)
+input_ids = valid_comb_ids + [cid for cid in conc_graph.combination_ids() if cid not in valid_comb_ids]
+sid_to_conc = {sid: c or 0.0 for sid, c in conc_graph.concentrations(input_ids).items()}
+solution_options = [f"{sid} | Conc: {sid_to_conc[sid]:.4f}" for sid in input_ids]
+if conc_graph.cycles:
+    st.warning(f"⚠️ These combinations feed themselves and have no concentration: {', '.join(sorted(conc_graph.cycles))}")
 
 st.markdown(f"**Auto-generated Combined ID:** `{combined_id}`")
 with st.form("combined_solution_form", clear_on_submit=True):
@@ -382,13 +323,14 @@ with st.form("combined_solution_form", clear_on_submit=True):
     this_row_date = st.date_input("Date (Record Creation/Update)", value=datetime.today().date(), key="combined_row_date")
     submit_combined = st.form_submit_button("Submit Combined Solution Details")
     if submit_combined:
+        combined_id = next_id(combined_sheet, "COMB")
         data = [
             combined_id, sid_a, sid_b, solution_mass_a, solution_mass_b, combined_conc,
             str(combined_date), combined_initials, combined_notes, this_row_date.strftime("%Y-%m-%d")
         ]
-        combined_sheet.append_row(data)
+        enqueue_row(combined_sheet, data)
         st.cache_data.clear()
-        st.success(":white_check_mark: Combined Solution saved! Dropdowns and tables updated.")
+        st.success(":white_check_mark: Combined Solution queued! Dropdowns and tables refresh once it is written.")
         st.rerun()
 
 # ================= PREVIEW TABLES WITH DATE FILTERS =================
@@ -414,4 +356,6 @@ display_table_with_date_filter(
     "Combined Solution Data Table"
 )
 
-
+# ================= UPLOAD QUEUE =================
+show_queue_status()
+show_render_cost()
@@ -1,18 +1,20 @@
 import streamlit as st
 import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime
-import json
+from write_queue import show_queue_status
+from api_trace import show_render_cost
+from storage import open_table
 
 GOOGLE_SHEET_NAME = "R&D Data Form"
 TAB_SOLUTION_QC = "Solution QC Tbl"
+TAB_SOLUTION_ID = "Solution ID Tbl"
 
 QC_HEADERS = [
     "Solution QC ID", "Solution ID (FK)", "Test Date", "Dish Tare Mass (g)",
     "Initial Solution Mass (g)", "Final Dish Mass (g)", "Operator Initials",
     "Notes", "QC Date", "C-Percent Solids", "Status"
 ]
+SOLUTION_ID_HEADERS = ["Solution ID", "Type", "Expired", "Consumed", "C-Solution Conc", "Date"]
 
 st.markdown("""
     <script>
@@ -24,41 +26,16 @@ st.markdown("""
     </script>
 """, unsafe_allow_html=True)
 
-def connect_google_sheet(sheet_name):
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(
-        json.loads(st.secrets["gcp_service_account"]), scope)
-    client = gspread.authorize(creds)
-    return client.open(sheet_name)
-
-def get_or_create_tab(spreadsheet, tab_name, headers):
-    try:
-        worksheet = spreadsheet.worksheet(tab_name)
-        if worksheet.row_values(1) != headers:
-            worksheet.clear()
-            worksheet.insert_row(headers, 1)
-    except gspread.exceptions.WorksheetNotFound:
-        worksheet = spreadsheet.add_worksheet(title=tab_name, rows="1000", cols="50")
-        worksheet.insert_row(headers, 1)
-    return worksheet
-
-def get_existing_solution_ids(spreadsheet):
+def get_existing_solution_ids():
     try:
-        solution_sheet = spreadsheet.worksheet("Solution ID Tbl")
-        solution_ids = solution_sheet.col_values(1)[1:]
+        # Solution Management owns this tab; only read it here
+        solution_table = open_table(TAB_SOLUTION_ID, SOLUTION_ID_HEADERS, GOOGLE_SHEET_NAME, create=False)
+        solution_ids = [str(r["Solution ID"]) for r in solution_table.read_all() if r.get("Solution ID")]
         return solution_ids
     except Exception as e:
         st.error(f"Error fetching Solution IDs: {e}")
         return []
 
-def get_last_qc_id(worksheet):
-    records = worksheet.col_values(1)[1:]
-    if not records:
-        return "QC-001"
-    nums = [int(r.split('-')[-1]) for r in records if r.startswith("QC")]
-    next_num = max(nums) + 1 if nums else 1
-    return f"QC-{str(next_num).zfill(3)}"
-
 def disable_if_filled(val):
     try:
         # Any of: "", None, "None", "0", "0.0", "0.00", 0, 0.0 means NOT filled
@@ -88,11 +65,10 @@ def is_complete_qc_record(rec):
 
 st.title("🔬 Solution QC Form (Linked to Solution Management Form)")
 
-spreadsheet = connect_google_sheet(GOOGLE_SHEET_NAME)
-qc_sheet = get_or_create_tab(spreadsheet, TAB_SOLUTION_QC, QC_HEADERS)
+qc_table = open_table(TAB_SOLUTION_QC, QC_HEADERS, GOOGLE_SHEET_NAME)
 
-existing_solution_ids = get_existing_solution_ids(spreadsheet)
-qc_records = qc_sheet.get_all_records()
+existing_solution_ids = get_existing_solution_ids()
+qc_records = qc_table.read_all()
 
 # --- Select to Edit Incomplete ---
 pending_qc = [r for r in qc_records if r.get("Status", "").lower() != "completed"]
@@ -118,7 +94,7 @@ with st.form("solution_qc_form", clear_on_submit=False):
         solution_id_fk = selected_pending_qc["Solution ID (FK)"]
         st.info(f"Editing pending record: {qc_id}")
     else:
-        qc_id = get_last_qc_id(qc_sheet)
+        qc_id = qc_table.peek_id("QC")
         solution_id_fk = st.selectbox("Select Solution ID (FK)", existing_solution_ids) if existing_solution_ids else st.text_input("Solution ID (FK)")
 
     st.markdown(f"**Auto-generated QC ID:** `{qc_id}`")
@@ -184,12 +160,7 @@ with st.form("solution_qc_form", clear_on_submit=False):
 if submit_button:
     try:
         if edit_mode:
-            rownum = None
-            for i, rec in enumerate(qc_records):
-                if rec.get("Solution QC ID") == qc_id:
-                    rownum = i+2 # header is 1
-                    break
-            if not rownum:
+            if not any(rec.get("Solution QC ID") == qc_id for rec in qc_records):
                 st.error("Record not found for update!")
             else:
                 updated_row = [
@@ -211,10 +182,13 @@ if submit_button:
                 else:
                     updated_row[-1] = "Pending"
                     st.warning("Submitted but pending (incomplete for concentration calculation). You can revisit and fill the rest later.")
-                qc_sheet.update(f"A{rownum}:K{rownum}", [updated_row])
-                st.success("QC record updated successfully!")
-                st.rerun()
+                if qc_table.update_row(qc_id, updated_row):
+                    st.success("QC record updated successfully!")
+                    st.rerun()
+                else:
+                    st.error("Record not found for update!")
         else:
+            qc_id = qc_table.next_id("QC")
             row = [
                 qc_id, solution_id_fk, str(test_date), dish_tare_mass,
                 initial_solution_mass, final_dish_mass, operator_initials,
@@ -226,15 +200,15 @@ if submit_button:
             else:
                 row[-1] = "Pending"
                 st.warning("Submitted but pending (incomplete for concentration calculation). You can revisit and fill the rest later.")
-            qc_sheet.append_row(row)
-            st.success("QC record successfully saved!")
+            qc_table.append_rows([row])
+            st.success(f"QC record {qc_id} successfully saved!")
             st.rerun()
     except Exception as e:
         st.error(f"❌ Error saving/updating data: {e}")
 
 st.markdown("### 📝 Solution QC Records Table")
 try:
-    qc_records = qc_sheet.get_all_records()
+    qc_records = qc_table.read_all()
     if qc_records:
         df = pd.DataFrame(qc_records)
         def pending_note(row):
@@ -249,3 +223,7 @@ try:
         st.info("No QC data found yet.")
 except Exception as e:
     st.error(f"❌ Error loading QC data: {e}")
+
+# --- Upload queue status (sidebar) ---
+show_queue_status()
+show_render_cost()
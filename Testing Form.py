@@ -1,65 +1,34 @@
 import streamlit as st
 import pandas as pd
-import gspread
-import json
 from datetime import datetime, timedelta
-from oauth2client.service_account import ServiceAccountCredentials
+from gsheets import open_spreadsheet, ensure_tabs
+from write_queue import enqueue_rows, show_queue_status
+from api_trace import show_render_cost
+from sequences import peek_ids, next_ids
+from module_index import module_label_index
+from dates import snapshot_frame
 
 # -------- CONFIG --------
 GOOGLE_SHEET_NAME = "R&D Data Form"
 TAB_MODULE = "Module Tbl"
-TAB_WOUND = "Wound Module Tbl"
-TAB_MINI = "Mini Module Tbl"
 TAB_PRESSURE_TEST = "Pressure Test Tbl"
 
-# -------- CONNECTION --------
-def connect_google_sheet(sheet_name):
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(
-        json.loads(st.secrets["gcp_service_account"]), scope)
-    return gspread.authorize(creds).open(sheet_name)
-
-def get_or_create_tab(spreadsheet, tab_name, headers):
-    try:
-        worksheet = spreadsheet.worksheet(tab_name)
-        if not worksheet.get_all_values():
-            worksheet.insert_row(headers, 1)
-    except gspread.exceptions.WorksheetNotFound:
-        worksheet = spreadsheet.add_worksheet(title=tab_name, rows="1000", cols="50")
-        worksheet.insert_row(headers, 1)
-    return worksheet
-
-def get_last_id(worksheet, prefix):
-    records = worksheet.col_values(1)[1:]
-    nums = [int(r.split('-')[-1]) for r in records if r.startswith(prefix) and r.split('-')[-1].isdigit()]
-    return f"{prefix}-{str(max(nums)+1).zfill(3)}" if nums else f"{prefix}-001"
-
-def get_display_label(mid, mtype, wound_df, mini_df):
-    if mtype.lower() == "mini":
-        label = mini_df[mini_df["Module ID"] == mid]["Module Label"].values
-    elif mtype.lower() == "wound":
-        label = wound_df[wound_df["Module ID (FK)"] == mid]["Wound Module ID"].values
-    else:
-        label = []
-    return f"{mid} / {mtype} / {label[0] if label.size else '—'}"
-
 # -------- LOAD SHEETS --------
-sheet = connect_google_sheet(GOOGLE_SHEET_NAME)
-module_sheet = get_or_create_tab(sheet, TAB_MODULE, ["Module ID", "Module Type", "Notes"])
-wound_df = pd.DataFrame(sheet.worksheet(TAB_WOUND).get_all_records())
-mini_df = pd.DataFrame(sheet.worksheet(TAB_MINI).get_all_records())
-pressure_test_sheet = get_or_create_tab(sheet, TAB_PRESSURE_TEST, [
-    "Pressure Test ID", "Module ID", "Module Type", "Display Label", "Feed Pressure",
-    "Permeate Flow", "Pressure Test DateTime", "Operator Initials", "Notes", "Passed"
-])
-
-module_df = pd.DataFrame(module_sheet.get_all_records())
+sheet = open_spreadsheet(GOOGLE_SHEET_NAME)
+tabs = ensure_tabs(sheet, {
+    TAB_MODULE: ["Module ID", "Module Type", "Notes"],
+    TAB_PRESSURE_TEST: [
+        "Pressure Test ID", "Module ID", "Module Type", "Display Label", "Feed Pressure",
+        "Permeate Flow", "Pressure Test DateTime", "Operator Initials", "Notes", "Passed"
+    ],
+})
+module_sheet = tabs[TAB_MODULE]
+pressure_test_sheet = tabs[TAB_PRESSURE_TEST]
+
+module_df = module_label_index(sheet)
 if not module_df.empty:
-    module_df["Display"] = module_df.apply(
-        lambda row: get_display_label(row["Module ID"], row["Module Type"], wound_df, mini_df),
-        axis=1
-    )
-    module_options = dict(zip(module_df["Display"], module_df["Module ID"]))
+    display = module_df["Module ID"].astype(str) + " / " + module_df["Module Type"].astype(str) + " / " + module_df["Label"]
+    module_options = dict(zip(display, module_df["Module ID"]))
 else:
     module_options = {}
 
@@ -122,9 +91,7 @@ if not df_measure.empty:
     st.line_chart(df_measure, x="Feed Pressure", y="Permeate Flow", use_container_width=True)
 
 # --- Show which PKs will be used
-next_pt_id = get_last_id(pressure_test_sheet, "PT")
-next_num = int(next_pt_id.split('-')[-1])
-pk_list = [f"PT-{str(next_num + i).zfill(3)}" for i in range(num)]
+pk_list = peek_ids(pressure_test_sheet, "PT", num)
 st.info(f"Primary Key(s) that will be used: {', '.join(pk_list)}")
 
 # --- 3. Pass/Fail & Submit
@@ -136,26 +103,27 @@ if st.button("💾 Submit All (with above Pass/Fail)"):
         st.warning("Please select a Module.")
     else:
         try:
+            pk_list = next_ids(pressure_test_sheet, "PT", len(st.session_state["measures"]))
+            rows = []
             for i, row_data in enumerate(st.session_state["measures"]):
                 test_time = datetime.now().time()
                 test_dt = datetime.combine(test_date, test_time)
                 pt_id = pk_list[i]
-                row = [
+                rows.append([
                     pt_id, module_id, module_type, module_display,
                     row_data["Feed Pressure"], row_data["Permeate Flow"], str(test_dt),
                     operator_initials, notes, passed
-                ]
-                pressure_test_sheet.append_row(row)
-            st.success("✅ All pressure test entries saved successfully!")
+                ])
+            elapsed = enqueue_rows(pressure_test_sheet, rows)
+            st.success(f"✅ All {len(rows)} pressure test entries saved (queued in {elapsed * 1000:.0f} ms)!")
         except Exception as e:
-            st.error(f"❌ Error saving entries: {e}")
+            st.error(f"❌ No entries were saved: {e}")
 
 # -------- LAST 7 DAYS --------
 st.subheader("📅 Last 7 Days of Pressure Test Entries")
 try:
-    df = pd.DataFrame(pressure_test_sheet.get_all_records())
+    df = snapshot_frame(pressure_test_sheet, ["Pressure Test DateTime"])
     if not df.empty and "Pressure Test DateTime" in df.columns:
-        df["Pressure Test DateTime"] = pd.to_datetime(df["Pressure Test DateTime"], errors="coerce")
         df_last7 = df[df["Pressure Test DateTime"] >= datetime.now() - timedelta(days=7)]
         if not df_last7.empty:
             st.dataframe(df_last7)
@@ -165,3 +133,7 @@ try:
         st.info("No records found yet.")
 except Exception as e:
     st.error(f"❌ Could not load last 7-day records: {e}")
+
+# -------- UPLOAD QUEUE --------
+show_queue_status()
+show_render_cost()
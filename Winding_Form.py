@@ -1,15 +1,19 @@
 # Winding Form – Final Updated Version with Full Corrections
 
 import streamlit as st
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import json
 from datetime import datetime, timedelta
 import pandas as pd
+from gsheets import open_spreadsheet, ensure_tabs
+from write_queue import enqueue_row, enqueue_rows, show_queue_status
+from api_trace import show_render_cost
+from sequences import peek_id, peek_ids, next_id, next_ids
+from snapshots import snapshot_records
+from row_index import RowConflict, current_version, upsert_row
+from date_index import read_recent
+from dates import parse_dates
 
 # ----------------- CONFIG -----------------
 GOOGLE_SHEET_NAME = "R&D Data Form"
-GOOGLE_CREDENTIALS = json.loads(st.secrets["gcp_service_account"])
 
 TAB_MODULE = "Module Tbl"
 TAB_WIND_PROGRAM = "Wind Program Tbl"
@@ -18,41 +22,32 @@ TAB_WRAP_PER_MODULE = "Wrap per Module Tbl"
 TAB_SPOOLS_PER_WIND = "Spools per Wind Tbl"
 TAB_COATED_SPOOL = "Coated Spool Tbl"
 
-# ----------------- UTILS -----------------
-def connect_google_sheet(sheet_name):
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(GOOGLE_CREDENTIALS, scope)
-    client = gspread.authorize(creds)
-    return client.open(sheet_name)
-
-def get_or_create_tab(sheet, tab_name, headers):
-    for ws in sheet.worksheets():
-        if ws.title.strip().lower() == tab_name.strip().lower():
-            return ws
-    ws = sheet.add_worksheet(title=tab_name, rows="1000", cols="50")
-    ws.insert_row(headers, 1)
-    return ws
-
-def get_last_id(worksheet, prefix, start_at=72):
-    records = worksheet.col_values(1)[1:]
-    nums = [int(r.split('-')[-1]) for r in records if r.startswith(prefix) and r.split('-')[-1].isdigit()]
-    next_num = max(nums) + 1 if nums else start_at
-    return f"{prefix}-{str(next_num).zfill(3)}"
+# First sequence number for every Winding PK prefix (WP, WMOD, WRAP, SPW)
+ID_START_AT = 72
 
+# ----------------- UTILS -----------------
 def fetch_column_values(worksheet, col_index=1):
     return [v for v in worksheet.col_values(col_index)[1:] if v]
 
 # ----------------- CONNECT SHEETS -----------------
-sheet = connect_google_sheet(GOOGLE_SHEET_NAME)
-module_sheet = get_or_create_tab(sheet, TAB_MODULE, ["Module ID", "Module Type", "Notes"])
-wind_program_sheet = get_or_create_tab(sheet, TAB_WIND_PROGRAM, ["Wind Program ID", "Program Name", "Number of bundles / wind", "Number of fibers / ribbon", "Space between ribbons", "Wind Angle (deg)", "Active fiber length (inch)", "Total fiber length (inch)", "Active Area / fiber", "Number of layers", "Number of loops / layer", "C - Active area / layer", "Notes"])
-wound_module_sheet = get_or_create_tab(sheet, TAB_WOUND_MODULE, ["Wound Module ID", "Module ID (FK)", "Wind Program ID (FK)", "Operator Initials", "Notes", "MFG DB Wind ID", "MFG DB Potting ID", "MFG DB Mod ID", "Date"])
-wrap_sheet = get_or_create_tab(sheet, TAB_WRAP_PER_MODULE, ["WrapPerModule PK", "Module ID (FK)", "Wrap After Layer #", "Type of Wrap", "Notes", "Date"])
-spool_sheet = get_or_create_tab(sheet, TAB_SPOOLS_PER_WIND, ["SpoolPerWind PK", "MFG DB Wind ID (FK)", "Coated Spool ID", "Length Used", "Notes", "Date"])
-coated_spool_sheet = get_or_create_tab(sheet, TAB_COATED_SPOOL, ["CoatedSpool_ID", "UnCoatedSpool_ID"])
-
-module_df = pd.DataFrame(module_sheet.get_all_records())
-wound_module_df = pd.DataFrame(wound_module_sheet.get_all_records())
+sheet = open_spreadsheet(GOOGLE_SHEET_NAME)
+tabs = ensure_tabs(sheet, {
+    TAB_MODULE: ["Module ID", "Module Type", "Notes"],
+    TAB_WIND_PROGRAM: ["Wind Program ID", "Program Name", "Number of bundles / wind", "Number of fibers / ribbon", "Space between ribbons", "Wind Angle (deg)", "Active fiber length (inch)", "Total fiber length (inch)", "Active Area / fiber", "Number of layers", "Number of loops / layer", "C - Active area / layer", "Notes"],
+    TAB_WOUND_MODULE: ["Wound Module ID", "Module ID (FK)", "Wind Program ID (FK)", "Operator Initials", "Notes", "MFG DB Wind ID", "MFG DB Potting ID", "MFG DB Mod ID", "Date"],
+    TAB_WRAP_PER_MODULE: ["WrapPerModule PK", "Module ID (FK)", "Wrap After Layer #", "Type of Wrap", "Notes", "Date"],
+    TAB_SPOOLS_PER_WIND: ["SpoolPerWind PK", "MFG DB Wind ID (FK)", "Coated Spool ID", "Length Used", "Notes", "Date"],
+    TAB_COATED_SPOOL: ["CoatedSpool_ID", "UnCoatedSpool_ID"],
+})
+module_sheet = tabs[TAB_MODULE]
+wind_program_sheet = tabs[TAB_WIND_PROGRAM]
+wound_module_sheet = tabs[TAB_WOUND_MODULE]
+wrap_sheet = tabs[TAB_WRAP_PER_MODULE]
+spool_sheet = tabs[TAB_SPOOLS_PER_WIND]
+coated_spool_sheet = tabs[TAB_COATED_SPOOL]
+
+module_df = pd.DataFrame(snapshot_records(module_sheet))
+wound_module_df = pd.DataFrame(snapshot_records(wound_module_sheet))
 coated_spool_ids = fetch_column_values(coated_spool_sheet)
 wind_program_ids = fetch_column_values(wind_program_sheet)
 
@@ -69,15 +64,22 @@ col1, col2 = st.columns([2, 3])
 with col1:
     st.subheader("🌬️ Wind Program")
     selected_existing_wp_id = st.selectbox("Select Wind Program ID to View/Edit", [""] + wind_program_ids)
-    wind_program_data = pd.DataFrame(wind_program_sheet.get_all_records())
+    wind_program_data = pd.DataFrame(snapshot_records(wind_program_sheet))
     wp_prefill = None
     if selected_existing_wp_id:
         match = wind_program_data[wind_program_data["Wind Program ID"] == selected_existing_wp_id]
         if not match.empty:
             wp_prefill = match.iloc[0]
+    # (ID, row version) as the previous render showed it is what a save checks against;
+    # every render records what it shows, so a later visit starts from the current row
+    shown_wp_version = st.session_state.get("wp_edit_version")
+    st.session_state["wp_edit_version"] = (
+        (selected_existing_wp_id, current_version(wind_program_sheet, selected_existing_wp_id, "Wind Program ID"))
+        if wp_prefill is not None else None
+    )
 
     with st.form("wind_program_form", clear_on_submit=True):
-        wind_program_id = selected_existing_wp_id or get_last_id(wind_program_sheet, "WP")
+        wind_program_id = selected_existing_wp_id or peek_id(wind_program_sheet, "WP", start_at=ID_START_AT)
         st.markdown(f"**Wind Program ID:** `{wind_program_id}`")
         program_name = st.text_input("Program Name", value=wp_prefill["Program Name"] if wp_prefill is not None else "")
         bundles = st.number_input("Number of Bundles / Wind", min_value=0, step=1, value=int(wp_prefill["Number of bundles / wind"]) if wp_prefill is not None else 0)
@@ -92,21 +94,29 @@ with col1:
         area_layer = st.number_input("C - Active Area / Layer", min_value=0.0, value=float(wp_prefill["C - Active area / layer"]) if wp_prefill is not None else 0.0)
         notes = st.text_area("Notes", value=wp_prefill["Notes"] if wp_prefill is not None else "")
         if st.form_submit_button("💾 Save Wind Program"):
+            is_update = bool(selected_existing_wp_id) and selected_existing_wp_id in wind_program_data["Wind Program ID"].values
+            if not is_update:
+                wind_program_id = next_id(wind_program_sheet, "WP", start_at=ID_START_AT)
             new_entry = [wind_program_id, program_name, bundles, fibers_per_ribbon, spacing, wind_angle, active_length, total_length, active_area, layers, loops_per_layer, area_layer, notes]
-            if selected_existing_wp_id and selected_existing_wp_id in wind_program_data["Wind Program ID"].values:
-                idx = wind_program_data[wind_program_data["Wind Program ID"] == selected_existing_wp_id].index[0] + 2
-                wind_program_sheet.delete_rows(idx)
-                wind_program_sheet.insert_row(new_entry, idx)
-                st.success(f"✅ Wind Program `{wind_program_id}` updated.")
+            if is_update:
+                if shown_wp_version is not None and shown_wp_version[0] == selected_existing_wp_id:
+                    version = shown_wp_version[1]
+                else:
+                    version = st.session_state["wp_edit_version"][1]
+                try:
+                    upsert_row(wind_program_sheet, selected_existing_wp_id, new_entry, version=version, key_column="Wind Program ID")
+                    st.success(f"✅ Wind Program `{wind_program_id}` updated.")
+                except RowConflict as e:
+                    st.error(f"❌ Not saved: {e}. Reload the program and apply your changes again.")
             else:
-                wind_program_sheet.append_row(new_entry)
+                enqueue_row(wind_program_sheet, new_entry)
                 st.success(f"✅ Wind Program `{wind_program_id}` saved.")
 
 # ----------------- OTHER FORMS STACKED -----------------
 with col2:
     st.subheader("🧵 Wound Module")
     with st.form("wound_module_form", clear_on_submit=True):
-        wound_id = get_last_id(wound_module_sheet, "WMOD", start_at=72)
+        wound_id = peek_id(wound_module_sheet, "WMOD", start_at=ID_START_AT)
         st.markdown(f"Wound Module ID: `{wound_id}`")
         selected_module = st.selectbox("Module ID", module_options)
         wind_fk = st.selectbox("Wind Program ID", wind_ids)
@@ -118,7 +128,8 @@ with col2:
         entry_date = st.date_input("Date", value=datetime.today())
         if st.form_submit_button("💾 Save Wound Module"):
             module_fk = selected_module.split(" ")[0]
-            wound_module_sheet.append_row([wound_id, module_fk, wind_fk, operator, notes, mfg_wind, mfg_potting, mfg_mod, entry_date.strftime("%Y-%m-%d")])
+            wound_id = next_id(wound_module_sheet, "WMOD", start_at=ID_START_AT)
+            enqueue_row(wound_module_sheet, [wound_id, module_fk, wind_fk, operator, notes, mfg_wind, mfg_potting, mfg_mod, entry_date.strftime("%Y-%m-%d")])
             st.success(f"✅ Saved {wound_id}")
 
     # Wrap Per Module
@@ -126,7 +137,8 @@ with col2:
     if "wrap_entries" not in st.session_state:
         st.session_state.wrap_entries = []
     with st.form("wrap_form"):
-        wrap_id = get_last_id(wrap_sheet, "WRAP")
+        # Provisional PK for the preview; real PKs are reserved on "Submit All"
+        wrap_id = peek_ids(wrap_sheet, "WRAP", len(st.session_state.wrap_entries) + 1, start_at=ID_START_AT)[-1]
         st.markdown(f"Wrap PK: `{wrap_id}`")
         wrap_mod = st.selectbox("Module ID", module_options)
         after_layer = st.number_input("Wrap After Layer #", min_value=0)
@@ -138,17 +150,21 @@ with col2:
     if st.session_state.wrap_entries:
         st.dataframe(pd.DataFrame(st.session_state.wrap_entries, columns=["PK", "Mod", "Layer", "Type", "Notes", "Date"]))
         if st.button("💾 Submit All Wraps"):
-            for entry in st.session_state.wrap_entries:
-                wrap_sheet.append_row(entry)
-            st.success("✅ Wraps submitted")
-            st.session_state.wrap_entries.clear()
+            try:
+                wrap_ids = next_ids(wrap_sheet, "WRAP", len(st.session_state.wrap_entries), start_at=ID_START_AT)
+                rows = [[pk] + entry[1:] for pk, entry in zip(wrap_ids, st.session_state.wrap_entries)]
+                elapsed = enqueue_rows(wrap_sheet, rows)
+                st.success(f"✅ {len(st.session_state.wrap_entries)} wraps submitted (queued in {elapsed * 1000:.0f} ms)")
+                st.session_state.wrap_entries.clear()
+            except Exception as e:
+                st.error(f"❌ No wraps were saved: {e}")
 
     # Spools Per Wind
     st.subheader("🧪 Spools Per Wind")
     if "spool_entries" not in st.session_state:
         st.session_state.spool_entries = []
     with st.form("spool_form"):
-        spool_id = get_last_id(spool_sheet, "SPW")
+        spool_id = peek_ids(spool_sheet, "SPW", len(st.session_state.spool_entries) + 1, start_at=ID_START_AT)[-1]
         wind_fk = st.selectbox("Wind ID", wind_ids)
         coated_fk = st.selectbox("Coated Spool ID", coated_spool_ids)
         length = st.number_input("Length Used", min_value=0.0)
@@ -159,10 +175,14 @@ with col2:
     if st.session_state.spool_entries:
         st.dataframe(pd.DataFrame(st.session_state.spool_entries, columns=["ID", "Wind", "Spool", "Length", "Notes", "Date"]))
         if st.button("💾 Submit All Spools"):
-            for entry in st.session_state.spool_entries:
-                spool_sheet.append_row(entry)
-            st.success("✅ Spools submitted")
-            st.session_state.spool_entries.clear()
+            try:
+                spool_ids = next_ids(spool_sheet, "SPW", len(st.session_state.spool_entries), start_at=ID_START_AT)
+                rows = [[pk] + entry[1:] for pk, entry in zip(spool_ids, st.session_state.spool_entries)]
+                elapsed = enqueue_rows(spool_sheet, rows)
+                st.success(f"✅ {len(st.session_state.spool_entries)} spools submitted (queued in {elapsed * 1000:.0f} ms)")
+                st.session_state.spool_entries.clear()
+            except Exception as e:
+                st.error(f"❌ No spools were saved: {e}")
 
 # ------------------ 30-DAY DATA REVIEW ------------------
 st.subheader("📅 Recent Entries (Last 30 Days)")
@@ -174,14 +194,18 @@ review_tabs = {
     "Spools per Wind Tbl": spool_sheet,
 }
 for label, ws in review_tabs.items():
-    df = pd.DataFrame(ws.get_all_records())
+    df = pd.DataFrame(read_recent(ws, "Date", 30))
     df.columns = [c.strip() for c in df.columns]
     st.markdown(f"### {label}")
     if "Date" in df.columns:
-        df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
+        df["Date"] = parse_dates(df["Date"])
         df = df[df["Date"].notna()]
         df = df[df["Date"].dt.date >= (datetime.now().date() - timedelta(days=30))]
     if df.empty:
         st.info("No recent data.")
     else:
         st.dataframe(df)
+
+# ------------------ UPLOAD QUEUE ------------------
+show_queue_status()
+show_render_cost()
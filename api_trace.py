@@ -0,0 +1,207 @@
+# Sheets API call accounting.
+#
+# install() wraps the gspread Client, Spreadsheet and Worksheet methods that
+# talk to Google. Each outermost call (get_all_records calling get_values
+# calling values_get counts once) is recorded with its tab, the rows and cells
+# it read or wrote, the approximate payload size and its latency. Calls made
+# by a Streamlit script are charged to that browser session and listed by
+# show_render_cost(); calls from background threads (the write-queue flusher,
+# headless jobs) are charged to "background". Every call is also appended to a
+# JSON-lines trace, which `python api_trace.py` ranks by page.
+#
+#     python api_trace.py                      # worst pages in the default trace
+#     python api_trace.py /tmp/trace.jsonl     # ... in another trace file
+
+import argparse
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import gspread
+import pandas as pd
+import streamlit as st
+
+import rate_limit
+
+TRACE_PATH = os.environ.get("RD_API_TRACE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sheets_api_trace.jsonl"))
+
+# Methods that issue (or may issue) an HTTP request
+METHODS = {
+    gspread.Client: ["open", "open_by_key", "open_by_url", "openall"],
+    gspread.Spreadsheet: [
+        "fetch_sheet_metadata", "worksheets", "worksheet", "add_worksheet", "del_worksheet", "batch_update",
+        "values_get", "values_batch_get", "values_update", "values_append", "values_clear", "values_batch_update",
+    ],
+    gspread.Worksheet: [
+        "get", "batch_get", "get_values", "get_all_values", "get_all_records", "row_values", "col_values",
+        "acell", "cell", "find", "findall", "update", "batch_update", "update_cell", "update_acell",
+        "append_row", "append_rows", "insert_row", "insert_rows", "delete_rows", "clear", "batch_clear",
+        "resize", "add_rows",
+    ],
+}
+
+_lock = threading.Lock()
+_local = threading.local()
+_installed = False
+_calls = defaultdict(list)   # session id -> calls not yet shown in a panel
+
+
+def _context():
+    """(session id, page) of the Streamlit script running on this thread, or ("background", "")."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+    except Exception:
+        ctx = None
+    if ctx is None:
+        return "background", ""
+    return ctx.session_id, os.path.basename(getattr(ctx, "main_script_path", "") or "")
+
+
+def _shape(value):
+    """(rows, cells) of a list of rows, a list of records or a batch of {"values": ...} blocks."""
+    if isinstance(value, dict):
+        value = value.get("values", value.get("valueRanges", []))
+    if not isinstance(value, (list, tuple)) or not value:
+        return 0, 0
+    if all(isinstance(item, dict) and "values" in item for item in value):
+        shapes = [_shape(item["values"]) for item in value]
+        return sum(r for r, _ in shapes), sum(c for _, c in shapes)
+    if isinstance(value[0], dict):
+        return len(value), sum(len(item) for item in value)
+    if isinstance(value[0], (list, tuple)):
+        return len(value), sum(len(row) for row in value)
+    return 1, len(value)
+
+
+def _size(value):
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _payload(args, kwargs, result):
+    """The values a call moved: what it sent for writes, what it got back for reads."""
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, (list, tuple)) and value and isinstance(value[0], (list, tuple, dict)):
+            return value
+    return result
+
+
+def _record(entry):
+    with _lock:
+        if entry["session"] != "background":
+            _calls[entry["session"]].append(entry)
+        if TRACE_PATH:
+            try:
+                with open(TRACE_PATH, "a", encoding="utf-8") as trace:
+                    trace.write(json.dumps(entry) + "\n")
+            except OSError:
+                pass
+
+
+def _wrap(cls, name, method):
+    @functools.wraps(method)
+    def traced(self, *args, **kwargs):
+        depth = getattr(_local, "depth", 0)
+        if depth:
+            return method(self, *args, **kwargs)
+        _local.depth = 1
+        started = time.perf_counter()
+        error = ""
+        result = None
+        try:
+            result = method(self, *args, **kwargs)
+            return result
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _local.depth = 0
+            elapsed = time.perf_counter() - started
+            payload = _payload(args, kwargs, result)
+            rows, cells = _shape(payload)
+            session, page = _context()
+            _record({
+                "ts": time.time(), "session": session, "page": page, "call": f"{cls.__name__}.{name}",
+                "tab": str(getattr(self, "title", "") if not isinstance(self, gspread.Client) else ""),
+                "rows": rows, "cells": cells, "bytes": _size(payload), "ms": round(elapsed * 1000, 1),
+                "error": error,
+            })
+
+    traced.__wrapped_for_trace__ = True
+    return traced
+
+
+def install():
+    """Wrap the gspread methods once per process."""
+    global _installed
+    with _lock:
+        if _installed:
+            return
+        for cls, names in METHODS.items():
+            for name in names:
+                method = getattr(cls, name, None)
+                if method is not None and not getattr(method, "__wrapped_for_trace__", False):
+                    setattr(cls, name, _wrap(cls, name, method))
+        _installed = True
+
+
+def take_calls(session=None):
+    """Calls charged to a session since the last take, oldest first."""
+    if session is None:
+        session = _context()[0]
+    with _lock:
+        return _calls.pop(session, [])
+
+
+def show_render_cost():
+    """Sidebar panel with the Sheets API calls made since the previous panel (this render and any reruns it caused)."""
+    calls = take_calls()
+    total_ms = sum(c["ms"] for c in calls)
+    with st.sidebar.expander(f"💸 Cost of this render ({len(calls)} API calls, {total_ms / 1000:.2f} s)"):
+        st.caption("Per-minute API budget of this server process")
+        st.dataframe(pd.DataFrame(rate_limit.metrics()), hide_index=True)
+        if not calls:
+            st.caption("No Sheets API calls; everything came from caches.")
+            return
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Calls", len(calls))
+        col2.metric("Cells", sum(c["cells"] for c in calls))
+        col3.metric("KB", f"{sum(c['bytes'] for c in calls) / 1024:.1f}")
+        st.dataframe(pd.DataFrame([
+            {"Call": c["call"], "Tab": c["tab"], "Rows": c["rows"], "Cells": c["cells"], "Bytes": c["bytes"],
+             "ms": c["ms"], "Error": c["error"]}
+            for c in calls
+        ]), hide_index=True)
+
+
+def rank_pages(path=TRACE_PATH):
+    """Per page: sessions, calls, cells, bytes and seconds spent in the Sheets API, worst first."""
+    with open(path, encoding="utf-8") as trace:
+        df = pd.DataFrame([json.loads(line) for line in trace if line.strip()])
+    if df.empty:
+        return df
+    df["page"] = df["page"].replace("", "(background)")
+    ranked = df.groupby("page").agg(
+        sessions=("session", "nunique"), calls=("call", "size"), cells=("cells", "sum"),
+        bytes=("bytes", "sum"), seconds=("ms", lambda ms: ms.sum() / 1000), errors=("error", lambda e: (e != "").sum()),
+    )
+    ranked["calls_per_session"] = ranked["calls"] / ranked["sessions"]
+    return ranked.sort_values("seconds", ascending=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank pages by the Sheets API time recorded in a trace.")
+    parser.add_argument("path", nargs="?", default=TRACE_PATH, help="JSON-lines trace (default: %(default)s)")
+    args = parser.parse_args()
+    ranked = rank_pages(args.path)
+    print("No calls recorded." if ranked.empty else ranked.to_string(float_format=lambda v: f"{v:.2f}"))
+
+
+if __name__ == "__main__":
+    main()
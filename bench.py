@@ -0,0 +1,546 @@
+# Render-time benchmark of the forms against an in-memory Google Sheets.
+#
+#     python bench.py                                   # every form, 1k / 10k / 100k rows
+#     python bench.py --page "Winding_Form.py" --rows 1000 --rows 10000
+#     python bench.py --csv /tmp/bench.csv              # also save the table
+#
+# Each form script is run headlessly with Streamlit's AppTest. gsheets hands it
+# a fake client instead of the authorized one: FakeClient / FakeSpreadsheet /
+# FakeWorksheet implement the subset of gspread the forms and shared modules
+# call, keep every tab as a list of rows and count each call that would have
+# been a Sheets API request.
+#
+# The tabs and their headers are not listed here: a discovery pass runs every
+# form against empty workbooks (then against a few seeded rows, so pages that
+# read other forms' tabs get further) and records what they create. For each
+# size, every tab a page touches is then filled with that many synthetic rows:
+# IDs in the first column, foreign keys drawn from the referenced tab, dates
+# rising towards today, a few known categorical columns and numbers elsewhere.
+#
+# Every page is measured cold (in a fresh process, so no module-level index,
+# memo or allocator survives from an earlier page) and warm (a rerun of the
+# same session): wall time, API calls and peak Python memory
+# (tracemalloc) of the render. tracemalloc slows Python down severalfold; pass
+# --no-memory for wall times comparable with a real server.
+
+import argparse
+import functools
+import glob
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+
+# Processes a run spawns (loadtest.py's sessions) inherit the scratch directory, so they share one journal
+_scratch = os.environ.get("RD_BENCH_SCRATCH") or tempfile.mkdtemp(prefix="rd_bench_")
+os.environ["RD_BENCH_SCRATCH"] = _scratch
+# The write queue and the API trace must not touch the real files
+os.environ["RD_WRITE_QUEUE_PATH"] = os.path.join(_scratch, "write_queue.sqlite3")
+os.environ["RD_API_TRACE_PATH"] = ""
+
+import gspread  # noqa: E402
+import pandas as pd  # noqa: E402
+import streamlit as st  # noqa: E402
+from gspread.cell import Cell  # noqa: E402
+from gspread.utils import a1_range_to_grid_range, a1_to_rowcol, numericise_all, to_records  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import gsheets  # noqa: E402
+import snapshots  # noqa: E402
+from sequences import format_id  # noqa: E402
+
+# AppTest leaves the last page it ran in sys.modules["__main__"]; spawned processes need the real one back
+_MAIN = sys.modules["__main__"]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SIZES = [1_000, 10_000, 100_000]
+DISCOVERY_ROWS = 20
+DISCOVERY_PASSES = 3
+RUN_TIMEOUT = 1800
+
+# Columns whose values the forms filter or branch on
+CATEGORIES = {
+    "module type": ["Mini", "Wound"],
+    "type": ["New", "Combined"],
+    "gas": ["CO2", "N2"],
+    "expired": ["No", "Yes"],
+    "consumed": ["No", "Yes"],
+    "status": ["Pending", "Completed"],
+    "end": ["Plug", "Nozzle"],
+}
+
+
+def form_pages():
+    """Every Streamlit form in the repository: the scripts that draw the render-cost panel at top level."""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(HERE, "*.py"))):
+        with open(path, encoding="utf-8") as f:
+            if any(line.startswith("show_render_cost()") for line in f):
+                pages.append(os.path.basename(path))
+    return pages
+
+
+# --- FAKE GSPREAD ---
+def _api(method):
+    """Count the call as one Sheets API request and run it atomically, after the client's simulated latency."""
+    @functools.wraps(method)
+    def call(self, *args, **kwargs):
+        client = self.client
+        if client.latency:
+            time.sleep(client.latency)
+        with client.lock:
+            client.count(method.__name__)
+            if isinstance(self, FakeWorksheet):
+                client.touched.add((self.spreadsheet.source, self.title))
+            return method(self, *args, **kwargs)
+
+    return call
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, sheet_id, title, rows=None):
+        self.spreadsheet = spreadsheet
+        self.client = spreadsheet.client
+        self.id = sheet_id
+        self.title = title
+        # Rows may be shared with other workbooks of the run; writes replace rows instead of mutating them
+        self._rows = list(rows or [])
+
+    @property
+    def row_count(self):
+        return max(1000, len(self._rows))
+
+    @property
+    def col_count(self):
+        return max([26] + [len(row) for row in self._rows[:1]])
+
+    # --- reads ---
+    def _block(self, range_name):
+        grid = a1_range_to_grid_range(range_name)
+        r0, r1 = grid.get("startRowIndex", 0), grid.get("endRowIndex", len(self._rows))
+        c0, c1 = grid.get("startColumnIndex", 0), grid.get("endColumnIndex")
+        block = [_trimmed(row[c0:c1]) for row in self._rows[r0:r1]]
+        while block and not block[-1]:
+            block.pop()
+        return block
+
+    @_api
+    def get_all_values(self, *args, **kwargs):
+        width = max((len(row) for row in self._rows), default=0)
+        return [row + [""] * (width - len(row)) for row in self._rows]
+
+    def get_values(self, range_name=None, *args, **kwargs):
+        if range_name is None:
+            return self.get_all_values()
+        return self.get(range_name)
+
+    @_api
+    def get_all_records(self, head=1, numericise_ignore=None, *args, **kwargs):
+        if len(self._rows) < head:
+            return []
+        width = max((len(row) for row in self._rows), default=0)
+        values = [row + [""] * (width - len(row)) for row in self._rows[head - 1:]]
+        return to_records(values[0], [numericise_all(row) for row in values[1:]])
+
+    @_api
+    def get(self, range_name=None, *args, **kwargs):
+        return self._block(range_name) if range_name else [list(row) for row in self._rows]
+
+    @_api
+    def batch_get(self, ranges, *args, **kwargs):
+        return [self._block(r) for r in ranges]
+
+    @_api
+    def row_values(self, row, *args, **kwargs):
+        return _trimmed(self._rows[row - 1]) if row <= len(self._rows) else []
+
+    @_api
+    def col_values(self, col, *args, **kwargs):
+        return _trimmed([row[col - 1] if col <= len(row) else "" for row in self._rows])
+
+    @_api
+    def acell(self, label, *args, **kwargs):
+        row, col = a1_to_rowcol(label)
+        return Cell(row, col, self._value(row, col))
+
+    @_api
+    def find(self, query, in_row=None, in_column=None, *args, **kwargs):
+        for r, row in enumerate(self._rows, start=1):
+            if in_row is not None and r != in_row:
+                continue
+            for c, value in enumerate(row, start=1):
+                if (in_column is None or c == in_column) and value == str(query):
+                    return Cell(r, c, value)
+        return None
+
+    def _value(self, row, col):
+        if row <= len(self._rows) and col <= len(self._rows[row - 1]):
+            return self._rows[row - 1][col - 1]
+        return ""
+
+    # --- writes ---
+    def _write(self, range_name, values):
+        grid = a1_range_to_grid_range(range_name)
+        r0, c0 = grid.get("startRowIndex", 0), grid.get("startColumnIndex", 0)
+        for i, new in enumerate(values):
+            while len(self._rows) <= r0 + i:
+                self._rows.append([])
+            row = list(self._rows[r0 + i])
+            row.extend([""] * (c0 + len(new) - len(row)))
+            row[c0:c0 + len(new)] = [_cell(v) for v in new]
+            self._rows[r0 + i] = row
+
+    @_api
+    def update(self, values=None, range_name=None, *args, **kwargs):
+        if isinstance(values, str):
+            # The pre-6.0 argument order, update("A1", [[...]])
+            values, range_name = range_name, values
+        self._write(range_name or "A1", values)
+
+    @_api
+    def batch_update(self, data, *args, **kwargs):
+        for block in data:
+            self._write(block["range"], block["values"])
+
+    @_api
+    def update_cell(self, row, col, value):
+        self._write(gspread.utils.rowcol_to_a1(row, col), [[value]])
+
+    @_api
+    def append_row(self, values, *args, **kwargs):
+        self._rows.append([_cell(v) for v in values])
+
+    @_api
+    def append_rows(self, values, *args, **kwargs):
+        self._rows.extend([_cell(v) for v in row] for row in values)
+
+    @_api
+    def insert_row(self, values, index=1, *args, **kwargs):
+        self._rows.insert(index - 1, [_cell(v) for v in values])
+
+    @_api
+    def insert_rows(self, values, row=1, *args, **kwargs):
+        self._rows[row - 1:row - 1] = [[_cell(v) for v in r] for r in values]
+
+    @_api
+    def delete_rows(self, start_index, end_index=None):
+        del self._rows[start_index - 1:(end_index or start_index)]
+
+    @_api
+    def clear(self):
+        self._rows = []
+
+    @_api
+    def resize(self, rows=None, cols=None):
+        pass
+
+    @_api
+    def add_rows(self, rows):
+        pass
+
+
+class FakeSpreadsheet:
+    def __init__(self, client, source, seed=None):
+        self.client = client
+        self.source = source
+        self.id = f"{client.tag}:{source}"
+        self.title = source.split(":", 1)[1]
+        self.url = f"https://docs.google.com/spreadsheets/d/{self.id}"
+        self._sheets = []
+        for title, rows in (seed or {}).items():
+            self._new(title, rows)
+
+    def _new(self, title, rows=None):
+        worksheet = FakeWorksheet(self, len(self._sheets), title, rows)
+        self._sheets.append(worksheet)
+        return worksheet
+
+    @property
+    def sheet1(self):
+        return self._sheets[0] if self._sheets else self.add_worksheet("Sheet1", 1000, 26)
+
+    @_api
+    def worksheets(self, *args, **kwargs):
+        return list(self._sheets)
+
+    @_api
+    def worksheet(self, title):
+        for worksheet in self._sheets:
+            if worksheet.title == title:
+                return worksheet
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    @_api
+    def add_worksheet(self, title, rows=1000, cols=26, *args, **kwargs):
+        return self._new(title)
+
+    def _tab(self, range_name):
+        title, _, cells = range_name.rpartition("!")
+        if title.startswith("'") and title.endswith("'"):
+            title = title[1:-1].replace("''", "'")
+        for worksheet in self._sheets:
+            if worksheet.title == title:
+                return worksheet, cells
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    @_api
+    def batch_update(self, body):
+        # The structural requests the schema bootstrap sends
+        for request in body["requests"]:
+            if "addSheet" in request:
+                self._new(request["addSheet"]["properties"]["title"])
+            elif "insertDimension" in request:
+                span = request["insertDimension"]["range"]
+                worksheet = next(w for w in self._sheets if w.id == span["sheetId"])
+                worksheet._rows[span["startIndex"]:span["startIndex"]] = [[] for _ in range(span["endIndex"] - span["startIndex"])]
+        return {"replies": [{} for _ in body["requests"]]}
+
+    @_api
+    def values_batch_get(self, ranges, params=None):
+        blocks = []
+        for range_name in ranges:
+            worksheet, cells = self._tab(range_name)
+            blocks.append({"range": range_name, "values": worksheet._block(cells)})
+        return {"valueRanges": blocks}
+
+    @_api
+    def values_batch_update(self, body=None):
+        for block in body["data"]:
+            worksheet, cells = self._tab(block["range"])
+            worksheet._write(cells, block["values"])
+        return {"totalUpdatedRows": len(body["data"])}
+
+    def tabs(self):
+        """{title: rows} as the workbook holds them now."""
+        return {worksheet.title: worksheet._rows for worksheet in self._sheets}
+
+
+class _FakeHTTPClient:
+    def login(self):
+        pass
+
+
+class FakeClient:
+    """Stand-in for an authorized gspread.Client; `seeds` maps "name:...", "key:..." or "url:..." to {title: rows}.
+
+    Calls are serialized by one lock, so sessions on several threads can share
+    it; `latency` seconds are slept before each call, outside the lock.
+    """
+
+    _tags = itertools.count()
+
+    def __init__(self, seeds=None, latency=0.0):
+        self.tag = f"bench{next(self._tags)}"
+        self.seeds = seeds or {}
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.expiry = datetime.utcnow() + timedelta(days=365)
+        self.http_client = _FakeHTTPClient()
+        self.books = {}
+        self.calls = Counter()
+        self.touched = set()   # (source, title) of every tab read or written
+
+    @property
+    def client(self):
+        return self
+
+    def count(self, call):
+        self.calls[call] += 1
+
+    def _book(self, source):
+        if source not in self.books:
+            self.books[source] = FakeSpreadsheet(self, source, self.seeds.get(source))
+        return self.books[source]
+
+    @_api
+    def open(self, title, *args, **kwargs):
+        return self._book(f"name:{title}")
+
+    @_api
+    def open_by_key(self, key):
+        # The write-queue flusher reopens workbooks by the id the forms' handles reported
+        for book in self.books.values():
+            if book.id == key:
+                return book
+        return self._book(f"key:{key}")
+
+    @_api
+    def open_by_url(self, url):
+        return self._book(f"url:{url}")
+
+    def total(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+
+def _cell(value):
+    return "" if value is None else str(value)
+
+
+def _trimmed(row):
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+# --- SYNTHETIC DATA ---
+def _is_date(header):
+    name = header.lower()
+    return "date" in name or name.endswith(" time") or name == "timestamp"
+
+
+def synthetic_rows(schema, tabs, n):
+    """{(source, title): rows} for `tabs`, each header plus `n` generated rows."""
+    rng = random.Random(n)
+    keys = {}
+    for source, title in schema:
+        header = schema[(source, title)]
+        prefix = "".join(word[0] for word in title.split() if word[0].isalnum()).upper()[:4] or "ID"
+        keys[header[0].strip()] = [format_id(prefix, i) for i in range(1, n + 1)]
+    start = datetime.now() - timedelta(days=2 * 365)
+    step = timedelta(days=2 * 365) / max(n, 1)
+    seeded = {}
+    for tab in tabs:
+        header = schema[tab]
+        columns = []
+        for i, name in enumerate(h.strip() for h in header):
+            if i == 0:
+                columns.append(keys[name])
+            elif name in keys:
+                pool = keys[name]
+                columns.append([pool[rng.randrange(len(pool))] for _ in range(n)])
+            elif _is_date(name):
+                columns.append([(start + step * j).strftime("%Y-%m-%d") for j in range(n)])
+            elif name.lower() in CATEGORIES:
+                choices = CATEGORIES[name.lower()]
+                columns.append([choices[j % len(choices)] for j in range(n)])
+            elif "id" in name.lower().split() or name.lower().endswith("(fk)"):
+                columns.append([format_id("X", rng.randrange(1, n + 1)) for _ in range(n)])
+            elif "initials" in name.lower() or "operator" in name.lower():
+                columns.append(["AB"] * n)
+            elif "note" in name.lower() or "label" in name.lower() or "name" in name.lower():
+                columns.append([f"{name} {j}" for j in range(n)])
+            else:
+                columns.append([f"{rng.uniform(0, 100):.3f}" for _ in range(n)])
+        seeded[tab] = [list(header)] + [list(row) for row in zip(*columns)]
+    return seeded
+
+
+def _by_source(seeded):
+    seeds = {}
+    for (source, title), rows in seeded.items():
+        seeds.setdefault(source, {})[title] = rows
+    return seeds
+
+
+# --- RUNNING ---
+def _reset(client):
+    """Point gsheets at `client` and forget the worksheets and snapshots of the previous one."""
+    gsheets._authorized_client = lambda: client
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    gsheets.forget_worksheets()
+    snapshots.invalidate()
+
+
+def _render(app):
+    started = time.perf_counter()
+    app.run(timeout=RUN_TIMEOUT)
+    seconds = time.perf_counter() - started
+    error = app.exception[0].value if len(app.exception) else ""
+    return seconds, error
+
+
+def _headers(client):
+    """{(source, title): header row} of every tab with a header after a run."""
+    schema = {}
+    for source, book in client.books.items():
+        for title, rows in book.tabs().items():
+            if rows and any(str(h).strip() for h in rows[0]):
+                schema[(source, title)] = _trimmed(rows[0])
+    return schema
+
+
+def discover(pages):
+    """Headers of every tab the pages create, and the tabs each page uses."""
+    schema, used = {}, {page: set() for page in pages}
+    for _ in range(DISCOVERY_PASSES):
+        known = len(schema)
+        for page in pages:
+            client = FakeClient(_by_source(synthetic_rows(schema, list(schema), DISCOVERY_ROWS)))
+            _reset(client)
+            AppTest.from_file(os.path.join(HERE, page), default_timeout=RUN_TIMEOUT).run()
+            for tab, header in _headers(client).items():
+                if len(header) > len(schema.get(tab, [])):
+                    schema[tab] = header
+            used[page] |= client.touched
+        if len(schema) == known:
+            break
+    return schema, {page: {tab for tab in tabs if tab in schema} for page, tabs in used.items()}
+
+
+def measure(page, schema, tabs, n, memory=True):
+    """Cold and warm render of one page against `n` rows per tab."""
+    client = FakeClient(_by_source(synthetic_rows(schema, tabs, n)))
+    _reset(client)
+    app = AppTest.from_file(os.path.join(HERE, page), default_timeout=RUN_TIMEOUT)
+    result = {"page": page, "rows": n, "tabs": len(tabs)}
+    for phase in ("cold", "warm"):
+        before = client.total()
+        if memory:
+            tracemalloc.start()
+        seconds, error = _render(app)
+        result.update({f"{phase}_s": round(seconds, 3), f"{phase}_calls": client.total() - before})
+        if memory:
+            result[f"{phase}_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            tracemalloc.stop()
+        if error:
+            result["error"] = f"{phase}: {error}"[:120]
+            break
+    return result
+
+
+def measure_fresh(page, schema, tabs, n, memory=True):
+    """measure() in a new process, so the cold render starts with nothing cached."""
+    sys.modules["__main__"] = _MAIN
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(measure, (page, schema, tabs, n, memory))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each form against in-memory sheets of growing size.")
+    parser.add_argument("--page", action="append", help="form script to run (repeatable; default: every form)")
+    parser.add_argument("--rows", action="append", type=int, help="rows per tab (repeatable; default: 1k, 10k, 100k)")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (faster, no peak memory column)")
+    parser.add_argument("--csv", help="also write the results to this CSV file")
+    args = parser.parse_args()
+
+    pages = args.page or form_pages()
+    sizes = args.rows or SIZES
+    schema, used = discover(pages)
+    results = []
+    for n in sizes:
+        for page in pages:
+            result = measure_fresh(page, schema, used[page], n, memory=not args.no_memory)
+            results.append(result)
+            print(f"{page:<32} {n:>7} rows  cold {result.get('cold_s', 0):7.2f}s {result.get('cold_calls', 0):>4} calls"
+                  f"  warm {result.get('warm_s', 0):7.2f}s {result.get('warm_calls', 0):>4} calls"
+                  f"  peak {result.get('cold_peak_mb', 0):7.1f} MB  {result.get('error', '')}", flush=True)
+
+    table = pd.DataFrame(results).fillna("")
+    print()
+    print(table.to_string(index=False))
+    if args.csv:
+        table.to_csv(args.csv, index=False)
+
+
+if __name__ == "__main__":
+    main()
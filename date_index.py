@@ -0,0 +1,149 @@
+# Date-range reads for the "recent entries" review panels.
+#
+# Rows are appended in time order, so the last N days sit at the bottom of a
+# tab. For each (tab, date column) we keep only that column's parsed dates, as a
+# running maximum so the list stays sorted when a few rows are blank or out of
+# order. A binary search gives the first row that can fall inside the window,
+# and one batch_get returns the header, the new date cells and the rows from
+# that offset down. Callers still apply their own date filter to the result.
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+
+from dates import parse_dates
+from rate_limit import review_priority
+from snapshots import FULL_RELOAD_SECONDS, end_column, snapshot_values, values_records
+
+# Widen every window by this much so a date parsed slightly differently than
+# the form's own filter can never push a wanted row out of the fetched range.
+WINDOW_MARGIN = timedelta(days=1)
+
+_lock = threading.Lock()
+_indexes = {}
+_index_locks = {}
+
+
+def _trimmed(row):
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+def _cell(row):
+    return row[0] if row else ""
+
+
+def _as_ns(values):
+    parsed = parse_dates(values)
+    # Dates in the future are typos (or day/month swaps); never let them move the window
+    parsed = parsed.where(parsed <= pd.Timestamp.now() + pd.Timedelta(days=1))
+    return parsed.to_numpy(dtype="datetime64[ns]").astype("int64"), parsed.isna().to_numpy()
+
+
+class _DateIndex:
+    def __init__(self, header, col, raw):
+        self.header = _trimmed(header)
+        self.col = col
+        self.raw = []
+        self.high = np.empty(0, dtype="int64")
+        self.built_at = time.time()
+        self.extend(raw)
+
+    @property
+    def letter(self):
+        return rowcol_to_a1(1, self.col).rstrip("0123456789")
+
+    def extend(self, raw):
+        if not raw:
+            return
+        ns, missing = _as_ns(raw)
+        ns[missing] = np.iinfo("int64").min
+        start = self.high[-1] if len(self.high) else np.iinfo("int64").min
+        self.high = np.concatenate([self.high, np.maximum.accumulate(np.maximum(ns, start))])
+        self.raw.extend(raw)
+
+    def first_offset(self, since):
+        """Offset of the first data row whose running-max date is >= since."""
+        return int(np.searchsorted(self.high, pd.Timestamp(since).value, side="left"))
+
+
+def _index_lock(key):
+    with _lock:
+        return _index_locks.setdefault(key, threading.Lock())
+
+
+def _build(worksheet, date_col):
+    header = worksheet.row_values(1)
+    names = [str(h).strip() for h in header]
+    if date_col.strip() not in names:
+        return None
+    col = names.index(date_col.strip()) + 1
+    letter = rowcol_to_a1(1, col).rstrip("0123456789")
+    raw = [_cell(row) for row in worksheet.get(f"{letter}2:{letter}")]
+    return _DateIndex(header, col, raw)
+
+
+def _read_window(worksheet, index, since):
+    """Header and data rows from the window start down, or None if the index is stale."""
+    n = len(index.raw)
+    start = index.first_offset(since) + 2
+    letter = index.letter
+    # Re-read the last indexed date cell so edits/inserts above the tail are noticed
+    dates_from = n + 1 if n else 2
+    header, dates, rows = worksheet.batch_get([
+        "1:1", f"{letter}{dates_from}:{letter}", f"A{start}:{end_column(worksheet, len(index.header))}",
+    ])
+    header = header[0] if header else []
+    dates = [_cell(row) for row in dates]
+    if _trimmed(header) != index.header:
+        return None
+    if n:
+        if not dates or dates[0] != index.raw[-1]:
+            return None
+        dates = dates[1:]
+    index.extend(dates)
+    return [header] + [list(row) for row in rows]
+
+
+def read_since_values(worksheet, date_col, since):
+    """Header plus every row that can have `date_col` >= since, oldest rows skipped.
+
+    Falls back to the whole tab when it has no `date_col` column.
+    """
+    since = pd.Timestamp(since) - WINDOW_MARGIN
+    key = (worksheet.spreadsheet.id, worksheet.id, date_col.strip())
+    with _index_lock(key), review_priority():
+        index = _indexes.get(key)
+        if index is None or time.time() - index.built_at > FULL_RELOAD_SECONDS:
+            index = _indexes[key] = _build(worksheet, date_col)
+        if index is None:
+            _indexes.pop(key, None)
+            return snapshot_values(worksheet)
+        values = _read_window(worksheet, index, since)
+        if values is None:
+            index = _indexes[key] = _build(worksheet, date_col)
+            if index is None:
+                _indexes.pop(key, None)
+                return snapshot_values(worksheet)
+            values = _read_window(worksheet, index, since)
+        return values or []
+
+
+def read_since(worksheet, date_col, since):
+    """get_all_records()-style dicts for the rows that can fall on or after `since`."""
+    return values_records(read_since_values(worksheet, date_col, since))
+
+
+def read_recent(worksheet, date_col, days):
+    """Records of roughly the last `days` days; filter exactly on the result."""
+    return read_since(worksheet, date_col, datetime.today().date() - timedelta(days=days))
+
+
+def read_recent_values(worksheet, date_col, days):
+    return read_since_values(worksheet, date_col, datetime.today().date() - timedelta(days=days))
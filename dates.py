@@ -0,0 +1,108 @@
+# Date parsing shared by the forms.
+#
+# Sheets hold dates typed by hand or written by different forms over the years,
+# so one column can mix "2024-05-01", "5/1/2024", "2024-05-01 13:45:00" and
+# str(datetime.now()) with its microseconds.
+# parse_dates() converts a whole column at once: the distinct strings are tried
+# against each known format in turn with one pd.to_datetime call per format,
+# whatever is left gets one ISO 8601 pass, and every string ever parsed is
+# remembered, so a rerun only parses strings it
+# has not seen. snapshot_frame() goes one step further and keeps the DataFrame
+# with its parsed date columns next to the tab snapshot it was built from.
+
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from rate_limit import review_priority
+from snapshots import snapshot, table_records
+
+# Tried in order; the first format that fits a string wins, so month/day comes
+# before day/month as it always has in these forms.
+FORMATS = (
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M",
+    "%m/%d/%Y",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y %H:%M",
+    "%d/%m/%Y",
+    "%Y/%m/%d",
+    "%d-%m-%Y",
+)
+
+# Parsed strings kept in memory; the memo starts over when it grows past this
+MEMO_LIMIT = 200_000
+
+_lock = threading.Lock()
+_memo = {}
+_frames = weakref.WeakKeyDictionary()
+
+
+def _parse_unique(strings):
+    parsed = np.full(len(strings), np.datetime64("NaT"), dtype="datetime64[ns]")
+    todo = np.arange(len(strings))
+    # ISO 8601 last, for "2024-05-01T13:45:00" and the like; offsets are
+    # converted to UTC so a column with mixed offsets still parses
+    for fmt in FORMATS + ("ISO8601",):
+        if not len(todo):
+            break
+        utc = fmt == "ISO8601"
+        attempt = pd.to_datetime(pd.Index([strings[i] for i in todo], dtype=object), format=fmt, errors="coerce", utc=utc)
+        if utc:
+            attempt = attempt.tz_localize(None)
+        ok = ~attempt.isna()
+        parsed[todo[ok]] = attempt[ok].to_numpy(dtype="datetime64[ns]")
+        todo = todo[~ok]
+    return parsed
+
+
+def parse_dates(values):
+    """Parse a column (Series or list) of date strings; unparseable cells become NaT."""
+    series = values if isinstance(values, pd.Series) else pd.Series(list(values), dtype=object)
+    text = series.astype(str).fillna("").str.strip()
+    codes, uniques = pd.factorize(text)
+    uniques = list(uniques)
+    # Resolve against a local copy of the hits: another call may clear the memo at any time
+    with _lock:
+        known = {u: _memo[u] for u in uniques if u in _memo}
+    missing = [u for u in uniques if u not in known]
+    if missing:
+        known.update(zip(missing, _parse_unique(missing)))
+        with _lock:
+            if len(_memo) + len(missing) > MEMO_LIMIT:
+                _memo.clear()
+            _memo.update((u, known[u]) for u in missing)
+    lookup = np.array([known[u] for u in uniques], dtype="datetime64[ns]")
+    return pd.Series(lookup[codes] if len(codes) else lookup[:0], index=series.index, name=series.name)
+
+
+def parse_date(value):
+    """Parse one date string; returns a datetime, or None if no format fits."""
+    parsed = parse_dates([value]).iloc[0]
+    return None if pd.isna(parsed) else parsed.to_pydatetime()
+
+
+def snapshot_frame(worksheet, date_cols=()):
+    """DataFrame of a tab's records with `date_cols` parsed, cached with the tab snapshot.
+
+    Returns a copy, so callers are free to modify it.
+    """
+    # Frames feed the review panels, which yield to interactive reads
+    with review_priority():
+        table = snapshot(worksheet)
+    key = tuple(date_cols)
+    with _lock:
+        cached = _frames.get(table, {}).get(key)
+    if cached is None or cached[0] != table.version:
+        frame = pd.DataFrame(table_records(table))
+        for col in date_cols:
+            if col in frame.columns:
+                frame[col] = parse_dates(frame[col])
+        cached = (table.version, frame)
+        with _lock:
+            _frames.setdefault(table, {})[key] = cached
+    return cached[1].copy()
@@ -0,0 +1,294 @@
+# Gas test calculations, vectorized, and the recompute job for stored results.
+#
+#     python gas_calc.py pure                      # dry run: report every cell that would change
+#     python gas_calc.py pure --apply              # write the changed cells back
+#     python gas_calc.py pure --area MOD-014=12.5  # recompute with a known module area
+#     python gas_calc.py mixed                     # same for Mixed Gas Test Tbl
+#
+# The forms and the rig-file import compute derived columns with these
+# functions, so a fix to a formula or constant lands everywhere at once. The
+# recompute job re-derives the columns for the whole tab in one NumPy pass,
+# diffs them against what is stored and sends only the changed cells, merged
+# into contiguous ranges, in a single batch_update.
+#
+# Mixed gas rows saved before the form stopped writing the module label have
+# every column from Temperature on shifted one to the right; the mixed job
+# moves those rows back under their headers before recomputing.
+
+import argparse
+
+import numpy as np
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+
+from gsheets import RD_SHEET_NAME, get_worksheet, open_spreadsheet, update_ranges
+from snapshots import invalidate, snapshot_values
+
+# psi -> cmHg
+PSI_TO_CMHG = 5.174
+# Constant the stored permeances were computed with; used to recover each test's module area
+STORED_PSI_TO_CMHG = 5.174
+# Module area the Pure Gas Test form defaults to, when no other area is known
+DEFAULT_AREA_CM2 = 1.0
+
+TAB_PURE_GAS = "Pure Gas Test Tbl"
+PURE_DERIVED = ["Permeance", "Selectivity", "Passed (y/n)?"]
+TAB_MIXED = "Mixed Gas Test Tbl"
+MIXED_DERIVED = ["C-CO2 Perm", "C - N2 perm", "C - Selectivity", "C - CO2 Flux", "C - stage cut"]
+# Raw mixed gas measurements, written back as numbers when a row is realigned
+MIXED_MEASUREMENTS = ["Temperature", "Feed Pressure", "Retentate Pressure", "Retentate Flow", "Retentate CO2 Comp",
+                      "Permeate Pressure", "Permeate Flow", "Permeate CO2 Composition", "Permeate O2 Composition",
+                      "Ambient Temperature"]
+# Column the old form wrote between Module Type and Temperature
+MIXED_LABEL_POSITION = 4
+OVERFLOW = "(past last header)"
+
+
+def _floats(values):
+    return np.asarray(values, dtype=float)
+
+
+def permeance(flow_ml_min, area_cm2, feed_psi, perm_psi, psi_to_cmhg=PSI_TO_CMHG):
+    """Permeance per reading; 0 where the pressures are equal or the area is 0."""
+    flow, area, feed, perm = (_floats(v) for v in (flow_ml_min, area_cm2, feed_psi, perm_psi))
+    dp_cmhg = (feed - perm) * psi_to_cmhg
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where((feed != perm) & (area != 0), (flow / 60) / (area * dp_cmhg), 0.0)
+
+
+def test_selectivity(test_keys, gases, permeances):
+    """Per-reading (selectivity, passed) for readings grouped into tests by `test_keys`.
+
+    A test's selectivity is its last CO2 permeance over its last N2 permeance,
+    and it passes when both are non-zero.
+    """
+    df = pd.DataFrame({"test": pd.Series(test_keys).astype(str).to_numpy(),
+                       "gas": pd.Series(gases).astype(str).str.strip().str.upper().to_numpy(),
+                       "perm": _floats(permeances)})
+    co2 = df[df["gas"] == "CO2"].groupby("test")["perm"].last()
+    n2 = df[df["gas"] == "N2"].groupby("test")["perm"].last()
+    co2 = df["test"].map(co2).fillna(0).to_numpy()
+    n2 = df["test"].map(n2).fillna(0).to_numpy()
+    ok = (co2 != 0) & (n2 != 0)
+    selectivity = np.where(ok, np.round(co2 / np.where(ok, n2, 1), 6), 0)
+    return selectivity, np.where(ok, "Yes", "No")
+
+
+def mixed_gas_derived(feed_psi, retentate_co2, permeate_flow, permeate_co2, area_cm2):
+    """The C - columns per test; all 0 where the feed, retentate CO2 or area is not positive."""
+    feed, r_co2, p_flow, p_co2, area = (_floats(v) for v in (feed_psi, retentate_co2, permeate_flow,
+                                                              permeate_co2, area_cm2))
+    valid = (area > 0) & (feed > 0) & (r_co2 > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        co2_perm = np.where(valid, np.round((p_co2 / 100) * p_flow / area, 6), 0.0)
+        n2_perm = np.where(valid, np.round(((100 - p_co2) / 100) * p_flow / area, 6), 0.0)
+        return {
+            "C-CO2 Perm": co2_perm,
+            "C - N2 perm": n2_perm,
+            "C - Selectivity": np.where(valid & (n2_perm != 0), np.round(co2_perm / n2_perm, 6), 0.0),
+            "C - CO2 Flux": np.where(valid, np.round(p_flow / area, 6), 0.0),
+            "C - stage cut": np.where(valid, np.round(p_flow / feed, 6), 0.0),
+        }
+
+
+# --- RECOMPUTE ---
+def _numbers(series):
+    return pd.to_numeric(series.astype(str).str.strip().str.replace(",", "", regex=False), errors="coerce")
+
+
+def _column(df, name):
+    return df[name] if name in df.columns else pd.Series("", index=df.index)
+
+
+def _frame(header, rows):
+    width = len(header)
+    return pd.DataFrame([list(row[:width]) + [""] * (width - len(row)) for row in rows], columns=header, dtype=object)
+
+
+def _known_areas(df, areas, area):
+    if areas:
+        known = _column(df, "Module ID").astype(str).str.strip().map(areas).to_numpy(dtype=float)
+        area = np.where(np.isnan(known), area, known)
+    return area
+
+
+def recompute_pure_gas(values, areas=None, default_area=DEFAULT_AREA_CM2):
+    """Recomputed Permeance / Selectivity / Passed for every row of the tab.
+
+    `values` is the tab as get_all_values() returns it. The tab does not store
+    the module area, so each test's area is taken from `areas` (Module ID ->
+    cm²) or else recovered from its stored permeance.
+    """
+    df = _frame([str(h).strip() for h in values[0]], values[1:])
+    flow, feed, perm = (_numbers(_column(df, c)).fillna(0).to_numpy()
+                        for c in ("Flow (mL/min)", "Feed Pressure (psi)", "Perm Pressure (psi)"))
+    stored = _numbers(_column(df, "Permeance")).to_numpy()
+
+    # Area each stored permeance implies; readings without one borrow their test's
+    with np.errstate(divide="ignore", invalid="ignore"):
+        implied = (flow / 60) / (stored * (feed - perm) * STORED_PSI_TO_CMHG)
+    implied = pd.Series(np.where(np.isfinite(implied) & (implied > 0), implied, np.nan), index=df.index)
+    ids = _column(df, "Pure Gas Test ID").astype(str).str.strip()
+    test_keys = ids.where(ids != "", "row-" + pd.Series(df.index.astype(str), index=df.index))
+    area = implied.fillna(implied.groupby(test_keys.to_numpy()).transform("median")).to_numpy()
+    area = _known_areas(df, areas, area)
+    area = np.where(np.isnan(area), default_area, area)
+
+    out = pd.DataFrame(index=df.index)
+    out["Permeance"] = np.round(permeance(flow, area, feed, perm), 6)
+    # All readings of a test share the module, so selectivity does not depend on the area
+    out["Selectivity"], out["Passed (y/n)?"] = test_selectivity(
+        test_keys, _column(df, "Gas"), permeance(flow, np.ones(len(df)), feed, perm))
+    return df, out
+
+
+def _as_number(values):
+    """Numbers where a value parses as one, the text otherwise."""
+    parsed = _numbers(values)
+    return values.where(parsed.isna() | (values.astype(str).str.strip() == ""), parsed)
+
+
+def recompute_mixed_gas(values, areas=None, default_area=DEFAULT_AREA_CM2):
+    """(stored, target) frames for the whole Mixed Gas Test tab.
+
+    `stored` holds the cells as they are now, `target` the same rows moved back
+    under their headers where they were shifted, with the C - columns
+    recomputed from the measurements. When any row spilled past the last
+    header, both frames carry an OVERFLOW column and the target clears it.
+    Each test's module area comes from `areas` (Module ID -> cm²) or else from
+    its stored CO2 flux.
+    """
+    header = [str(h).strip() for h in values[0]]
+    while header and not header[-1]:
+        header.pop()
+    width = len(header)
+    rows = values[1:]
+    shifted = np.array([len(row) > width and str(row[width]).strip() != "" for row in rows], dtype=bool)
+    aligned = [list(row[:MIXED_LABEL_POSITION]) + list(row[MIXED_LABEL_POSITION + 1:width + 1]) if moved else row
+               for row, moved in zip(rows, shifted)]
+    columns = header + [OVERFLOW] if shifted.any() else header
+    stored = _frame(columns, rows)
+    target = _frame(header, aligned)
+    if shifted.any():
+        target[OVERFLOW] = ""
+    for column in MIXED_MEASUREMENTS:
+        if column in target.columns:
+            target.loc[shifted, column] = _as_number(target.loc[shifted, column])
+
+    feed, r_co2, p_flow, p_co2 = (_numbers(_column(target, c)).fillna(0).to_numpy()
+                                  for c in ("Feed Pressure", "Retentate CO2 Comp", "Permeate Flow",
+                                            "Permeate CO2 Composition"))
+    flux = _numbers(_column(target, "C - CO2 Flux")).to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        implied = p_flow / flux
+    area = np.where(np.isfinite(implied) & (implied > 0), implied, np.nan)
+    area = _known_areas(target, areas, area)
+    area = np.where(np.isnan(area), default_area, area)
+    for column, derived in mixed_gas_derived(feed, r_co2, p_flow, p_co2, area).items():
+        target[column] = derived
+    return stored, target
+
+
+def diff_cells(stored, computed, columns):
+    """[(sheet row, column name, old, new)] for every cell of `columns` that changes.
+
+    Numbers are compared numerically, anything else as text.
+    """
+    changes = []
+    for column in columns:
+        old = _column(stored, column).astype(str).str.strip()
+        new = computed[column]
+        old_num = _numbers(old).to_numpy()
+        new_num = (new.to_numpy(dtype=float) if new.dtype.kind in "fi" else
+                   pd.to_numeric(new.map(lambda v: v if isinstance(v, (int, float, np.number)) else None),
+                                 errors="coerce").to_numpy(dtype=float))
+        with np.errstate(invalid="ignore"):
+            same_num = np.isclose(old_num, new_num, rtol=0, atol=5e-7) & ~np.isnan(old_num)
+        same_text = old.to_numpy() == new.astype(str).str.strip().to_numpy()
+        same = np.where(np.isnan(new_num), same_text, same_num)
+        for i in np.flatnonzero(~same):
+            value = new.iloc[i]
+            changes.append((int(i) + 2, column, old.iloc[i], value.item() if hasattr(value, "item") else value))
+    return changes
+
+
+def cell_ranges(changes, header):
+    """Merge changed cells into batch_update blocks of contiguous rows per column."""
+    col_index = {name.strip(): i + 1 for i, name in enumerate(header)}
+    data = []
+    for column in dict.fromkeys(c[1] for c in changes):
+        cells = sorted((row, new) for row, name, _, new in changes if name == column)
+        start = 0
+        for i in range(1, len(cells) + 1):
+            if i == len(cells) or cells[i][0] != cells[i - 1][0] + 1:
+                first, last = cells[start][0], cells[i - 1][0]
+                a1 = rowcol_to_a1(first, col_index[column])
+                if last != first:
+                    a1 += ":" + rowcol_to_a1(last, col_index[column])
+                data.append({"range": a1, "values": [[new] for _, new in cells[start:i]]})
+                start = i
+    return data
+
+
+def recompute_pure_gas_tab(worksheet, areas=None, default_area=DEFAULT_AREA_CM2, apply=False):
+    """Diff the tab against a fresh recompute; with apply=True write the changes in one batch_update."""
+    values = snapshot_values(worksheet)
+    if len(values) < 2:
+        return []
+    stored, computed = recompute_pure_gas(values, areas, default_area)
+    missing = [c for c in PURE_DERIVED if c not in stored.columns]
+    if missing:
+        raise ValueError(f"{worksheet.title} has no column for: {', '.join(missing)}")
+    changes = diff_cells(stored, computed, PURE_DERIVED)
+    if apply and changes:
+        update_ranges(worksheet, cell_ranges(changes, values[0]))
+        invalidate(worksheet)
+    return changes
+
+
+def recompute_mixed_gas_tab(worksheet, areas=None, default_area=DEFAULT_AREA_CM2, apply=False):
+    """Realign shifted rows and diff the C - columns; with apply=True write the changes in one batch_update."""
+    values = snapshot_values(worksheet)
+    if len(values) < 2:
+        return []
+    stored, target = recompute_mixed_gas(values, areas, default_area)
+    missing = [c for c in MIXED_DERIVED if c not in stored.columns]
+    if missing:
+        raise ValueError(f"{worksheet.title} has no column for: {', '.join(missing)}")
+    changes = diff_cells(stored, target, list(target.columns))
+    if apply and changes:
+        update_ranges(worksheet, cell_ranges(changes, list(target.columns)))
+        invalidate(worksheet)
+    return changes
+
+
+def _parse_areas(items):
+    areas = {}
+    for item in items or []:
+        module_id, _, value = item.partition("=")
+        areas[module_id.strip()] = float(value)
+    return areas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute derived gas test columns from the raw readings.")
+    parser.add_argument("table", choices=["pure", "mixed"], help="which test tab to recompute")
+    parser.add_argument("--apply", action="store_true", help="write changed cells back (default: dry run)")
+    parser.add_argument("--area", action="append", metavar="MODULE=CM2", help="known module area (repeatable)")
+    parser.add_argument("--default-area", type=float, default=DEFAULT_AREA_CM2,
+                        help="area for tests whose area cannot be recovered (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.table == "pure":
+        tab, recompute = TAB_PURE_GAS, recompute_pure_gas_tab
+    else:
+        tab, recompute = TAB_MIXED, recompute_mixed_gas_tab
+    worksheet = get_worksheet(open_spreadsheet(RD_SHEET_NAME), tab)
+    changes = recompute(worksheet, _parse_areas(args.area), args.default_area, apply=args.apply)
+    for row, column, old, new in changes:
+        print(f"row {row:>6}  {column:<24} {old!s:>14} -> {new}")
+    print(f"{len(changes)} cells {'written' if args.apply else 'would change (dry run)'}")
+
+
+if __name__ == "__main__":
+    main()
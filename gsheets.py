@@ -0,0 +1,217 @@
+# Shared Google Sheets connection for all forms.
+#
+# The authorized client, opened spreadsheets and worksheet handles live for the
+# whole Streamlit process, so a rerun costs no auth or open round trips.
+# ensure_tabs() checks a form's tabs and header rows once per process, in a
+# few batched calls, instead of on every rerun.
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import gspread
+import streamlit as st
+from gspread.utils import absolute_range_name
+from oauth2client.service_account import ServiceAccountCredentials
+
+import api_trace
+import rate_limit
+from snapshots import invalidate
+
+# --- CONFIG ---
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+RD_SHEET_NAME = "R&D Data Form"
+SOLUTION_SHEET_KEY = "1uPdUWiiwMdJCYJaxZ5TneFa9h6tbSrs327BVLT5GVPY"
+UNCOATED_FIBER_SHEET_URL = "https://docs.google.com/spreadsheets/d/1AGZ1g3LeSPtLAKV685snVQeERWXVPF4WlIAV8aAj9o8"
+
+# Refresh the access token this long before Google expires it.
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+_lock = threading.RLock()
+_worksheets = {}
+_verified = set()
+
+api_trace.install()
+rate_limit.install()
+
+
+def _tab_key(title):
+    return title.strip().lower()
+
+
+# --- CLIENT ---
+def load_credentials():
+    json_key = json.loads(st.secrets["gcp_service_account"])
+    json_key["private_key"] = json_key["private_key"].replace("\\n", "\n")
+    return ServiceAccountCredentials.from_json_keyfile_dict(json_key, SCOPE)
+
+
+@st.cache_resource(show_spinner=False)
+def _authorized_client():
+    return gspread.authorize(load_credentials())
+
+
+def get_client():
+    """Process-wide gspread client whose token is refreshed before it expires."""
+    client = _authorized_client()
+    with _lock:
+        expiry = client.expiry
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        if expiry is None or expiry - now < TOKEN_REFRESH_MARGIN:
+            client.http_client.login()
+    return client
+
+
+# --- SPREADSHEETS ---
+@st.cache_resource(show_spinner=False)
+def _open_spreadsheet(name=None, key=None, url=None):
+    client = get_client()
+    if key:
+        return client.open_by_key(key)
+    if url:
+        return client.open_by_url(url)
+    return client.open(name)
+
+
+def open_spreadsheet(name=None, key=None, url=None):
+    """Return the shared Spreadsheet handle for a name, key or URL."""
+    get_client()
+    return _open_spreadsheet(name=name, key=key, url=url)
+
+
+# --- WORKSHEETS ---
+def _load_worksheet_handles(spreadsheet):
+    handles = {_tab_key(ws.title): ws for ws in spreadsheet.worksheets()}
+    _worksheets[spreadsheet.id] = handles
+    return handles
+
+
+def get_worksheet(spreadsheet, title):
+    """Cached Worksheet handle; tab titles match case- and whitespace-insensitively.
+
+    All handles of a spreadsheet are loaded with a single metadata call on first
+    use. Raises gspread.exceptions.WorksheetNotFound if the tab does not exist.
+    """
+    with _lock:
+        handles = _worksheets.get(spreadsheet.id)
+        if handles is None or _tab_key(title) not in handles:
+            handles = _load_worksheet_handles(spreadsheet)
+        if _tab_key(title) not in handles:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return handles[_tab_key(title)]
+
+
+def add_worksheet(spreadsheet, title, rows="1000", cols="50"):
+    """Create a tab and register its handle in the cache."""
+    with _lock:
+        worksheet = spreadsheet.add_worksheet(title=title, rows=rows, cols=cols)
+        _worksheets.setdefault(spreadsheet.id, {})[_tab_key(title)] = worksheet
+        return worksheet
+
+
+def forget_worksheets(spreadsheet=None):
+    """Drop cached handles, e.g. after tabs were renamed or deleted in the UI; tabs are checked again on next use."""
+    with _lock:
+        if spreadsheet is None:
+            _worksheets.clear()
+            _verified.clear()
+        else:
+            _worksheets.pop(spreadsheet.id, None)
+            _verified.difference_update({key for key in _verified if key[0] == spreadsheet.id})
+
+
+# --- SCHEMA ---
+def _schema_key(spreadsheet, title, headers, on_mismatch):
+    mode = on_mismatch if on_mismatch is None or isinstance(on_mismatch, str) else on_mismatch.__qualname__
+    return (spreadsheet.id, _tab_key(title), tuple(h.strip() for h in headers), mode)
+
+
+def _bootstrap(spreadsheet, tabs, on_mismatch):
+    handles = _worksheets.get(spreadsheet.id)
+    if handles is None or any(_tab_key(title) not in handles for title in tabs):
+        handles = _load_worksheet_handles(spreadsheet)
+    missing = [title for title in tabs if _tab_key(title) not in handles]
+    existing = [title for title in tabs if _tab_key(title) in handles]
+
+    current = {}
+    if existing:
+        response = spreadsheet.values_batch_get([absolute_range_name(handles[_tab_key(t)].title, "1:1") for t in existing])
+        for title, block in zip(existing, response.get("valueRanges", [])):
+            values = block.get("values", [])
+            current[title] = [str(v) for v in values[0]] if values else []
+
+    requests, writes = [], []
+    for title in missing:
+        requests.append({"addSheet": {"properties": {
+            "title": title, "gridProperties": {"rowCount": 1000, "columnCount": max(26, len(tabs[title]))},
+        }}})
+        writes.append((title, tabs[title]))
+    for title in existing:
+        headers, actual = tabs[title], current[title]
+        if not any(h.strip() for h in actual):
+            writes.append((title, headers))
+        elif [h.strip() for h in actual] == [h.strip() for h in headers] or on_mismatch is None:
+            continue
+        elif on_mismatch == "insert":
+            requests.append({"insertDimension": {
+                "range": {"sheetId": handles[_tab_key(title)].id, "dimension": "ROWS", "startIndex": 0, "endIndex": 1},
+                "inheritFromBefore": False,
+            }})
+            writes.append((title, headers))
+        else:
+            row = on_mismatch(list(actual), list(headers))
+            if row is not None and list(row) != actual:
+                writes.append((title, row))
+
+    if requests:
+        spreadsheet.batch_update({"requests": requests})
+        handles = _load_worksheet_handles(spreadsheet)
+    if writes:
+        spreadsheet.values_batch_update({"valueInputOption": "RAW", "data": [
+            {"range": absolute_range_name(handles[_tab_key(title)].title, "A1"), "values": [list(row)]}
+            for title, row in writes
+        ]})
+        for title, _ in writes:
+            invalidate(handles[_tab_key(title)])
+
+
+def ensure_tabs(spreadsheet, tabs, on_mismatch=None):
+    """{title: Worksheet} for {title: headers}, creating missing tabs and blank header rows.
+
+    Each tab is checked once per process: the first call costs one metadata
+    call, one batched read of the header rows and at most one structural and
+    one values batch update; every later call is answered from the handle
+    cache. A header row that differs from `headers` is left alone, unless
+    `on_mismatch` is "insert" (insert `headers` above it) or a function of
+    (current header, headers) returning the row to write instead, or None.
+    """
+    with _lock:
+        todo = {title: list(headers) for title, headers in tabs.items()
+                if _schema_key(spreadsheet, title, headers, on_mismatch) not in _verified}
+        if todo:
+            _bootstrap(spreadsheet, todo, on_mismatch)
+            _verified.update(_schema_key(spreadsheet, title, headers, on_mismatch) for title, headers in todo.items())
+        return {title: get_worksheet(spreadsheet, title) for title in tabs}
+
+
+# --- WRITES ---
+def append_rows(worksheet, rows, value_input_option="RAW"):
+    """Append all rows with one values.append call and return the elapsed seconds.
+
+    A single append request is applied atomically, so either every row lands or none do.
+    """
+    if not rows:
+        return 0.0
+    started = time.perf_counter()
+    worksheet.append_rows([list(row) for row in rows], value_input_option=value_input_option)
+    return time.perf_counter() - started
+
+
+def update_ranges(worksheet, data, value_input_option="RAW"):
+    """Write several `{"range": ..., "values": ...}` blocks of one tab in a single request."""
+    if not data:
+        return 0.0
+    started = time.perf_counter()
+    worksheet.batch_update(list(data), value_input_option=value_input_option)
+    return time.perf_counter() - started
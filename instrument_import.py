@@ -0,0 +1,217 @@
+# Import of test-rig exports into the pure-gas and mixed-gas test tabs.
+#
+# A rig export (CSV or XLSX, one reading per row) is read in chunks of
+# CHUNK_ROWS; each chunk is reduced to the columns we know, under their
+# canonical names, with numbers coerced, so a large file never sits in memory
+# as raw text. Modules are matched by Module ID, display string or label, and
+# permeance / selectivity / flux / stage cut are computed for every row at once
+# with the same formulas as the hand-entry forms. The forms then preview the
+# result and queue the whole file as one append.
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from dates import parse_dates
+from gas_calc import mixed_gas_derived, permeance, test_selectivity
+from module_index import NO_LABEL
+
+CHUNK_ROWS = 5_000
+
+# Canonical column -> accepted export headers (compared lower-case, punctuation ignored)
+PURE_COLUMNS = {
+    "Module": ["module id", "module", "module label", "label"],
+    "Test Date": ["test date", "date", "timestamp", "date time"],
+    "Gas": ["gas"],
+    "Feed": ["feed pressure psi", "feed pressure", "feed psi", "feed"],
+    "Perm": ["perm pressure psi", "permeate pressure psi", "perm pressure", "permeate pressure", "perm psi", "perm"],
+    "Flow": ["flow ml min", "flow", "permeate flow ml min", "permeate flow"],
+    "Area": ["module area cm2", "area cm2", "area"],
+    "Test": ["test", "test id", "run", "run id"],
+}
+MIXED_COLUMNS = {
+    "Module": ["module id", "module", "module label", "label"],
+    "Test Date": ["mixed gas test date", "test date", "date", "timestamp", "date time"],
+    "Temperature": ["temperature c", "temperature", "temp"],
+    "Feed": ["feed pressure psi", "feed pressure", "feed"],
+    "Retentate Pressure": ["retentate pressure psi", "retentate pressure"],
+    "Retentate Flow": ["retentate flow l min", "retentate flow"],
+    "Retentate CO2": ["retentate co2 comp", "retentate co2 comp percent", "retentate co2"],
+    "Permeate Pressure": ["permeate pressure psi", "permeate pressure"],
+    "Permeate Flow": ["permeate flow l min", "permeate flow"],
+    "Permeate CO2": ["permeate co2 comp", "permeate co2 composition", "permeate co2"],
+    "Permeate O2": ["permeate o2 comp", "permeate o2 composition", "permeate o2"],
+    "Ambient Temperature": ["ambient temperature c", "ambient temperature", "ambient temp"],
+    "Area": ["module area cm2", "area cm2", "area"],
+    "Analyzer": ["co2 analyzer id", "analyzer id", "analyzer"],
+    "Rig": ["test rig", "rig"],
+    "Passed": ["passed", "pass"],
+}
+PURE_REQUIRED = ["Module", "Gas", "Feed", "Perm", "Flow"]
+MIXED_REQUIRED = ["Module", "Feed", "Retentate CO2", "Permeate Flow", "Permeate CO2"]
+TEXT_COLUMNS = {"Module", "Test Date", "Gas", "Test", "Analyzer", "Rig", "Passed"}
+
+
+def _normalise(name):
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", str(name).lower()).split())
+
+
+def _renamer(columns, spec):
+    aliases = {_normalise(alias): canonical for canonical, names in spec.items() for alias in names}
+    rename = {}
+    for column in columns:
+        canonical = aliases.get(_normalise(column))
+        if canonical and canonical not in rename.values():
+            rename[column] = canonical
+    return rename
+
+
+def _xlsx_chunks(file, chunk_rows):
+    import openpyxl  # only needed for Excel exports
+
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(h) if h is not None else "" for h in next(rows, [])]
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_rows:
+                yield pd.DataFrame(chunk, columns=header, dtype=object)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header, dtype=object)
+    finally:
+        workbook.close()
+
+
+def _chunks(file, chunk_rows):
+    name = getattr(file, "name", str(file)).lower()
+    if name.endswith((".xlsx", ".xlsm")):
+        return _xlsx_chunks(file, chunk_rows)
+    return pd.read_csv(file, chunksize=chunk_rows, dtype=str, keep_default_na=False, skipinitialspace=True)
+
+
+def read_export(file, spec, chunk_rows=CHUNK_ROWS):
+    """Read a rig export into a DataFrame of the canonical columns in `spec` that it has."""
+    frames = []
+    for chunk in _chunks(file, chunk_rows):
+        chunk = chunk.rename(columns=_renamer(chunk.columns, spec))
+        chunk = chunk[[c for c in spec if c in chunk.columns]].copy()
+        for column in chunk.columns:
+            if column in TEXT_COLUMNS:
+                chunk[column] = chunk[column].fillna("").astype(str).str.strip()
+            else:
+                chunk[column] = pd.to_numeric(chunk[column], errors="coerce")
+        chunk = chunk.dropna(how="all")
+        frames.append(chunk)
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=list(spec))
+    return df
+
+
+def missing_columns(df, required):
+    return [c for c in required if c not in df.columns]
+
+
+def map_modules(df, module_df):
+    """Add Module ID / Type / Label / Display from the module label index.
+
+    The export's Module column may hold a Module ID, a full display string or a
+    module label (tried in that order); rows that match nothing get an empty
+    Module ID.
+    """
+    columns = ["Module ID", "Type", "Label", "Display"]
+    keyed = pd.concat([
+        module_df[columns].assign(_key=module_df[column].astype(str).str.strip().str.lower())
+        for column in ("Module ID", "Display", "Label")
+    ])
+    keyed = keyed[keyed["_key"] != NO_LABEL.lower()].drop_duplicates("_key", keep="first")
+    out = df.drop(columns=[c for c in columns if c in df.columns])
+    out["_key"] = out["Module"].astype(str).str.strip().str.lower()
+    out = out.merge(keyed, on="_key", how="left").drop(columns="_key")
+    out[columns] = out[columns].fillna("").astype(str)
+    return out
+
+
+def test_dates(df, default):
+    """The export's test dates as YYYY-MM-DD, `default` where missing or unreadable."""
+    if "Test Date" not in df.columns:
+        return pd.Series(str(default), index=df.index)
+    return parse_dates(df["Test Date"]).dt.strftime("%Y-%m-%d").fillna(str(default))
+
+
+def _num(df, column, default=0.0):
+    if column in df.columns:
+        return df[column].fillna(default).to_numpy(dtype=float)
+    return np.full(len(df), default, dtype=float)
+
+
+def pure_gas_results(df, default_area):
+    """Permeance per reading; selectivity and pass/fail per test.
+
+    A test is one module on one date (or one value of the export's Test column);
+    as in the form, its selectivity is the last CO2 permeance over the last N2
+    permeance, and it passes when both are non-zero.
+    """
+    out = df.copy()
+    feed, perm, flow = _num(out, "Feed"), _num(out, "Perm"), _num(out, "Flow")
+    area = _num(out, "Area", default_area)
+    area = np.where(area > 0, area, default_area)
+    perms = permeance(flow, area, feed, perm)
+    out["Permeance"] = np.round(perms, 6)
+
+    if "Test" in out.columns:
+        group_cols = ["Module ID", "Test"]
+    elif "Test Date" in out.columns:
+        group_cols = ["Module ID", "Test Date"]
+    else:
+        group_cols = ["Module ID"]
+    out["_test"] = out.groupby(group_cols, sort=False, dropna=False).ngroup()
+    out["Selectivity"], out["Passed (y/n)?"] = test_selectivity(out["_test"], out["Gas"], perms)
+    return out
+
+
+def mixed_gas_results(df, default_area):
+    """C - columns for every reading, with the Mixed Gas Test form's formulas."""
+    out = df.copy()
+    area = _num(out, "Area", default_area)
+    area = np.where(area > 0, area, default_area)
+    derived = mixed_gas_derived(_num(out, "Feed"), _num(out, "Retentate CO2"), _num(out, "Permeate Flow"),
+                                _num(out, "Permeate CO2"), area)
+    for column, values in derived.items():
+        out[column] = values
+    return out
+
+
+def _text(df, column, default=""):
+    if column in df.columns:
+        return df[column].replace("", default).tolist()
+    return [default] * len(df)
+
+
+def pure_gas_rows(results, test_ids, test_date, initials, notes):
+    """Pure Gas Test Tbl rows; `test_ids` holds one ID per test (results["_test"])."""
+    ids = np.asarray(test_ids, dtype=object)[results["_test"].to_numpy()]
+    module_type = results["Type"].str.capitalize()
+    return [list(row) for row in zip(
+        ids, test_dates(results, test_date), results["Module ID"], module_type, results["Display"],
+        results["Gas"].str.upper(), _num(results, "Feed"), _num(results, "Perm"), _num(results, "Flow"),
+        [initials] * len(results), [notes] * len(results),
+        results["Permeance"], results["Selectivity"], results["Passed (y/n)?"],
+    )]
+
+
+def mixed_gas_rows(results, test_ids, test_date, initials, notes, passed):
+    """Mixed Gas Test Tbl rows, in the tab's column order (one ID per reading)."""
+    n = len(results)
+    return [list(row) for row in zip(
+        test_ids, test_dates(results, test_date), results["Module ID"], results["Type"],
+        _num(results, "Temperature"), _num(results, "Feed"), _num(results, "Retentate Pressure"),
+        _num(results, "Retentate Flow"), _num(results, "Retentate CO2"), _num(results, "Permeate Pressure"),
+        _num(results, "Permeate Flow"), _num(results, "Permeate CO2"), _num(results, "Permeate O2"),
+        _num(results, "Ambient Temperature"), _text(results, "Analyzer"), _text(results, "Rig"),
+        [initials] * n, [notes] * n, _text(results, "Passed", passed),
+        results["C-CO2 Perm"], results["C - N2 perm"], results["C - Selectivity"],
+        results["C - CO2 Flux"], results["C - stage cut"],
+    )]
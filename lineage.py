@@ -0,0 +1,222 @@
+# Material lineage across the process chain.
+#
+# Every row of the tabs below is a node (kind, ID); its FK columns become edges
+# pointing downstream, from fiber batch through spools, coating runs and
+# modules to test results. The adjacency sets are kept in memory, so a
+# traceability query is a breadth-first walk over dicts. The index follows the
+# tab snapshots: appended rows only add edges, while a reloaded tab rebuilds the
+# adjacency from the per-tab edge lists.
+
+import threading
+import time
+from collections import defaultdict, deque
+
+import gspread
+
+from gsheets import RD_SHEET_NAME, UNCOATED_FIBER_SHEET_URL, open_spreadsheet, get_worksheet
+from snapshots import snapshot
+
+WORKBOOKS = {
+    "rd": {"name": RD_SHEET_NAME},
+    "uncoated": {"url": UNCOATED_FIBER_SHEET_URL},
+}
+
+# (workbook, tab, key column, node kind, [(FK column, FK kind, direction)])
+# "from": the referenced node feeds this row; "to": this row feeds the referenced node
+LINKS = [
+    ("uncoated", "Uncoated Fiber Data Tbl", "Batch_Fiber_ID", "batch", []),
+    ("uncoated", "As Received UnCoatedSpools Tbl", "Received_Spool_PK", "received_spool", [
+        ("Batch_Fiber_ID", "batch", "from"), ("UncoatedSpool_ID", "uncoated_spool", "to")]),
+    ("uncoated", "Combined Spools Tbl", "Combined_SpoolsPK", "combined_spool", [
+        ("Received_Spool_PK", "received_spool", "from"), ("UncoatedSpool_ID", "uncoated_spool", "to")]),
+    ("rd", "Coated Spool Tbl", "CoatedSpool_ID", "coated_spool", [
+        ("UnCoatedSpool_ID", "uncoated_spool", "from")]),
+    ("rd", "Pilot Coating Process Tbl", "PCoating ID", "pcoating", [
+        ("Solution ID", "solution", "from")]),
+    ("rd", "Dip Coating Process Tbl", "DCoating_ID", "dcoating", [
+        ("Solution_ID", "solution", "from")]),
+    ("rd", "Fiber per Coating Run Tbl (Coating)", "FiberCoat_ID", "fiber_coat", [
+        ("PCoating_ID", "pcoating", "from"), ("CoatedSpool_ID", "coated_spool", "to")]),
+    ("rd", "Spools per Wind Tbl", "SpoolPerWind PK", "spool_per_wind", [
+        ("Coated Spool ID", "coated_spool", "from"), ("MFG DB Wind ID (FK)", "wound_module", "to")]),
+    ("rd", "Wound Module Tbl", "Wound Module ID", "wound_module", [
+        ("Module ID (FK)", "module", "to")]),
+    ("rd", "Mini Module Tbl", "Mini Module ID", "mini_module", [
+        ("Batch_Fiber_ID", "batch", "from"), ("UncoatedSpool_ID", "uncoated_spool", "from"),
+        ("CoatedSpool_ID", "coated_spool", "from"), ("DCoating_ID", "dcoating", "from"),
+        ("Module ID", "module", "to")]),
+    ("rd", "Module Tbl", "Module ID", "module", []),
+    ("rd", "Pressure Test Tbl", "Pressure Test ID", "pressure_test", [("Module ID", "module", "from")]),
+    ("rd", "Pure Gas Test Tbl", "Pure Gas Test ID", "pure_gas_test", [("Module ID", "module", "from")]),
+    ("rd", "Mixed Gas Test Tbl", "Mixed Gas Test ID", "mixed_gas_test", [("Module ID", "module", "from")]),
+    ("rd", "Leak Test Tbl", "Leak Test ID", "leak_test", [("Module ID", "module", "from")]),
+    ("rd", "Module Failures Tbl", "Module Failure ID", "module_failure", [("Module ID", "module", "from")]),
+]
+
+# Snapshots are tail-fetched at most this often for the index
+REFRESH_SECONDS = 30
+
+
+def _clean(value):
+    return str(value).strip()
+
+
+def _row_edges(cols, row, key_col, kind, fks):
+    """The node and edges contributed by one sheet row; cols maps header -> index."""
+    def cell(name):
+        i = cols.get(name)
+        return _clean(row[i]) if i is not None and i < len(row) else ""
+
+    key = cell(key_col)
+    if not key:
+        return None, []
+    node = (kind, key)
+    edges = []
+    for column, fk_kind, direction in fks:
+        ref = cell(column)
+        if ref:
+            edges.append(((fk_kind, ref), node) if direction == "from" else (node, (fk_kind, ref)))
+    return node, edges
+
+
+class _TabState:
+    def __init__(self, table):
+        self.table = table
+        self.rows = 0
+        self.nodes = []
+        self.edges = []
+
+
+class LineageIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._tabs = {}
+        self._reset()
+        self.refreshed_at = 0.0
+        self.missing_tabs = []
+        self.build_seconds = 0.0
+
+    def _reset(self):
+        self.down = defaultdict(set)
+        self.up = defaultdict(set)
+        self.by_id = defaultdict(set)
+
+    def _add_node(self, node):
+        self.by_id[node[1]].add(node)
+
+    def _add_edge(self, src, dst):
+        self.down[src].add(dst)
+        self.up[dst].add(src)
+        self._add_node(src)
+        self._add_node(dst)
+
+    def _ingest(self, state, spec, header, rows):
+        _, _, key_col, kind, fks = spec
+        cols = {name.strip(): i for i, name in enumerate(header)}
+        for row in rows:
+            node, edges = _row_edges(cols, row, key_col, kind, fks)
+            if node is None:
+                continue
+            state.nodes.append(node)
+            state.edges.extend(edges)
+            self._add_node(node)
+            for src, dst in edges:
+                self._add_edge(src, dst)
+
+    def refresh(self, force=False):
+        """Pull new rows of every lineage tab; returns True if the graph changed."""
+        with self._refresh_lock:
+            if not force and time.time() - self.refreshed_at < REFRESH_SECONDS:
+                return False
+            started = time.perf_counter()
+            # Network reads happen outside the graph lock so queries never wait on them
+            tables, missing, spreadsheets = [], [], {}
+            for spec in LINKS:
+                workbook, tab = spec[0], spec[1]
+                try:
+                    if workbook not in spreadsheets:
+                        spreadsheets[workbook] = open_spreadsheet(**WORKBOOKS[workbook])
+                    tables.append((spec, snapshot(get_worksheet(spreadsheets[workbook], tab))))
+                except gspread.exceptions.WorksheetNotFound:
+                    missing.append(tab)
+
+            changed, rebuild = False, False
+            with self._lock:
+                for spec, table in tables:
+                    state = self._tabs.get(spec[:2])
+                    if state is None or state.table is not table:
+                        # First load or full reload of the tab: its old edges may be stale
+                        rebuild = rebuild or state is not None
+                        state = self._tabs[spec[:2]] = _TabState(table)
+                    data = table.values[1:]
+                    if len(data) > state.rows:
+                        self._ingest(state, spec, table.values[0], data[state.rows:])
+                        state.rows = len(data)
+                        changed = True
+                if rebuild:
+                    self._reset()
+                    for state in self._tabs.values():
+                        for node in state.nodes:
+                            self._add_node(node)
+                        for src, dst in state.edges:
+                            self._add_edge(src, dst)
+                self.missing_tabs = missing
+            self.refreshed_at = time.time()
+            self.build_seconds = time.perf_counter() - started
+            return changed or rebuild
+
+    def _walk(self, node, adjacency, kind=None):
+        seen = {node: 0}
+        queue = deque([node])
+        while queue:
+            current = queue.popleft()
+            for nxt in adjacency.get(current, ()):
+                if nxt not in seen:
+                    seen[nxt] = seen[current] + 1
+                    queue.append(nxt)
+        del seen[node]
+        return {n: d for n, d in seen.items() if kind is None or n[0] == kind}
+
+    def upstream(self, node, kind=None):
+        """Every node that fed `node`, with its distance in hops."""
+        with self._lock:
+            return self._walk(node, self.up, kind)
+
+    def downstream(self, node, kind=None):
+        """Every node made from `node`, with its distance in hops."""
+        with self._lock:
+            return self._walk(node, self.down, kind)
+
+    def find(self, node_id):
+        """All nodes (of any kind) with this ID."""
+        with self._lock:
+            return sorted(self.by_id.get(_clean(node_id), ()))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "nodes": sum(len(nodes) for nodes in self.by_id.values()),
+                "edges": sum(len(v) for v in self.down.values()),
+                "tabs": len(self._tabs),
+                "missing_tabs": list(self.missing_tabs),
+                "build_seconds": self.build_seconds,
+            }
+
+
+index = LineageIndex()
+
+
+def get_index(force=False):
+    index.refresh(force=force)
+    return index
+
+
+def modules_using(batch_fiber_id):
+    """Modules built from a fiber batch, e.g. modules_using("B-17")."""
+    return sorted(n[1] for n in get_index().downstream(("batch", _clean(batch_fiber_id)), "module"))
+
+
+def batches_feeding(module_id):
+    """Fiber batches that fed a module, e.g. batches_feeding("MOD-123")."""
+    return sorted(n[1] for n in get_index().upstream(("module", _clean(module_id)), "batch"))
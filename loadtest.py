@@ -0,0 +1,380 @@
+# Concurrent-session load test of the form submits.
+#
+#     python loadtest.py                                     # every scenario, 8 sessions x 5 submits
+#     python loadtest.py --scenario pure_gas --sessions 20 --submits 10 --latency 0.2
+#
+# Each simulated operator is an AppTest of the real form script running in
+# its own process: AppTest swaps process-wide Streamlit state on every run, so
+# sessions cannot share one. The in-memory workbook from bench.py lives in a
+# manager process and every session talks to it through RemoteClient, which
+# sleeps --latency seconds and then forwards the call; the workbook applies
+# calls atomically, as Google applies requests one at a time. The primary
+# keys come from one SequenceAllocator in the manager process too, as they
+# would from the one in a server process, and the sessions share one
+# write-queue journal, each with its own flusher. They render once, wait for
+# each other and then submit as fast as they can.
+#
+# Every submit writes a unique token into its Notes cell. When the sessions
+# are done the write queue is drained and the rows appended during the run
+# are checked: a primary key whose rows carry more than one token was handed
+# to two submits (duplicate), an acknowledged token with fewer rows than the
+# submit wrote was lost and one with more was written twice (repeated). A row
+# without a token cannot be accounted for and fails the run too.
+# Reports p50/p95 submit latency (the click until the page has rerendered),
+# submits per second and API calls; exits non-zero on any of the above.
+
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from collections import namedtuple
+from multiprocessing.managers import BaseManager
+
+import bench  # sets up the scratch write queue before the forms' modules are imported
+
+import pandas as pd  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import sequences  # noqa: E402
+import write_queue  # noqa: E402
+
+RD_SOURCE = f"name:{bench.gsheets.RD_SHEET_NAME}"
+DRAIN_SECONDS = 120
+
+# AppTest leaves the last page it ran in sys.modules["__main__"]; spawned processes need the real one back
+_MAIN = sys.modules["__main__"]
+
+
+# --- SHARED WORKBOOK ---
+# A spreadsheet (sheet_id None) or worksheet as it crosses the process boundary
+_Handle = namedtuple("_Handle", "source sheet_id title")
+
+
+class Workbook:
+    """A bench.FakeClient served to every session process; `path` is (source,) or (source, sheet id)."""
+
+    def __init__(self, seeds):
+        self.client = bench.FakeClient(seeds)
+        self.allocator = sequences.SequenceAllocator()
+
+    def _target(self, path):
+        if path is None:
+            return self.client
+        book = self.client._book(path[0])
+        if len(path) == 1:
+            return book
+        return next(worksheet for worksheet in book._sheets if worksheet.id == path[1])
+
+    def call(self, path, method, args, kwargs):
+        return _handles(getattr(self._target(path), method)(*args, **kwargs))
+
+    def attribute(self, path, name):
+        return getattr(self._target(path), name)
+
+    def sequence(self, path, method, args, kwargs):
+        worksheet = self._target(path) if path is not None else None
+        return getattr(self.allocator, method)(worksheet, *args, **kwargs)
+
+    def total(self):
+        return self.client.total()
+
+    def rows(self, source, title):
+        return [list(row) for row in self.client._book(source).tabs().get(title, [])]
+
+
+def _handles(value):
+    if isinstance(value, bench.FakeSpreadsheet):
+        return _Handle(value.source, None, value.title)
+    if isinstance(value, bench.FakeWorksheet):
+        return _Handle(value.spreadsheet.source, value.id, value.title)
+    if isinstance(value, list) and value and isinstance(value[0], (bench.FakeSpreadsheet, bench.FakeWorksheet)):
+        return [_handles(item) for item in value]
+    return value
+
+
+class _WorkbookManager(BaseManager):
+    pass
+
+
+_WorkbookManager.register("Workbook", Workbook)
+
+
+class _Remote:
+    """Forwards every method call to the shared workbook after the simulated latency."""
+
+    def __init__(self, client, path):
+        self._client = client
+        self._path = path
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            if self._client.latency:
+                time.sleep(self._client.latency)
+            return self._client._wrap(self._client.workbook.call(self._path, name, args, kwargs))
+
+        return call
+
+
+class RemoteSpreadsheet(_Remote):
+    def __init__(self, client, source):
+        super().__init__(client, (source,))
+        self.client = client
+        self.source = source
+        self.id = client.workbook.attribute(self._path, "id")
+        self.title = client.workbook.attribute(self._path, "title")
+        self.url = client.workbook.attribute(self._path, "url")
+
+
+class RemoteWorksheet(_Remote):
+    def __init__(self, spreadsheet, handle):
+        super().__init__(spreadsheet.client, (handle.source, handle.sheet_id))
+        self.spreadsheet = spreadsheet
+        self.client = spreadsheet.client
+        self.id = handle.sheet_id
+        self.title = handle.title
+
+    @property
+    def row_count(self):
+        return self.client.workbook.attribute(self._path, "row_count")
+
+    @property
+    def col_count(self):
+        return self.client.workbook.attribute(self._path, "col_count")
+
+
+class _SharedAllocator:
+    """sequences.allocator of a session process, forwarding to the workbook's allocator."""
+
+    def __init__(self, workbook):
+        self._workbook = workbook
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(worksheet=None, *args, **kwargs):
+            return self._workbook.sequence(None if worksheet is None else worksheet._path, name, args, kwargs)
+
+        return call
+
+
+class RemoteClient(_Remote):
+    """Stand-in for an authorized gspread.Client whose workbook lives in the manager process."""
+
+    def __init__(self, workbook, latency=0.0):
+        super().__init__(self, None)
+        self.workbook = workbook
+        self.latency = latency
+        self.expiry = bench.datetime.utcnow() + bench.timedelta(days=365)
+        self.http_client = bench._FakeHTTPClient()
+        self._books = {}
+
+    def _wrap(self, value):
+        if isinstance(value, list) and value and isinstance(value[0], _Handle):
+            return [self._wrap(item) for item in value]
+        if not isinstance(value, _Handle):
+            return value
+        if value.source not in self._books:
+            self._books[value.source] = RemoteSpreadsheet(self, value.source)
+        book = self._books[value.source]
+        return book if value.sheet_id is None else RemoteWorksheet(book, value)
+
+
+def _widget(elements, label, last=False):
+    matches = [w for w in elements if w.label == label]
+    if not matches:
+        raise LookupError(f"no widget labelled {label!r}")
+    return matches[-1] if last else matches[0]
+
+
+def _click(app, label):
+    """Click a button and rerun; returns the seconds until the page has rendered again."""
+    _widget(app.button, label).click()
+    started = time.perf_counter()
+    app.run()
+    return time.perf_counter() - started
+
+
+def _submit_pure_gas(app, token):
+    _widget(app.text_input, "Operator Initials").input("LT")
+    _widget(app.text_area, "Notes").input(token)
+    for i, (feed, flow) in enumerate([(50.0, 12.0), (50.0, 1.5)], start=1):
+        _widget(app.number_input, f"Feed Pressure (psi) {i}").set_value(feed)
+        _widget(app.number_input, f"Flow (mL/min) {i}").set_value(flow)
+    return _click(app, "💾 Submit")
+
+
+def _submit_leak(app, token):
+    # The module entry form above has a "Notes" box too
+    _widget(app.text_area, "Notes", last=True).input(token)
+    _widget(app.text_input, "Operator Initials", last=True).input("LT")
+    _click(app, "➕ Add Leak Point")
+    return _click(app, "💧 Submit All Leak Points")
+
+
+def _submit_pressure(app, token):
+    _widget(app.text_area, "Notes").input(token)
+    _widget(app.text_input, "Operator Initials").input("LT")
+    _click(app, "Continue to Measurements")
+    _widget(app.selectbox, "Passed?").select("Yes")
+    return _click(app, "💾 Submit All (with above Pass/Fail)")
+
+
+# name -> form script, tab written, primary key column, rows per submit, driver
+SCENARIOS = {
+    "pure_gas": {"page": "Pure Gas Test Form.py", "tab": "Pure Gas Test Tbl", "key": "Pure Gas Test ID",
+                 "rows": 2, "submit": _submit_pure_gas},
+    "leak": {"page": "Module Management Form.py", "tab": "Leak Test Tbl", "key": "Leak Test ID",
+             "rows": 1, "submit": _submit_leak},
+    "pressure": {"page": "Testing Form.py", "tab": "Pressure Test Tbl", "key": "Pressure Test ID",
+                 "rows": 2, "submit": _submit_pressure},
+}
+
+
+def _errors(app):
+    errors = [str(e.value) for e in app.exception] + [str(e.value) for e in app.error]
+    return "; ".join(errors)[:200]
+
+
+def _session(workbook, latency, name, index, submits, start, done, results):
+    """One operator, run in its own process; keeps the process (and its flusher) up until `done` is set."""
+    bench._reset(RemoteClient(workbook, latency))
+    sequences.allocator = _SharedAllocator(workbook)
+    scenario = SCENARIOS[name]
+    app = AppTest.from_file(os.path.join(bench.HERE, scenario["page"]), default_timeout=bench.RUN_TIMEOUT)
+    try:
+        app.run()
+        failed = _errors(app)
+    except Exception as e:
+        failed = f"{type(e).__name__}: {e}"[:200]
+    start.wait()
+    for k in range(submits):
+        token = f"load-{index}-{k}"
+        try:
+            if failed:
+                raise RuntimeError(f"first render failed: {failed}")
+            seconds = scenario["submit"](app, token)
+            error = _errors(app)
+        except Exception as e:
+            seconds, error = None, f"{type(e).__name__}: {e}"[:200]
+        results.put({"session": index, "token": token, "seconds": seconds, "error": error})
+    done.wait()
+
+
+def drain(timeout=DRAIN_SECONDS):
+    """Flush the write queue until it is empty; False if entries are still pending or failed."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        write_queue.flush_once()
+        status = write_queue.queue_status()
+        if not status["pending"]:
+            return not status["failed"]
+        time.sleep(0.1)
+    return False
+
+
+def check_rows(rows, start, key, expected):
+    """Duplicate keys, lost and repeated tokens and untagged rows among the rows of a tab from index `start` on.
+
+    `expected` maps each acknowledged token to the rows its submit wrote.
+    """
+    header = [str(h).strip() for h in rows[0]] if rows else []
+    written = rows[max(start, 1):]
+    if key not in header or "Notes" not in header:
+        return [], sorted(expected), [], len(written)
+    key_col, token_col = header.index(key), header.index("Notes")
+    tokens_by_key, found, untagged = {}, {}, 0
+    for row in written:
+        token = row[token_col] if token_col < len(row) else ""
+        if not token.startswith("load-"):
+            untagged += 1
+            continue
+        tokens_by_key.setdefault(row[key_col], set()).add(token)
+        found[token] = found.get(token, 0) + 1
+    duplicates = sorted(k for k, tokens in tokens_by_key.items() if len(tokens) > 1)
+    lost = sorted(t for t, n in expected.items() if found.get(t, 0) < n)
+    repeated = sorted(t for t, n in expected.items() if found.get(t, 0) > n)
+    return duplicates, lost, repeated, untagged
+
+
+def run(name, schema, used, sessions, submits, rows, latency):
+    """Run one scenario against a freshly seeded workbook; `schema` and `used` come from bench.discover()."""
+    scenario = SCENARIOS[name]
+    tabs = used[scenario["page"]] | {(RD_SOURCE, scenario["tab"])}
+    seeds = bench._by_source(bench.synthetic_rows(schema, [t for t in tabs if t in schema], rows))
+    start_row = len(seeds.get(RD_SOURCE, {}).get(scenario["tab"], []))
+
+    sys.modules["__main__"] = _MAIN
+    ctx = multiprocessing.get_context("spawn")
+    manager = _WorkbookManager(ctx=ctx)
+    manager.start()
+    try:
+        workbook = manager.Workbook(seeds)
+        # This process only drains the journal and reads the tab back
+        bench._reset(RemoteClient(workbook))
+        start, done, queued = ctx.Barrier(sessions + 1), ctx.Event(), ctx.Queue()
+        processes = [ctx.Process(target=_session, args=(workbook, latency, name, i, submits, start, done, queued), daemon=True)
+                     for i in range(sessions)]
+        for process in processes:
+            process.start()
+        start.wait(timeout=bench.RUN_TIMEOUT)
+        calls_before = workbook.total()
+        started = time.perf_counter()
+        try:
+            results = [queued.get(timeout=bench.RUN_TIMEOUT) for _ in range(sessions * submits)]
+        except queue.Empty:
+            raise RuntimeError("a session process stopped without reporting its submits") from None
+        elapsed = time.perf_counter() - started
+        calls = workbook.total() - calls_before
+        drained = drain()
+        done.set()
+        for process in processes:
+            process.join()
+        tab = workbook.rows(RD_SOURCE, scenario["tab"])
+    finally:
+        manager.shutdown()
+
+    submitted = pd.DataFrame(results)
+    ok = submitted[submitted["error"] == ""]
+    expected = {token: scenario["rows"] for token in ok["token"]}
+    duplicates, lost, repeated, untagged = check_rows(tab, start_row, scenario["key"], expected)
+    latencies = ok["seconds"].astype(float)
+    return {
+        "scenario": name, "sessions": sessions, "submits": len(submitted), "ok": len(ok), "failed": len(submitted) - len(ok),
+        "p50_s": round(latencies.quantile(0.5), 3) if len(ok) else None,
+        "p95_s": round(latencies.quantile(0.95), 3) if len(ok) else None,
+        "max_s": round(latencies.max(), 3) if len(ok) else None,
+        "submits_per_s": round(len(ok) / elapsed, 2) if elapsed else None,
+        "api_calls": calls, "calls_per_submit": round(calls / len(submitted), 1) if len(submitted) else None,
+        "drained": drained, "duplicate_keys": len(duplicates), "lost_submits": len(lost),
+        "repeated_submits": len(repeated), "untagged_rows": untagged,
+        "examples": ", ".join(duplicates[:3] + lost[:3] + repeated[:3]),
+        "errors": "; ".join(sorted(set(submitted.loc[submitted["error"] != "", "error"])))[:200],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive concurrent sessions through the form submits and check the keys.")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="scenario to run (repeatable; default: all)")
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent sessions (default: %(default)s)")
+    parser.add_argument("--submits", type=int, default=5, help="submits per session (default: %(default)s)")
+    parser.add_argument("--rows", type=int, default=1000, help="seeded rows per tab (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per fake API call (default: %(default)s)")
+    args = parser.parse_args()
+
+    # The forms read each other's tabs (module labels come from three of them), so learn every page's headers
+    schema, used = bench.discover(bench.form_pages())
+    results = [run(name, schema, used, args.sessions, args.submits, args.rows, args.latency)
+               for name in args.scenario or SCENARIOS]
+    print(pd.DataFrame(results).fillna("").to_string(index=False))
+    if any(r["duplicate_keys"] or r["lost_submits"] or r["repeated_submits"] or r["untagged_rows"] or not r["drained"] for r in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
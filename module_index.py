@@ -0,0 +1,68 @@
+# Module display labels shared by the test forms.
+#
+# A module is shown as "MOD-001 | Mini | <label>", the label coming from Mini
+# Module Tbl ("Module Label") or Wound Module Tbl ("Wound Module ID"). The index
+# is built with two left merges instead of filtering both tabs once per module,
+# and is rebuilt only when the snapshot of one of the three tabs changes.
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from gsheets import get_worksheet
+from snapshots import snapshot, table_records
+
+TAB_MODULE = "Module Tbl"
+TAB_WOUND = "Wound Module Tbl"
+TAB_MINI = "Mini Module Tbl"
+NO_LABEL = "—"
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def _columns(df, columns):
+    df = df.copy()
+    for col in columns:
+        if col not in df.columns:
+            df[col] = ""
+    return df[columns]
+
+
+def _labels(df, key_col, label_col, name):
+    # First row per module wins, as the per-row lookups used to do
+    df = _columns(df, [key_col, label_col])
+    out = pd.DataFrame({"_key": df[key_col].astype(str), name: df[label_col].astype(str)})
+    return out.drop_duplicates("_key", keep="first")
+
+
+def build_label_index(module_df, wound_df, mini_df):
+    """One row per module: Module ID, Module Type, Type (normalised), Label, Display."""
+    modules = _columns(module_df, ["Module ID", "Module Type"])
+    modules["_key"] = modules["Module ID"].astype(str)
+    modules["Type"] = modules["Module Type"].astype(str).str.strip().str.lower()
+
+    index = (modules
+             .merge(_labels(mini_df, "Module ID", "Module Label", "_mini"), on="_key", how="left")
+             .merge(_labels(wound_df, "Module ID (FK)", "Wound Module ID", "_wound"), on="_key", how="left"))
+    label = np.where(index["Type"] == "mini", index["_mini"],
+                     np.where(index["Type"] == "wound", index["_wound"], None))
+    index["Label"] = pd.Series(label, index=index.index, dtype=object).fillna(NO_LABEL).astype(str)
+    index["Display"] = index["_key"] + " | " + index["Type"].str.capitalize() + " | " + index["Label"]
+    return index[["Module ID", "Module Type", "Type", "Label", "Display"]]
+
+
+def module_label_index(spreadsheet):
+    """Cached label index for a workbook; shared between sessions, so treat it as read-only."""
+    tables = [snapshot(get_worksheet(spreadsheet, tab)) for tab in (TAB_MODULE, TAB_WOUND, TAB_MINI)]
+    versions = tuple(table.version for table in tables)
+    with _lock:
+        cached = _cache.get(spreadsheet.id)
+        if cached and cached[0] == versions:
+            return cached[1]
+    module_df, wound_df, mini_df = (pd.DataFrame(table_records(table)) for table in tables)
+    index = build_label_index(module_df, wound_df, mini_df)
+    with _lock:
+        _cache[spreadsheet.id] = (versions, index)
+    return index
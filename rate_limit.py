@@ -0,0 +1,160 @@
+# Process-wide rate limiting for the Sheets API.
+#
+# Google meters read and write requests separately, per minute. install()
+# routes every request the gspread HTTP client sends through one of two token
+# buckets (GET = read, anything else = write), so a burst from a dozen open
+# forms turns into short waits instead of 429 errors. Waiters are served by
+# priority: writes first, then interactive reads, then review-panel reads,
+# which also leave a reserve of read tokens untouched. A 429 that still gets
+# through (another process sharing the quota) empties the bucket for a backoff
+# period and the request is retried instead of failing.
+
+import contextlib
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+
+READS_PER_MINUTE = float(os.environ.get("RD_SHEETS_READS_PER_MINUTE", "60"))
+WRITES_PER_MINUTE = float(os.environ.get("RD_SHEETS_WRITES_PER_MINUTE", "60"))
+# Bucket size as a fraction of the per-minute budget: how much of it a burst may use at once
+BURST_FRACTION = 0.25
+# Share of the read bucket that review-panel reads may not dip into
+REVIEW_RESERVE = 0.25
+# 429 retries, with exponential backoff from BACKOFF_SECONDS up to BACKOFF_MAX_SECONDS
+MAX_RETRIES = 6
+BACKOFF_SECONDS = 2.0
+BACKOFF_MAX_SECONDS = 64.0
+
+# Priorities, lowest number served first
+WRITE, READ, REVIEW = 0, 1, 2
+
+_local = threading.local()
+_install_lock = threading.Lock()
+_installed = False
+
+
+class TokenBucket:
+    def __init__(self, name, per_minute, burst_fraction=BURST_FRACTION, reserve=0.0):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, per_minute * burst_fraction)
+        self.reserve = self.capacity * reserve
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+        self.granted = 0
+        self.delayed = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.throttled = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority=READ):
+        """Take one token, waiting behind higher-priority callers; returns the seconds waited."""
+        started = time.monotonic()
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            floor = 1.0 + (self.reserve if priority >= REVIEW else 0.0)
+            while True:
+                self._refill()
+                if self._waiting[0] == ticket:
+                    if self.tokens >= floor:
+                        heapq.heappop(self._waiting)
+                        self.tokens -= 1.0
+                        break
+                    self._cond.wait((floor - self.tokens) / self.rate)
+                else:
+                    self._cond.wait()
+            waited = time.monotonic() - started
+            self.granted += 1
+            if waited > 0.05:
+                self.delayed += 1
+                self.wait_seconds += waited
+                self.max_wait = max(self.max_wait, waited)
+            self._cond.notify_all()
+        return waited
+
+    def penalize(self, seconds):
+        """Hand out nothing for `seconds`, e.g. after Google answered 429."""
+        with self._cond:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+            self.throttled += 1
+            self._cond.notify_all()
+
+    def metrics(self):
+        with self._cond:
+            self._refill()
+            return {
+                "bucket": self.name, "per_minute": round(self.rate * 60), "capacity": self.capacity,
+                "available": round(max(self.tokens, 0.0), 2), "waiting": len(self._waiting),
+                "granted": self.granted, "delayed": self.delayed, "wait_seconds": round(self.wait_seconds, 2),
+                "max_wait": round(self.max_wait, 2), "throttled_429": self.throttled,
+            }
+
+
+reads = TokenBucket("read", READS_PER_MINUTE, reserve=REVIEW_RESERVE)
+writes = TokenBucket("write", WRITES_PER_MINUTE)
+
+
+@contextlib.contextmanager
+def review_priority():
+    """Reads in this block yield to interactive reads and leave them a reserve."""
+    previous = getattr(_local, "priority", READ)
+    _local.priority = REVIEW
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def _is_read(method, endpoint):
+    return method.upper() == "GET" or "GetByDataFilter" in endpoint or "getByDataFilter" in endpoint
+
+
+def _limited(request):
+    def limited_request(self, method, endpoint, *args, **kwargs):
+        if _is_read(method, endpoint):
+            bucket, priority = reads, getattr(_local, "priority", READ)
+        else:
+            bucket, priority = writes, WRITE
+        for attempt in range(MAX_RETRIES + 1):
+            bucket.acquire(priority)
+            try:
+                return request(self, method, endpoint, *args, **kwargs)
+            except APIError as e:
+                if getattr(e, "code", None) != 429 or attempt == MAX_RETRIES:
+                    raise
+                delay = min(BACKOFF_MAX_SECONDS, BACKOFF_SECONDS * 2 ** attempt)
+                bucket.penalize(delay * random.uniform(0.8, 1.2))
+
+    limited_request.__rate_limited__ = True
+    return limited_request
+
+
+def install():
+    """Route every gspread request through the buckets, once per process."""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        if not getattr(HTTPClient.request, "__rate_limited__", False):
+            HTTPClient.request = _limited(HTTPClient.request)
+        _installed = True
+
+
+def metrics():
+    return [reads.metrics(), writes.metrics()]
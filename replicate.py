@@ -0,0 +1,195 @@
+# Replicate the R&D Google Sheets into a local SQLite database.
+#
+#     python replicate.py                # incremental sync of every tab
+#     python replicate.py --full         # reload everything from scratch
+#     python replicate.py --tab "Module Tbl" --db /tmp/replica.sqlite3
+#
+# Every "... Tbl" tab of the R&D Data Form, Solution Management and Uncoated
+# Fiber workbooks (plus the Syensqo supplier tab) becomes one indexed table. A
+# per-table watermark records the last sheet row copied and its contents; the
+# next run reads the header plus everything from that row down in one call and
+# only inserts the new rows. If the header or the watermark row changed, the
+# table is rebuilt from a full read. Credentials come from the same
+# .streamlit/secrets.toml the forms use, so no Streamlit server is needed.
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+
+from gsheets import RD_SHEET_NAME, SOLUTION_SHEET_KEY, UNCOATED_FIBER_SHEET_URL, open_spreadsheet
+from storage import SQLiteBackend, identifier
+from syensqo_ingest import FIRST_ROW as SYENSQO_FIRST_ROW, SYENSQO_HEADERS
+
+REPLICA_PATH = os.environ.get("RD_REPLICA_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rd_replica.sqlite3"))
+
+# (alias, open_spreadsheet kwargs); the alias prefixes tables whose tab name is already taken
+SOURCES = [
+    ("rd", {"name": RD_SHEET_NAME}),
+    ("solution", {"key": SOLUTION_SHEET_KEY}),
+    ("uncoated", {"url": UNCOATED_FIBER_SHEET_URL}),
+]
+
+# Tabs that are not "... Tbl" tables: fixed headers and the first sheet row holding data
+EXTRA_TABS = {
+    "Syensqo": {
+        "headers": SYENSQO_HEADERS,
+        "first_row": SYENSQO_FIRST_ROW,
+    },
+}
+
+_WATERMARKS = """
+CREATE TABLE IF NOT EXISTS replication_watermarks (
+    table_name TEXT PRIMARY KEY,
+    spreadsheet_id TEXT NOT NULL,
+    tab TEXT NOT NULL,
+    header TEXT NOT NULL,
+    columns TEXT NOT NULL,
+    last_row INTEGER NOT NULL,
+    last_values TEXT NOT NULL,
+    synced_at REAL NOT NULL
+)
+"""
+
+
+def _trimmed(row):
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+def _end_column(worksheet, width):
+    return rowcol_to_a1(1, max(worksheet.col_count, width, 1)).rstrip("0123456789")
+
+
+def _is_replicated(title):
+    return title.strip().endswith("Tbl") or title.strip() in EXTRA_TABS
+
+
+def _first_data_row(worksheet):
+    return EXTRA_TABS.get(worksheet.title.strip(), {}).get("first_row", 2)
+
+
+def _columns(worksheet, values):
+    """Column headers for a tab, widened so cells past the last header are kept."""
+    extra = EXTRA_TABS.get(worksheet.title.strip())
+    headers = list(extra["headers"]) if extra else [str(h).strip() for h in (values[0] if values else [])]
+    width = max([len(headers), 1] + [len(row) for row in values[_first_data_row(worksheet) - 1:]])
+    return headers + [""] * (width - len(headers))
+
+
+class Replicator:
+    def __init__(self, path=REPLICA_PATH):
+        self.path = path
+        self.backend = SQLiteBackend(path)
+        with self.backend.connection() as conn:
+            conn.execute(_WATERMARKS)
+        self._claimed = {}
+
+    def _watermark(self, table_name):
+        with self.backend.connection() as conn:
+            row = conn.execute("SELECT * FROM replication_watermarks WHERE table_name = ?", (table_name,)).fetchone()
+        if row is None:
+            return None
+        return {"header": json.loads(row[3]), "columns": json.loads(row[4]),
+                "last_row": row[5], "last_values": json.loads(row[6])}
+
+    def _save_watermark(self, table_name, worksheet, header, columns, last_row, last_values):
+        with self.backend.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO replication_watermarks VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (table_name, worksheet.spreadsheet.id, worksheet.title, json.dumps(_trimmed(header)),
+                 json.dumps(columns), last_row, json.dumps(_trimmed(last_values)), time.time()),
+            )
+
+    def table_name(self, alias, worksheet):
+        name = identifier(worksheet.title)
+        me = (worksheet.spreadsheet.id, worksheet.title)
+        if name not in self._claimed:
+            with self.backend.connection() as conn:
+                row = conn.execute("SELECT spreadsheet_id, tab FROM replication_watermarks WHERE table_name = ?", (name,)).fetchone()
+            self._claimed[name] = tuple(row) if row else me
+        if self._claimed[name] != me:
+            name = identifier(f"{alias} {worksheet.title}")
+        return name
+
+    def _full(self, table_name, worksheet):
+        values = worksheet.get_all_values()
+        columns = _columns(worksheet, values)
+        rows = values[_first_data_row(worksheet) - 1:]
+        self.backend.replace_table(table_name, columns, rows)
+        self._save_watermark(table_name, worksheet, values[0] if values else [], columns,
+                             len(values), values[-1] if values else [])
+        return len(rows)
+
+    def sync_tab(self, alias, worksheet, full=False):
+        """Copy new rows of one tab; returns (table name, rows written, 'incremental' | 'full')."""
+        table_name = self.table_name(alias, worksheet)
+        mark = None if full else self._watermark(table_name)
+        if mark is None or mark["last_row"] < _first_data_row(worksheet):
+            return table_name, self._full(table_name, worksheet), "full"
+
+        columns = mark["columns"]
+        header, tail = worksheet.batch_get(["1:1", f"A{mark['last_row']}:{_end_column(worksheet, len(columns))}"])
+        header = header[0] if header else []
+        tail = [list(row) for row in tail]
+        new_rows = tail[1:]
+        if (_trimmed(header) != mark["header"]
+                or not tail or _trimmed(tail[0]) != mark["last_values"]
+                or any(len(row) > len(columns) for row in new_rows)):
+            return table_name, self._full(table_name, worksheet), "full"
+
+        if new_rows:
+            self.backend.open_table(table_name, columns).append_rows(new_rows)
+        self._save_watermark(table_name, worksheet, header, columns, mark["last_row"] + len(new_rows), tail[-1])
+        return table_name, len(new_rows), "incremental"
+
+    def sync(self, full=False, tabs=None):
+        results = []
+        for alias, source in SOURCES:
+            spreadsheet = open_spreadsheet(**source)
+            for worksheet in spreadsheet.worksheets():
+                if not _is_replicated(worksheet.title):
+                    continue
+                if tabs and worksheet.title.strip() not in tabs:
+                    continue
+                started = time.perf_counter()
+                try:
+                    table_name, n_rows, mode = self.sync_tab(alias, worksheet, full=full)
+                    results.append((worksheet.title, table_name, mode, n_rows, time.perf_counter() - started, ""))
+                except Exception as e:
+                    results.append((worksheet.title, identifier(worksheet.title), "error", 0, time.perf_counter() - started, str(e)))
+        return results
+
+
+def query(sql, params=(), path=REPLICA_PATH):
+    """Run read-only SQL against the replica and return a DataFrame."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replicate the R&D Google Sheets into a local SQLite database.")
+    parser.add_argument("--db", default=REPLICA_PATH, help="SQLite file to write (default: %(default)s)")
+    parser.add_argument("--full", action="store_true", help="ignore watermarks and reload every table")
+    parser.add_argument("--tab", action="append", help="only sync this tab (repeatable)")
+    args = parser.parse_args()
+
+    results = Replicator(args.db).sync(full=args.full, tabs=set(args.tab) if args.tab else None)
+    for tab, table_name, mode, n_rows, seconds, error in results:
+        line = f"{tab:<35} -> {table_name:<35} {mode:<11} {n_rows:>6} rows  {seconds:6.2f}s"
+        print(f"{line}  {error}" if error else line)
+    if any(r[2] == "error" for r in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# Primary key -> sheet row number, per tab.
+#
+# Updating a row in place needs its row number. Instead of scanning records,
+# calling worksheet.find() (a full-sheet search that can match any column) or
+# trusting a DataFrame index that may be stale, each tab keeps a key -> row
+# dict built from its snapshot. Rows appended to the snapshot only add their
+# keys; a reloaded snapshot rebuilds the dict. locate() checks the key cell
+# with a one-cell read before a write is aimed at the row, and re-indexes once
+# from a fresh snapshot if the row has moved.
+#
+# upsert_row() edits a row in place with one range write. Given the version
+# (a hash of the cells) the edit started from, it reads the live row first and
+# refuses to write over a row someone else changed in the meantime.
+
+import hashlib
+import threading
+
+from gspread.utils import rowcol_to_a1
+
+from gsheets import append_rows, update_ranges
+from snapshots import invalidate, snapshot
+
+_lock = threading.Lock()
+_indexes = {}
+
+
+class RowConflict(Exception):
+    """The row changed after the edit was started; `current` holds its cells now."""
+
+    def __init__(self, key, current):
+        super().__init__(f"{key} was changed by someone else since it was loaded")
+        self.key = key
+        self.current = current
+
+
+def _clean(value):
+    return str(value).strip()
+
+
+class _RowIndex:
+    def __init__(self, table, column):
+        self.table = table
+        self.column = column
+        self.rows = 0
+        self.by_key = {}
+
+    def extend(self):
+        data = self.table.values[1:]
+        i = self.column - 1
+        for rownum, values in enumerate(data[self.rows:], start=self.rows + 2):
+            key = _clean(values[i]) if i < len(values) else ""
+            if key:
+                # The first row with a key wins, as the scans did
+                self.by_key.setdefault(key, rownum)
+        self.rows = len(data)
+
+
+def _key_column(table, key_column):
+    if key_column is None:
+        return 1
+    header = [_clean(h) for h in (table.values[0] if table.values else [])]
+    if key_column not in header:
+        raise KeyError(f"no column {key_column!r} in the header row")
+    return header.index(key_column) + 1
+
+
+def _index(worksheet, key_column):
+    table = snapshot(worksheet)
+    name = (worksheet.spreadsheet.id, worksheet.id, key_column)
+    with _lock:
+        index = _indexes.get(name)
+        if index is None or index.table is not table:
+            index = _indexes[name] = _RowIndex(table, _key_column(table, key_column))
+        if index.rows < len(table.values) - 1:
+            index.extend()
+        return index
+
+
+def row_number(worksheet, key, key_column=None):
+    """Row holding `key` in `key_column` (header name; default the first column), or None."""
+    return _index(worksheet, key_column).by_key.get(_clean(key))
+
+
+def locate(worksheet, key, key_column=None):
+    """row_number(), checked against the live key cell; None if the key is no longer in the tab."""
+    index = _index(worksheet, key_column)
+    rownum = index.by_key.get(_clean(key))
+    if rownum is not None:
+        cell = worksheet.get(rowcol_to_a1(rownum, index.column))
+        if cell and cell[0] and _clean(cell[0][0]) == _clean(key):
+            return rownum
+    # Rows were inserted, deleted or sorted above it: index a fresh copy of the tab
+    invalidate(worksheet)
+    return row_number(worksheet, key, key_column)
+
+
+def row_range(rownum, width):
+    """A1 range covering the first `width` cells of a row, e.g. "A7:M7"."""
+    return f"A{rownum}:{rowcol_to_a1(rownum, max(width, 1))}"
+
+
+def row_version(values):
+    """Short hash of a row's cells, trailing blanks ignored."""
+    cells = [_clean(v) for v in values]
+    while cells and not cells[-1]:
+        cells.pop()
+    return hashlib.sha1("\x1f".join(cells).encode("utf-8")).hexdigest()[:16]
+
+
+def current_version(worksheet, key, key_column=None):
+    """row_version() of the row as the snapshot holds it, or None if the key is not in the tab."""
+    index = _index(worksheet, key_column)
+    rownum = index.by_key.get(_clean(key))
+    return None if rownum is None else row_version(index.table.values[rownum - 1])
+
+
+def upsert_row(worksheet, key, row, version=None, key_column=None, retries=2):
+    """Write `row` over the row holding `key` with one range update, or append it if the key is absent.
+
+    With `version`, the live row is read first and RowConflict is raised if it
+    no longer matches. A row that moved (rows inserted or deleted above it) is
+    looked up again up to `retries` times. Returns the row number written, or
+    None if the row was appended.
+    """
+    key = _clean(key)
+    for _ in range(retries + 1):
+        index = _index(worksheet, key_column)
+        rownum = index.by_key.get(key)
+        if rownum is None:
+            # Index a fresh copy before deciding the key is new
+            invalidate(worksheet)
+            index = _index(worksheet, key_column)
+            rownum = index.by_key.get(key)
+            if rownum is None:
+                if version is not None:
+                    raise RowConflict(key, None)
+                append_rows(worksheet, [row])
+                invalidate(worksheet)
+                return None
+        live = worksheet.row_values(rownum)
+        if index.column > len(live) or _clean(live[index.column - 1]) != key:
+            invalidate(worksheet)
+            continue
+        if version is not None and row_version(live) != version:
+            raise RowConflict(key, live)
+        update_ranges(worksheet, [{"range": row_range(rownum, len(row)), "values": [list(row)]}])
+        invalidate(worksheet)
+        return rownum
+    raise RowConflict(key, None)
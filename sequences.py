@@ -0,0 +1,103 @@
+# Central primary-key allocator for all forms.
+#
+# Keys are either prefixed ("MOD-001", "PGT-014") or plain integers (numeric
+# IDs such as UncoatedSpool_ID). The allocator keeps a high-water mark per
+# (tab, prefix) in memory and reserves IDs in blocks under a process-wide lock,
+# so concurrent sessions never receive the same ID. The sheet is only read on
+# first use and when a block is exhausted, to pick up IDs written elsewhere;
+# rows still waiting in the write queue count too, so a restart with a
+# non-empty journal does not hand their IDs out again.
+
+import re
+import threading
+
+from write_queue import queued_values
+
+BLOCK_SIZE = 20
+
+
+def format_id(prefix, num):
+    return f"{prefix}-{str(num).zfill(3)}" if prefix else num
+
+
+def parse_id_num(value, prefix=None):
+    value = str(value).strip()
+    if prefix:
+        m = re.match(rf"^{re.escape(prefix)}-(\d+)$", value)
+        return int(m.group(1)) if m else None
+    return int(value) if value.isdigit() else None
+
+
+class SequenceAllocator:
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = {}
+        self._limit = {}
+
+    def _key(self, worksheet, prefix):
+        return (worksheet.spreadsheet.id, worksheet.id, prefix)
+
+    def _sheet_high_water(self, worksheet, prefix, id_col):
+        values = worksheet.col_values(id_col)[1:] + queued_values(worksheet, id_col)
+        nums = [parse_id_num(v, prefix) for v in values]
+        nums = [n for n in nums if n is not None]
+        return max(nums) if nums else None
+
+    def _ensure(self, worksheet, prefix, count, start_at, id_col):
+        key = self._key(worksheet, prefix)
+        if key in self._next and self._next[key] + count <= self._limit[key]:
+            return key
+        high = self._sheet_high_water(worksheet, prefix, id_col)
+        base = high + 1 if high is not None else start_at
+        if key in self._next:
+            base = max(base, self._next[key])
+        self._next[key] = base
+        self._limit[key] = base + max(self.block_size, count)
+        return key
+
+    def peek(self, worksheet, prefix=None, count=1, start_at=1, id_col=1):
+        """The next `count` IDs, without reserving them."""
+        with self._lock:
+            key = self._key(worksheet, prefix)
+            if key not in self._next:
+                self._ensure(worksheet, prefix, count, start_at, id_col)
+            first = self._next[key]
+        return [format_id(prefix, first + i) for i in range(count)]
+
+    def allocate(self, worksheet, prefix=None, count=1, start_at=1, id_col=1):
+        """Reserve `count` contiguous IDs; they are never handed out again by this process."""
+        with self._lock:
+            key = self._ensure(worksheet, prefix, count, start_at, id_col)
+            first = self._next[key]
+            self._next[key] = first + count
+        return [format_id(prefix, first + i) for i in range(count)]
+
+    def forget(self, worksheet=None, prefix=None):
+        with self._lock:
+            if worksheet is None:
+                self._next.clear()
+                self._limit.clear()
+            else:
+                key = self._key(worksheet, prefix)
+                self._next.pop(key, None)
+                self._limit.pop(key, None)
+
+
+allocator = SequenceAllocator()
+
+
+def peek_id(worksheet, prefix=None, start_at=1):
+    return allocator.peek(worksheet, prefix, start_at=start_at)[0]
+
+
+def peek_ids(worksheet, prefix=None, count=1, start_at=1):
+    return allocator.peek(worksheet, prefix, count=count, start_at=start_at)
+
+
+def next_id(worksheet, prefix=None, start_at=1):
+    return allocator.allocate(worksheet, prefix, start_at=start_at)[0]
+
+
+def next_ids(worksheet, prefix=None, count=1, start_at=1):
+    return allocator.allocate(worksheet, prefix, count=count, start_at=start_at)
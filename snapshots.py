@@ -0,0 +1,138 @@
+# Incremental table snapshots for append-only tabs.
+#
+# Most tabs only ever grow at the bottom, so re-downloading the whole tab on
+# every render wastes quota and time. A snapshot remembers the rows it already
+# holds; a refresh reads the header row plus everything from the last known
+# row downwards in one batch_get. If the header or the last known row no longer
+# match (rows inserted/deleted/edited near the end) the tab is reloaded in full.
+# Edits further up are caught by invalidate() for our own writes and by a
+# periodic full reload for everyone else's.
+
+import itertools
+import threading
+import time
+from collections import Counter
+
+from gspread.exceptions import GSpreadException
+from gspread.utils import numericise_all, rowcol_to_a1
+
+# Upper bound on how long an edit above the tail can go unnoticed.
+FULL_RELOAD_SECONDS = 600
+
+_lock = threading.Lock()
+_tables = {}
+_versions = itertools.count(1)
+_table_locks = {}
+
+
+def _key(worksheet):
+    return (worksheet.spreadsheet.id, worksheet.id)
+
+
+def _trimmed(row):
+    # Sheets drops trailing blanks, so compare rows without them
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+def end_column(worksheet, width):
+    return rowcol_to_a1(1, max(worksheet.col_count, width, 1)).rstrip("0123456789")
+
+
+class _Table:
+    def __init__(self, values):
+        self.values = [list(row) for row in values if row is not None]
+        if self.values == [[]]:
+            self.values = []
+        self.width = max((len(row) for row in self.values), default=0)
+        self.numericised = [numericise_all(row) for row in self.values[1:]]
+        self.loaded_at = time.time()
+        self.last_full = self.loaded_at
+        # Changes whenever the contents do; lets callers cache work derived from a tab
+        self.version = next(_versions)
+
+    def extend(self, rows):
+        self.values.extend(rows)
+        self.numericised.extend(numericise_all(row) for row in rows)
+        self.width = max([self.width] + [len(row) for row in rows])
+        self.loaded_at = time.time()
+        self.version = next(_versions)
+
+
+def _table_lock(key):
+    with _lock:
+        return _table_locks.setdefault(key, threading.Lock())
+
+
+def _refresh(worksheet):
+    key = _key(worksheet)
+    table = _tables.get(key)
+    if table is None or len(table.values) < 2 or time.time() - table.last_full > FULL_RELOAD_SECONDS:
+        table = _Table(worksheet.get_all_values())
+        _tables[key] = table
+        return table
+
+    last = len(table.values)
+    header, tail = worksheet.batch_get(["1:1", f"A{last}:{end_column(worksheet, table.width)}"])
+    header = header[0] if header else []
+    tail = [list(row) for row in tail]
+    if (_trimmed(header) != _trimmed(table.values[0])
+            or not tail or _trimmed(tail[0]) != _trimmed(table.values[-1])):
+        table = _Table(worksheet.get_all_values())
+        _tables[key] = table
+        return table
+    if len(tail) > 1:
+        table.extend(tail[1:])
+    return table
+
+
+def snapshot(worksheet):
+    with _table_lock(_key(worksheet)):
+        return _refresh(worksheet)
+
+
+def snapshot_values(worksheet):
+    """Like worksheet.get_all_values(), but only new rows are downloaded."""
+    table = snapshot(worksheet)
+    return [row + [""] * (table.width - len(row)) for row in table.values]
+
+
+def snapshot_records(worksheet):
+    """Like worksheet.get_all_records(), but only new rows are downloaded."""
+    return table_records(snapshot(worksheet))
+
+
+def _record_keys(header, width):
+    keys = list(header) + [""] * (width - len(header))
+    duplicates = [k for k, n in Counter(keys).items() if n > 1]
+    if duplicates:
+        raise GSpreadException(f"the header row in the worksheet contains duplicates: {duplicates}")
+    return keys
+
+
+def table_records(table):
+    if not table.values:
+        return []
+    keys = _record_keys(table.values[0], table.width)
+    width = len(keys)
+    return [dict(zip(keys, row + [""] * (width - len(row)))) for row in table.numericised]
+
+
+def values_records(values):
+    """get_all_records()-style dicts for a header row followed by data rows."""
+    if not values:
+        return []
+    keys = _record_keys(values[0], max(len(row) for row in values))
+    width = len(keys)
+    return [dict(zip(keys, numericise_all(list(row) + [""] * (width - len(row))))) for row in values[1:]]
+
+
+def invalidate(worksheet=None):
+    """Drop the snapshot of one tab (or all tabs) after editing rows in place."""
+    with _lock:
+        if worksheet is None:
+            _tables.clear()
+        else:
+            _tables.pop(_key(worksheet), None)
@@ -0,0 +1,267 @@
+# Effective concentration of every solution, combinations of combinations included.
+#
+# Solutions form a DAG. A prepared solution's concentration is the
+# C-Solution Concentration of its latest prep (or, without a prep, the
+# C-Solution Conc stored in Solution ID Tbl); a Combined Solution Tbl row is
+# the mass-weighted mean of its two inputs, which may be prepared solutions or
+# earlier combinations. Values are memoized per ID. Setting one prep,
+# solution or combination row forgets only the IDs downstream of it, so a
+# changed row costs a walk over its dependents rather than a rebuild. An ID
+# that, through its inputs, feeds itself is reported in `cycles` and has no
+# concentration.
+#
+# prep_index() groups the prep rows by solution, latest Prep Date first, with
+# every date parsed in one pass; it is rebuilt only when the prep tab's
+# snapshot changes.
+
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+import pandas as pd
+
+from dates import parse_date, parse_dates
+from gsheets import get_worksheet
+from snapshots import snapshot, table_records
+
+TAB_SOLUTION = "Solution ID Tbl"
+TAB_PREP = "Solution Prep Data Tbl"
+TAB_COMBINED = "Combined Solution Tbl"
+
+
+def _clean(value):
+    return str(value).strip()
+
+
+def _number(value):
+    try:
+        return float(_clean(value).replace(",", ""))
+    except ValueError:
+        return None
+
+
+class ConcentrationGraph:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._stored = {}                 # Solution ID -> C-Solution Conc
+        self._prep_rows = {}              # Prep ID -> (Solution ID, prep date, conc)
+        self._preps = defaultdict(dict)   # Solution ID -> {Prep ID: (prep date, conc)}
+        self._combos = {}                 # Combined ID -> (ID A, ID B, mass A, mass B, stored conc)
+        self._users = defaultdict(set)    # ID -> combinations it is an input of
+        self._memo = {}
+        self._tabs = {}                   # tab -> (snapshot table, rows consumed)
+        self.cycles = set()
+
+    # --- updates ---
+    def _invalidate(self, node):
+        seen, stack = {node}, [node]
+        while stack:
+            current = stack.pop()
+            self._memo.pop(current, None)
+            self.cycles.discard(current)
+            for user in self._users.get(current, ()):
+                if user not in seen:
+                    seen.add(user)
+                    stack.append(user)
+
+    def set_solution(self, solution_id, stored_conc):
+        with self._lock:
+            if self._stored.get(solution_id, object()) != stored_conc:
+                self._stored[solution_id] = stored_conc
+                self._invalidate(solution_id)
+
+    def set_prep(self, prep_id, solution_id, prep_date, conc):
+        with self._lock:
+            entry = (solution_id, prep_date, conc)
+            old = self._prep_rows.get(prep_id)
+            if old == entry:
+                return
+            if old is not None:
+                self._preps[old[0]].pop(prep_id, None)
+                self._invalidate(old[0])
+            self._prep_rows[prep_id] = entry
+            self._preps[solution_id][prep_id] = (prep_date, conc)
+            self._invalidate(solution_id)
+
+    def drop_prep(self, prep_id):
+        with self._lock:
+            old = self._prep_rows.pop(prep_id, None)
+            if old is not None:
+                self._preps[old[0]].pop(prep_id, None)
+                self._invalidate(old[0])
+
+    def set_combination(self, combined_id, id_a, id_b, mass_a, mass_b, stored_conc=None):
+        with self._lock:
+            entry = (id_a, id_b, mass_a, mass_b, stored_conc)
+            old = self._combos.get(combined_id)
+            if old == entry:
+                return
+            self._invalidate(combined_id)
+            if old is not None:
+                for input_id in old[:2]:
+                    self._users[input_id].discard(combined_id)
+            self._combos[combined_id] = entry
+            for input_id in (id_a, id_b):
+                if input_id:
+                    self._users[input_id].add(combined_id)
+
+    def drop_combination(self, combined_id):
+        with self._lock:
+            old = self._combos.pop(combined_id, None)
+            if old is not None:
+                self._invalidate(combined_id)
+                for input_id in old[:2]:
+                    self._users[input_id].discard(combined_id)
+
+    # --- evaluation ---
+    def _evaluate(self, node, path):
+        if node in self._memo:
+            return self._memo[node]
+        if node in path:
+            self.cycles.update(path[path.index(node):])
+            return None
+        combo = self._combos.get(node)
+        if combo is None:
+            preps = self._preps.get(node)
+            value = None
+            if preps:
+                # Latest prep date wins; the first row listed wins a tie
+                value = max(preps.values(), key=lambda p: p[0] or datetime.min)[1]
+            if value is None:
+                value = self._stored.get(node)
+        else:
+            path.append(node)
+            id_a, id_b, mass_a, mass_b, stored = combo
+            conc_a, conc_b = self._evaluate(id_a, path), self._evaluate(id_b, path)
+            path.pop()
+            mass_a, mass_b = mass_a or 0.0, mass_b or 0.0
+            if conc_a is None or conc_b is None:
+                value = stored
+            elif mass_a + mass_b > 0:
+                value = (mass_a * conc_a + mass_b * conc_b) / (mass_a + mass_b)
+            else:
+                value = 0.0
+            if node in self.cycles:
+                value = None
+        self._memo[node] = value
+        return value
+
+    def concentration(self, node_id):
+        """Effective concentration of a Solution or Combined Solution ID; None if unknown or on a cycle."""
+        with self._lock:
+            return self._evaluate(_clean(node_id), [])
+
+    def concentrations(self, node_ids):
+        with self._lock:
+            return {node_id: self._evaluate(_clean(node_id), []) for node_id in node_ids}
+
+    def combination_ids(self):
+        with self._lock:
+            return list(self._combos)
+
+    # --- loading from the tabs ---
+    def _apply_rows(self, tab, header, rows):
+        cols = {name.strip(): i for i, name in enumerate(header)}
+
+        def cell(row, name):
+            i = cols.get(name)
+            return _clean(row[i]) if i is not None and i < len(row) else ""
+
+        keys = []
+        for row in rows:
+            if tab == TAB_SOLUTION:
+                key = cell(row, "Solution ID")
+                if key:
+                    self.set_solution(key, _number(cell(row, "C-Solution Conc")))
+            elif tab == TAB_PREP:
+                key = cell(row, "Solution Prep ID")
+                if key:
+                    self.set_prep(key, cell(row, "Solution ID (FK)"), parse_date(cell(row, "Prep Date")),
+                                  _number(cell(row, "C-Solution Concentration")))
+            else:
+                key = cell(row, "Combined Solution ID")
+                if key:
+                    self.set_combination(key, cell(row, "Solution ID A"), cell(row, "Solution ID B"),
+                                         _number(cell(row, "Solution Mass A")),
+                                         _number(cell(row, "Solution Mass B")),
+                                         _number(cell(row, "Combined Solution Conc")))
+            if key:
+                keys.append(key)
+        return keys
+
+    def sync(self, tables):
+        """Feed {tab: snapshot table}: appended rows only, or a diff of the whole tab after a reload."""
+        with self._lock:
+            for tab, table in tables.items():
+                previous = self._tabs.get(tab)
+                data = table.values[1:]
+                header = table.values[0] if table.values else []
+                if previous is not None and previous[0] is table:
+                    if len(data) > previous[1]:
+                        self._apply_rows(tab, header, data[previous[1]:])
+                else:
+                    keys = set(self._apply_rows(tab, header, data))
+                    if tab == TAB_SOLUTION:
+                        for key in set(self._stored) - keys:
+                            self.set_solution(key, None)
+                    elif tab == TAB_PREP:
+                        for key in set(self._prep_rows) - keys:
+                            self.drop_prep(key)
+                    else:
+                        for key in set(self._combos) - keys:
+                            self.drop_combination(key)
+                self._tabs[tab] = (table, len(data))
+
+
+_lock = threading.Lock()
+_graphs = {}
+
+
+def concentration_graph(spreadsheet):
+    """The workbook's graph, caught up with its tab snapshots; shared between sessions."""
+    tables = {tab: snapshot(get_worksheet(spreadsheet, tab)) for tab in (TAB_SOLUTION, TAB_PREP, TAB_COMBINED)}
+    with _lock:
+        graph = _graphs.setdefault(spreadsheet.id, ConcentrationGraph())
+    graph.sync(tables)
+    return graph
+
+
+class PrepIndex:
+    def __init__(self, records):
+        self.records = records
+        frame = pd.DataFrame({
+            "sid": [_clean(r.get("Solution ID (FK)", "")) for r in records],
+            "date": parse_dates(pd.Series([str(r.get("Prep Date", "")) for r in records], dtype=object)),
+        })
+        # Latest first; undated preps last and ties in sheet order, as the per-solution sorts did
+        frame = frame.sort_values("date", ascending=False, kind="stable", na_position="last")
+        self._by_solution = {sid: [records[i] for i in positions]
+                             for sid, positions in frame.groupby("sid", sort=False).groups.items()}
+
+    def preps(self, solution_id):
+        """Prep records of a solution, latest first."""
+        return self._by_solution.get(_clean(solution_id), [])
+
+    def latest(self, solution_id):
+        preps = self.preps(solution_id)
+        return preps[0] if preps else None
+
+    def latest_conc(self, solution_id):
+        latest = self.latest(solution_id)
+        return float(latest.get("C-Solution Concentration", 0) or 0) if latest else 0.0
+
+
+_prep_indexes = {}
+
+
+def prep_index(spreadsheet):
+    """Prep index for the workbook's current prep snapshot; shared between sessions, so treat it as read-only."""
+    table = snapshot(get_worksheet(spreadsheet, TAB_PREP))
+    with _lock:
+        cached = _prep_indexes.get(spreadsheet.id)
+        if cached and cached[0] == table.version:
+            return cached[1]
+    index = PrepIndex(table_records(table))
+    with _lock:
+        _prep_indexes[spreadsheet.id] = (table.version, index)
+    return index
@@ -0,0 +1,431 @@
+# Storage backends for form tables.
+#
+# A form opens a table by tab name and header list and then only talks to the
+# returned table object: read all / read a range, append rows, update a row by
+# its key (first column) and allocate the next ID. RD_STORAGE_BACKEND selects:
+#
+#   sheets  - the Google Sheets workbooks (default); reads go through the tail
+#             snapshot cache and writes through the write-behind queue.
+#   sqlite  - a local SQLite file, no services needed.
+#   mysql   - MySQL via mysql-connector-python, config in st.secrets["mysql"].
+#
+# Relational tables get one TEXT column per header, an insertion-order row
+# number, and indexes on the key column and every other "... ID"/"(FK)"
+# column, so lookups by ID are index seeks instead of full scans.
+
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+from gspread.utils import numericise_all, rowcol_to_a1
+
+from gsheets import RD_SHEET_NAME, ensure_tabs, get_worksheet, open_spreadsheet
+from row_index import locate, row_number
+from sequences import format_id, parse_id_num, peek_id, next_id
+from snapshots import snapshot_records
+from write_queue import enqueue_rows, enqueue_update
+
+BACKEND = os.environ.get("RD_STORAGE_BACKEND", "sheets")
+SQLITE_PATH = os.environ.get("RD_SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rd_data.sqlite3"))
+POOL_SIZE = 5
+
+_lock = threading.Lock()
+_backend = None
+
+
+def _column_letter(n):
+    return rowcol_to_a1(1, max(n, 1)).rstrip("0123456789")
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8")
+    return str(value)
+
+
+def _to_records(headers, rows):
+    width = len(headers)
+    return [dict(zip(headers, numericise_all(list(row) + [""] * (width - len(row))))) for row in rows]
+
+
+# --- GOOGLE SHEETS ---
+class SheetsTable:
+    def __init__(self, worksheet, headers):
+        self.worksheet = worksheet
+        self.headers = list(headers)
+
+    def read_all(self):
+        return snapshot_records(self.worksheet)
+
+    def read_range(self, offset, limit):
+        """Data rows offset..offset+limit-1 (0 = first row under the header)."""
+        first = offset + 2
+        last = first + limit - 1
+        header, rows = self.worksheet.batch_get(["1:1", f"A{first}:{_column_letter(len(self.headers))}{last}"])
+        return _to_records(header[0] if header else self.headers, rows)
+
+    def get(self, key):
+        rownum = row_number(self.worksheet, key)
+        return self.read_all()[rownum - 2] if rownum is not None else None
+
+    def append_rows(self, rows):
+        return enqueue_rows(self.worksheet, rows)
+
+    def update_row(self, key, row):
+        """Overwrite the first row whose key matches; False if there is none."""
+        rownum = locate(self.worksheet, key)
+        if rownum is None:
+            return False
+        enqueue_update(self.worksheet, key, row)
+        return True
+
+    def peek_id(self, prefix=None, start_at=1):
+        return peek_id(self.worksheet, prefix, start_at=start_at)
+
+    def next_id(self, prefix=None, start_at=1):
+        return next_id(self.worksheet, prefix, start_at=start_at)
+
+
+class SheetsBackend:
+    name = "sheets"
+
+    def open_table(self, tab_name, headers, spreadsheet_name=RD_SHEET_NAME, key=None, url=None, create=True):
+        spreadsheet = open_spreadsheet(name=None if key or url else spreadsheet_name, key=key, url=url)
+        if create:
+            worksheet = ensure_tabs(spreadsheet, {tab_name: list(headers)})[tab_name]
+        else:
+            worksheet = get_worksheet(spreadsheet, tab_name)
+        return SheetsTable(worksheet, headers)
+
+
+# --- RELATIONAL ---
+def identifier(text):
+    return re.sub(r"\W+", "_", str(text)).strip("_").lower() or "col"
+
+
+def _column_names(headers):
+    names = []
+    for header in headers:
+        name = base = identifier(header)
+        n = 2
+        while name in names or name == "row_no":
+            name = f"{base}_{n}"
+            n += 1
+        names.append(name)
+    return names
+
+
+def _is_indexed(header):
+    header = header.strip()
+    return header.endswith("(FK)") or re.search(r"\bID$|_ID$|_PK$", header) is not None
+
+
+class _SQLitePool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if self._idle.qsize() < self.size:
+                self._idle.put(conn)
+            else:
+                conn.close()
+
+
+class SqlTable:
+    def __init__(self, backend, tab_name, headers):
+        self.backend = backend
+        self.headers = list(headers)
+        self.name = identifier(tab_name)
+        self.columns = _column_names(self.headers)
+
+    def _select(self):
+        q = self.backend.quote
+        return f"SELECT {', '.join(q(c) for c in self.columns)} FROM {q(self.name)}"
+
+    def _rows(self, sql, params=()):
+        with self.backend.connection() as conn:
+            rows = self.backend.execute(conn, sql, params).fetchall()
+        return [[_text(v) for v in row] for row in rows]
+
+    def read_all(self):
+        return _to_records(self.headers, self._rows(f"{self._select()} ORDER BY row_no"))
+
+    def read_range(self, offset, limit):
+        p = self.backend.placeholder
+        return _to_records(self.headers, self._rows(f"{self._select()} ORDER BY row_no LIMIT {p} OFFSET {p}", (limit, offset)))
+
+    def get(self, key):
+        q, p = self.backend.quote, self.backend.placeholder
+        rows = self._rows(f"{self._select()} WHERE {q(self.columns[0])} = {p} ORDER BY row_no LIMIT 1", (str(key),))
+        return _to_records(self.headers, rows)[0] if rows else None
+
+    def _values(self, row):
+        row = [_text(v) for v in row][:len(self.columns)]
+        return row + [""] * (len(self.columns) - len(row))
+
+    def append_rows(self, rows):
+        """Insert all rows in one transaction and return the elapsed seconds."""
+        if not rows:
+            return 0.0
+        started = time.perf_counter()
+        with self.backend.connection() as conn:
+            self._insert(conn, rows)
+        return time.perf_counter() - started
+
+    def _insert(self, conn, rows):
+        q, p = self.backend.quote, self.backend.placeholder
+        sql = (f"INSERT INTO {q(self.name)} ({', '.join(q(c) for c in self.columns)}) "
+               f"VALUES ({', '.join([p] * len(self.columns))})")
+        self.backend.executemany(conn, sql, [self._values(row) for row in rows])
+
+    def update_row(self, key, row):
+        q, p = self.backend.quote, self.backend.placeholder
+        sql = (f"UPDATE {q(self.name)} SET {', '.join(f'{q(c)} = {p}' for c in self.columns)} "
+               f"WHERE {q(self.columns[0])} = {p}")
+        with self.backend.connection() as conn:
+            return self.backend.execute(conn, sql, self._values(row) + [str(key)]).rowcount > 0
+
+    def _high_water(self, conn, prefix):
+        q, p = self.backend.quote, self.backend.placeholder
+        pattern = f"{prefix}-%" if prefix else "%"
+        values = self.backend.execute(
+            conn, f"SELECT {q(self.columns[0])} FROM {q(self.name)} WHERE {q(self.columns[0])} LIKE {p}", (pattern,)
+        ).fetchall()
+        nums = [n for n in (parse_id_num(_text(v[0]), prefix) for v in values) if n is not None]
+        return max(nums) if nums else None
+
+    def _sequence_name(self, prefix):
+        return f"{self.name}:{prefix or ''}"
+
+    def peek_id(self, prefix=None, start_at=1):
+        p = self.backend.placeholder
+        with self.backend.connection() as conn:
+            row = self.backend.execute(
+                conn, f"SELECT next_value FROM sequences WHERE name = {p}", (self._sequence_name(prefix),)
+            ).fetchone()
+            if row:
+                return format_id(prefix, row[0])
+            high = self._high_water(conn, prefix)
+        return format_id(prefix, high + 1 if high is not None else start_at)
+
+    def next_id(self, prefix=None, start_at=1):
+        """Reserve the next ID; the sequences row serialises concurrent writers."""
+        p = self.backend.placeholder
+        name = self._sequence_name(prefix)
+        for _ in range(3):
+            with self.backend.connection() as conn:
+                if self.backend.execute(conn, f"UPDATE sequences SET next_value = next_value + 1 WHERE name = {p}", (name,)).rowcount:
+                    value = self.backend.execute(conn, f"SELECT next_value FROM sequences WHERE name = {p}", (name,)).fetchone()[0]
+                    return format_id(prefix, value - 1)
+                high = self._high_water(conn, prefix)
+                first = high + 1 if high is not None else start_at
+                try:
+                    self.backend.execute(conn, f"INSERT INTO sequences (name, next_value) VALUES ({p}, {p})", (name, first + 1))
+                    return format_id(prefix, first)
+                except self.backend.integrity_error:
+                    # Another writer created the sequence first; take the UPDATE path
+                    conn.rollback()
+        raise RuntimeError(f"Could not allocate an ID for {self.name}")
+
+
+class SQLiteBackend:
+    name = "sqlite"
+    placeholder = "?"
+    integrity_error = sqlite3.IntegrityError
+    _row_no = "row_no INTEGER PRIMARY KEY AUTOINCREMENT"
+    _indexed_type = "TEXT"
+
+    def __init__(self, path=SQLITE_PATH):
+        self.pool = _SQLitePool(path)
+        self._tables = {}
+        self._lock = threading.Lock()
+        with self.connection() as conn:
+            self.execute(conn, f"CREATE TABLE IF NOT EXISTS sequences (name {self._indexed_type} PRIMARY KEY, next_value BIGINT NOT NULL)")
+
+    @staticmethod
+    def quote(name):
+        return f'"{name}"'
+
+    def connection(self):
+        return self.pool.connection()
+
+    def execute(self, conn, sql, params=()):
+        return conn.execute(sql, list(params))
+
+    def executemany(self, conn, sql, rows):
+        return conn.executemany(sql, rows)
+
+    def _existing_columns(self, conn, table):
+        return [row[1] for row in self.execute(conn, f"PRAGMA table_info({self.quote(table)})").fetchall()]
+
+    def _create_index(self, conn, table, column):
+        q = self.quote
+        self.execute(conn, f"CREATE INDEX IF NOT EXISTS {q(f'ix_{table}_{column}')} ON {q(table)} ({q(column)})")
+
+    def _ensure_schema(self, conn, table):
+        q = self.quote
+        indexed = {c for c, h in zip(table.columns, table.headers) if _is_indexed(h)} | {table.columns[0]}
+        existing = self._existing_columns(conn, table.name)
+        if not existing:
+            cols = [f"{q(c)} {self._indexed_type if c in indexed else 'TEXT'}" for c in table.columns]
+            self.execute(conn, f"CREATE TABLE IF NOT EXISTS {q(table.name)} ({self._row_no}, {', '.join(cols)})")
+        else:
+            # Header lists grow over time (e.g. a Date column added later)
+            for c in table.columns:
+                if c not in existing:
+                    self.execute(conn, f"ALTER TABLE {q(table.name)} ADD COLUMN {q(c)} {self._indexed_type if c in indexed else 'TEXT'}")
+        for c in indexed:
+            self._create_index(conn, table.name, c)
+
+    def open_table(self, tab_name, headers, spreadsheet_name=RD_SHEET_NAME, key=None, url=None, create=True):
+        if not create:
+            return SqlTable(self, tab_name, headers)
+        cache_key = (identifier(tab_name), tuple(headers))
+        with self._lock:
+            table = self._tables.get(cache_key)
+            if table is None:
+                table = SqlTable(self, tab_name, headers)
+                with self.connection() as conn:
+                    self._ensure_schema(conn, table)
+                self._tables[cache_key] = table
+            return table
+
+    def replace_table(self, tab_name, headers, rows):
+        """Recreate a table with new headers and contents (atomically on SQLite; MySQL commits DDL implicitly)."""
+        with self._lock:
+            table = SqlTable(self, tab_name, headers)
+            with self.connection() as conn:
+                self.execute(conn, f"DROP TABLE IF EXISTS {self.quote(table.name)}")
+                self._ensure_schema(conn, table)
+                table._insert(conn, rows)
+            self._tables = {k: v for k, v in self._tables.items() if k[0] != table.name}
+            self._tables[(table.name, tuple(headers))] = table
+            return table
+
+
+class _Fetched:
+    """Rows and rowcount of a MySQL statement whose cursor is already closed."""
+
+    def __init__(self, rows, rowcount):
+        self.rows = rows
+        self.rowcount = rowcount
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class MySQLBackend(SQLiteBackend):
+    name = "mysql"
+    placeholder = "%s"
+    _row_no = "row_no BIGINT AUTO_INCREMENT PRIMARY KEY"
+    # MySQL can only index a bounded prefix of TEXT, so key/FK columns are VARCHAR
+    _indexed_type = "VARCHAR(191)"
+
+    def __init__(self, config):
+        from mysql.connector import errors, pooling
+        from mysql.connector.constants import ClientFlag
+
+        self.integrity_error = errors.IntegrityError
+        self._programming_error = errors.ProgrammingError
+        # An UPDATE's rowcount then counts matched rows, so re-saving an unchanged row still finds it
+        flags = list(config.get("client_flags", [])) + [ClientFlag.FOUND_ROWS]
+        self.pool = pooling.MySQLConnectionPool(pool_name="rd_forms", pool_size=POOL_SIZE, **{**config, "client_flags": flags})
+        self._tables = {}
+        self._lock = threading.Lock()
+        with self.connection() as conn:
+            self.execute(conn, f"CREATE TABLE IF NOT EXISTS sequences (name {self._indexed_type} PRIMARY KEY, next_value BIGINT NOT NULL)")
+
+    @staticmethod
+    def quote(name):
+        return f"`{name}`"
+
+    @contextmanager
+    def connection(self):
+        conn = self.pool.get_connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            # Returns the connection to the pool
+            conn.close()
+
+    def execute(self, conn, sql, params=()):
+        with conn.cursor(prepared=True) as cursor:
+            cursor.execute(sql, tuple(params))
+            return _Fetched(cursor.fetchall() if cursor.with_rows else [], cursor.rowcount)
+
+    def executemany(self, conn, sql, rows):
+        with conn.cursor(prepared=True) as cursor:
+            cursor.executemany(sql, [tuple(row) for row in rows])
+            return _Fetched([], cursor.rowcount)
+
+    def _existing_columns(self, conn, table):
+        return [row[0] for row in self.execute(
+            conn,
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+            "ORDER BY ORDINAL_POSITION",
+            (table,),
+        ).fetchall()]
+
+    def _create_index(self, conn, table, column):
+        q = self.quote
+        try:
+            self.execute(conn, f"CREATE INDEX {q(f'ix_{table}_{column}'[:64])} ON {q(table)} ({q(column)})")
+        except self._programming_error as e:
+            if getattr(e, "errno", None) != 1061:  # ER_DUP_KEYNAME: index already exists
+                raise
+
+
+def get_backend():
+    """The configured backend, created once per process (RD_STORAGE_BACKEND=sheets|sqlite|mysql)."""
+    global _backend
+    with _lock:
+        if _backend is None:
+            if BACKEND == "sqlite":
+                _backend = SQLiteBackend()
+            elif BACKEND == "mysql":
+                _backend = MySQLBackend(dict(st.secrets["mysql"]))
+            else:
+                _backend = SheetsBackend()
+        return _backend
+
+
+def open_table(tab_name, headers, spreadsheet_name=RD_SHEET_NAME, key=None, url=None, create=True):
+    """The table for a tab, created (and its missing columns added) first unless `create` is False.
+
+    With create=False a table the form only reads is left exactly as it is; a
+    missing one raises the backend's own error on open or first read.
+    """
+    return get_backend().open_table(tab_name, headers, spreadsheet_name=spreadsheet_name, key=key, url=url, create=create)
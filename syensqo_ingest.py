@@ -0,0 +1,178 @@
+# Bulk import of the Syensqo supplier tab into Uncoated Fiber Data Tbl.
+#
+# Syensqo lists one fiber batch per row (data from sheet row 3). Rather than
+# importing batches one at a time through the entry form, new_batches() maps
+# every not-yet-imported row to a Uncoated Fiber Data row in one vectorized
+# pass, with the same defaults the form's safe_float/safe_int/parse_date
+# prefills use, and skips Batch_Fiber_IDs that already exist or are still
+# waiting in the write queue from an earlier import. A watermark
+# records the last Syensqo row scanned (and its contents, to notice edits
+# above it), so later runs only look at rows added since.
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from dates import parse_dates
+from snapshots import snapshot_records, snapshot_values
+from write_queue import queued_values
+
+STATE_PATH = os.environ.get("RD_INGEST_STATE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest_state.sqlite3"))
+SOURCE = "Syensqo"
+FIRST_ROW = 3
+
+SYENSQO_HEADERS = [
+    "Fiber", "Shipment date", "Tracking number UPS", "Batch length (m)", "OD", "SD",
+    "ID", "SD_ID", "Thickness (µm)", "Thickness/OD", "minimum thickness/OD",
+    "Concentricity (%)", "GPU (N2)", "Collapse pressure (PSI)",
+    "Kink test 2.95 inches (mm)", "Kink test 2.36 inches (mm)",
+    "Bobbin number", "Order (coating)", "Blue Splicings number", "Surface (m^2)"
+]
+
+# Uncoated Fiber Data column -> (Syensqo column, conversion), as prefilled by the form
+FIELDS = {
+    "Batch_Fiber_ID": ("Fiber", "text"),
+    "Inside_Diameter_Avg": ("ID", "float"),
+    "Inside_Diameter_StDev": ("SD_ID", "float"),
+    "Outside_Diameter_Avg": ("OD", "float"),
+    "Outside_Diameter_StDev": ("SD", "float"),
+    "Reported_Concentricity": ("Concentricity (%)", "float"),
+    "Batch_Length": ("Batch length (m)", "float"),
+    "Shipment_Date": ("Shipment date", "date"),
+    "Tracking_Number": ("Tracking number UPS", "text"),
+    "Average_t_OD": ("Thickness/OD", "float"),
+    "Minimum_t_OD": ("minimum thickness/OD", "float"),
+    "Minimum_Wall_Thickness": ("Thickness (µm)", "float"),
+    "N2_Permeance": ("GPU (N2)", "float"),
+    "Collapse_Pressure": ("Collapse pressure (PSI)", "float"),
+    "Kink_Test_2_95": ("Kink test 2.95 inches (mm)", "float"),
+    "Kink_Test_2_36": ("Kink test 2.36 inches (mm)", "float"),
+    "Order_On_Bobbin": ("Bobbin number", "int"),
+    "Number_Of_Blue_Splices": ("Blue Splicings number", "int"),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_watermarks (
+    source TEXT PRIMARY KEY,
+    last_row INTEGER NOT NULL,
+    last_values TEXT NOT NULL,
+    ingested_at REAL NOT NULL
+)
+"""
+
+
+@contextmanager
+def _state():
+    conn = sqlite3.connect(STATE_PATH, timeout=30)
+    try:
+        conn.execute(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _trimmed(row):
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+# --- VECTORIZED CONVERSIONS ---
+def _text(series):
+    return series.fillna("").astype(str).str.strip()
+
+
+def safe_floats(series):
+    """safe_float() for a whole column: blanks, "no kink" and junk become 0.0."""
+    text = _text(series).str.replace(",", "", regex=False)
+    return pd.to_numeric(text, errors="coerce").fillna(0.0).astype(float)
+
+
+def safe_ints(series):
+    """safe_int() for a whole column: int(float(value)), 0 when not a number."""
+    return pd.Series(np.trunc(safe_floats(series).to_numpy()).astype(int), index=series.index)
+
+
+def safe_dates(series):
+    """parse_date() for a whole column, as "YYYY-MM-DD"; unparseable dates become today."""
+    parsed = parse_dates(series)
+    return parsed.dt.strftime("%Y-%m-%d").fillna(datetime.today().strftime("%Y-%m-%d"))
+
+
+_CONVERT = {"text": _text, "float": safe_floats, "int": safe_ints, "date": safe_dates}
+
+
+def syensqo_frame(values, first_row=FIRST_ROW):
+    """Syensqo data rows from sheet row `first_row` down, indexed by sheet row number."""
+    rows = [list(row[:len(SYENSQO_HEADERS)]) + [""] * (len(SYENSQO_HEADERS) - len(row)) for row in values[first_row - 1:]]
+    df = pd.DataFrame(rows, columns=SYENSQO_HEADERS, index=range(first_row, first_row + len(rows)))
+    return df.loc[~(df == "").all(axis=1)]
+
+
+def to_fiber_rows(df, headers, now=None):
+    """Map Syensqo rows onto Uncoated Fiber Data Tbl columns (`headers` order)."""
+    now = now or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    out = pd.DataFrame(index=df.index)
+    for header in headers:
+        if header in FIELDS:
+            column, kind = FIELDS[header]
+            out[header] = _CONVERT[kind](df[column])
+        elif header == "Average_Wall_Thickness":
+            out[header] = 0.0
+        elif header == "Fiber_Source":
+            out[header] = SOURCE
+        elif header == "Date_Time":
+            out[header] = now
+        else:
+            out[header] = ""
+    return out
+
+
+# --- WATERMARK ---
+def get_watermark():
+    with _state() as conn:
+        row = conn.execute("SELECT last_row, last_values FROM ingest_watermarks WHERE source = ?", (SOURCE,)).fetchone()
+    return (row[0], json.loads(row[1])) if row else (FIRST_ROW - 1, [])
+
+
+def save_watermark(last_row, last_values):
+    with _state() as conn:
+        conn.execute("INSERT OR REPLACE INTO ingest_watermarks VALUES (?, ?, ?, ?)",
+                     (SOURCE, last_row, json.dumps(_trimmed(last_values)), time.time()))
+
+
+def reset_watermark():
+    with _state() as conn:
+        conn.execute("DELETE FROM ingest_watermarks WHERE source = ?", (SOURCE,))
+
+
+# --- DIFF ---
+def new_batches(syensqo_sheet, fiber_sheet, headers):
+    """Rows to append to Uncoated Fiber Data Tbl, plus the watermark to save once they are written.
+
+    Only Syensqo rows after the watermark are scanned; if the watermark row was
+    edited or removed, the whole tab is scanned again. Batches already in the
+    fiber table, queued for it but not yet written, or repeated in Syensqo are
+    skipped.
+    """
+    values = snapshot_values(syensqo_sheet)
+    last_row, last_values = get_watermark()
+    if last_row >= FIRST_ROW and (len(values) < last_row or _trimmed(values[last_row - 1]) != last_values):
+        last_row = FIRST_ROW - 1
+    scan_from = max(last_row + 1, FIRST_ROW)
+    df = syensqo_frame(values, first_row=scan_from)
+    watermark = (len(values), values[-1]) if len(values) >= scan_from else (last_row, last_values)
+
+    existing = {str(r.get("Batch_Fiber_ID", "")).strip() for r in snapshot_records(fiber_sheet)}
+    existing.update(str(v).strip() for v in queued_values(fiber_sheet, headers.index("Batch_Fiber_ID") + 1))
+    fiber = _text(df["Fiber"])
+    keep = (fiber != "") & ~fiber.isin(existing) & ~fiber.duplicated(keep="first")
+    return to_fiber_rows(df[keep], headers), watermark
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+import dates
+
+
+def test_memo_overflow_keeps_earlier_hits(monkeypatch):
+    monkeypatch.setattr(dates, "MEMO_LIMIT", 5)
+    monkeypatch.setattr(dates, "_memo", {})
+    first = ["2024-05-01", "2024-05-02", "2024-05-03"]
+    dates.parse_dates(first)
+    # Three memoized strings plus four new ones overflow the memo and clear it mid-call
+    parsed = dates.parse_dates(first + ["5/4/2024", "2024-05-05 13:45:00", "2024-05-06 13:45:00.250000", "junk"])
+    expected = pd.to_datetime(["2024-05-01", "2024-05-02", "2024-05-03", "2024-05-04",
+                               "2024-05-05 13:45:00", "2024-05-06 13:45:00.25"], format="mixed")
+    assert list(parsed[:6]) == list(expected)
+    assert pd.isna(parsed.iloc[6])
+    assert len(dates._memo) <= 5 + 4
+
+
+def test_memo_cleared_by_another_call(monkeypatch):
+    monkeypatch.setattr(dates, "_memo", {"2024-05-01": np.datetime64("2024-05-01", "ns")})
+
+    real = dates._parse_unique
+
+    def parse_and_clear(strings):
+        # Another session clears the memo while this call is parsing
+        dates._memo.clear()
+        return real(strings)
+
+    monkeypatch.setattr(dates, "_parse_unique", parse_and_clear)
+    parsed = dates.parse_dates(["2024-05-01", "2024-05-02"])
+    assert list(parsed) == list(pd.to_datetime(["2024-05-01", "2024-05-02"]))
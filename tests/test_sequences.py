@@ -0,0 +1,29 @@
+import sequences
+import write_queue
+
+
+class _Spreadsheet:
+    id = "book"
+
+
+class _Worksheet:
+    spreadsheet = _Spreadsheet()
+    id = 0
+    title = "Module Tbl"
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def col_values(self, col):
+        return ["Module ID"] + self.ids
+
+
+def test_ids_of_queued_rows_are_not_handed_out_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(write_queue, "QUEUE_PATH", str(tmp_path / "journal.sqlite3"))
+    monkeypatch.setattr(write_queue, "start_flusher", lambda: None)
+    worksheet = _Worksheet(["MOD-001", "MOD-002"])
+    # Written by a previous process and still waiting for the flusher
+    write_queue.enqueue_rows(worksheet, [["MOD-003", "Mini"], ["MOD-004", "Wound"]])
+
+    allocator = sequences.SequenceAllocator()
+    assert allocator.allocate(worksheet, "MOD") == ["MOD-005"]
@@ -0,0 +1,38 @@
+import syensqo_ingest
+import write_queue
+from syensqo_ingest import SYENSQO_HEADERS
+
+
+class _Spreadsheet:
+    id = "book"
+
+
+class _Worksheet:
+    spreadsheet = _Spreadsheet()
+    id = 0
+    title = "Uncoated Fiber Data Tbl"
+
+
+def _syensqo(*fibers):
+    rows = [["Syensqo fiber report"], SYENSQO_HEADERS]
+    return rows + [[fiber] + ["1"] * (len(SYENSQO_HEADERS) - 1) for fiber in fibers]
+
+
+def test_rescan_skips_batches_still_in_the_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(syensqo_ingest, "STATE_PATH", str(tmp_path / "ingest.sqlite3"))
+    monkeypatch.setattr(write_queue, "QUEUE_PATH", str(tmp_path / "journal.sqlite3"))
+    monkeypatch.setattr(write_queue, "start_flusher", lambda: None)
+    monkeypatch.setattr(syensqo_ingest, "snapshot_values", lambda worksheet: _syensqo("B-1", "B-2", "B-3"))
+    monkeypatch.setattr(syensqo_ingest, "snapshot_records", lambda worksheet: [{"Batch_Fiber_ID": "B-1"}])
+    headers = ["Batch_Fiber_ID", "Supplier_Batch_ID", "Inside_Diameter_Avg"]
+    fiber_sheet = _Worksheet()
+
+    rows, watermark = syensqo_ingest.new_batches(None, fiber_sheet, headers)
+    assert rows["Batch_Fiber_ID"].tolist() == ["B-2", "B-3"]
+    # Imported, then rescanned before the flusher wrote anything
+    write_queue.enqueue_rows(fiber_sheet, rows.values.tolist())
+    syensqo_ingest.save_watermark(*watermark)
+    syensqo_ingest.reset_watermark()
+
+    rows, _ = syensqo_ingest.new_batches(None, fiber_sheet, headers)
+    assert rows.empty
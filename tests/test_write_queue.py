@@ -0,0 +1,50 @@
+import write_queue
+
+
+class _Spreadsheet:
+    id = "book"
+
+
+class _Worksheet:
+    spreadsheet = _Spreadsheet()
+    id = 0
+    title = "Solution ID Tbl"
+
+
+def _journal_to(tmp_path, monkeypatch, rows):
+    """Flush against a tab whose keys sit at the row numbers in `rows`; returns the ranges written."""
+    written = []
+    monkeypatch.setattr(write_queue, "QUEUE_PATH", str(tmp_path / "journal.sqlite3"))
+    monkeypatch.setattr(write_queue, "start_flusher", lambda: None)
+    monkeypatch.setattr(write_queue, "open_spreadsheet", lambda key: _Spreadsheet())
+    monkeypatch.setattr(write_queue, "get_worksheet", lambda spreadsheet, tab: _Worksheet())
+    monkeypatch.setattr(write_queue, "locate", lambda worksheet, key, key_column=None: rows.get(key))
+    monkeypatch.setattr(write_queue, "invalidate", lambda worksheet: None)
+
+    def update_ranges(worksheet, data, value_input_option="RAW"):
+        written.extend((item["range"], item["values"]) for item in data)
+        return 0.0
+
+    monkeypatch.setattr(write_queue, "update_ranges", update_ranges)
+    return written
+
+
+def test_update_row_is_resolved_when_sent(tmp_path, monkeypatch):
+    rows = {"SOL-002": 3}
+    written = _journal_to(tmp_path, monkeypatch, rows)
+    write_queue.enqueue_update(_Worksheet(), "SOL-002", ["Yes", "No"], column=3)
+    # A row was inserted above it before the flusher ran
+    rows["SOL-002"] = 4
+
+    assert write_queue.flush_once() == 1
+    assert written == [("C4:D4", [["Yes", "No"]])]
+
+
+def test_update_waits_for_a_row_that_is_not_written_yet(tmp_path, monkeypatch):
+    written = _journal_to(tmp_path, monkeypatch, {})
+    write_queue.enqueue_update(_Worksheet(), "SOL-009", [0.25], column=5)
+
+    assert write_queue.flush_once() == 0
+    assert written == []
+    status = write_queue.queue_status()
+    assert status["pending"] == 1 and status["retrying"][0][1] == 1
@@ -1,16 +1,18 @@
 import streamlit as st
 import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import json
 from datetime import datetime
+from gsheets import open_spreadsheet, get_worksheet, ensure_tabs
+from write_queue import enqueue_row, enqueue_rows, show_queue_status
+from api_trace import show_render_cost
+from sequences import next_id
+from snapshots import snapshot_values, snapshot_records
+from date_index import read_recent
+from dates import parse_dates
+from syensqo_ingest import syensqo_frame, new_batches, save_watermark, reset_watermark
 
 # === GOOGLE SHEET SETUP ===
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(st.secrets["gcp_service_account"]), scope)
-client = gspread.authorize(creds)
 sheet_url = "https://docs.google.com/spreadsheets/d/1AGZ1g3LeSPtLAKV685snVQeERWXVPF4WlIAV8aAj9o8"
-spreadsheet = client.open_by_url(sheet_url)
+spreadsheet = open_spreadsheet(url=sheet_url)
 
 # === HEADERS (MATCH YOUR GOOGLE SHEET TABLES) ===
 UFD_HEADERS = [
@@ -31,25 +33,15 @@ QC_HEADERS = [
 
 # === LOAD SYENSQO SHEET: MANUAL HEADER ASSIGNMENT ===
 try:
-    syensqo_sheet = spreadsheet.worksheet("Syensqo")
+    syensqo_sheet = get_worksheet(spreadsheet, "Syensqo")
 except Exception:
     syensqo_sheet = None
 
 syensqo_df = pd.DataFrame()
 if syensqo_sheet:
-    syensqo_raw = syensqo_sheet.get_all_values()
+    syensqo_raw = snapshot_values(syensqo_sheet)
     if len(syensqo_raw) > 2:
-        syensqo_headers = [
-            "Fiber", "Shipment date", "Tracking number UPS", "Batch length (m)", "OD", "SD",
-            "ID", "SD_ID", "Thickness (µm)", "Thickness/OD", "minimum thickness/OD",
-            "Concentricity (%)", "GPU (N2)", "Collapse pressure (PSI)",
-            "Kink test 2.95 inches (mm)", "Kink test 2.36 inches (mm)",
-            "Bobbin number", "Order (coating)", "Blue Splicings number", "Surface (m^2)"
-        ]
-        syensqo_data = syensqo_raw[2:]  # Data starts from 3rd row
-        trimmed_data = [row[:len(syensqo_headers)] for row in syensqo_data]
-        syensqo_df = pd.DataFrame(trimmed_data, columns=syensqo_headers)
-        syensqo_df = syensqo_df.loc[~(syensqo_df == '').all(axis=1)]
+        syensqo_df = syensqo_frame(syensqo_raw)  # Data starts from 3rd row
     else:
         syensqo_df = pd.DataFrame()
 
@@ -75,34 +67,22 @@ def safe_text(val):
     return str(val).strip() if val is not None else ""
 
 def parse_date(val):
-    for fmt in ("%m/%d/%Y", "%d/%m/%Y", "%Y/%m/%d", "%Y-%m-%d"):
-        try:
-            return datetime.strptime(str(val).strip(), fmt).date()
-        except Exception:
-            continue
-    return datetime.today().date()
-
-def get_next_id(worksheet, id_column):
-    records = worksheet.get_all_records()
-    if records:
-        last_id = max([int(record[id_column]) for record in records if str(record[id_column]).isdigit()])
-        return last_id + 1
-    return 1
-
-def get_or_create_worksheet(sheet, title, headers):
-    try:
-        worksheet = sheet.worksheet(title)
-    except gspread.exceptions.WorksheetNotFound:
-        worksheet = sheet.add_worksheet(title=title, rows="1000", cols="50")
-        worksheet.append_row(headers)
-    return worksheet
+    parsed = parse_dates([val]).iloc[0]
+    return datetime.today().date() if pd.isna(parsed) else parsed.date()
 
 # === TABLE SHEETS ===
-ufd_sheet = get_or_create_worksheet(spreadsheet, "Uncoated Fiber Data Tbl", UFD_HEADERS)
-usid_sheet = get_or_create_worksheet(spreadsheet, "UnCoatedSpool ID Tbl", USID_HEADERS)
-ar_sheet = get_or_create_worksheet(spreadsheet, "As Received UnCoatedSpools Tbl", AR_HEADERS)
-cs_sheet = get_or_create_worksheet(spreadsheet, "Combined Spools Tbl", CS_HEADERS)
-qc_sheet = get_or_create_worksheet(spreadsheet, "Ardent Fiber Dimension QC Tbl", QC_HEADERS)
+tabs = ensure_tabs(spreadsheet, {
+    "Uncoated Fiber Data Tbl": UFD_HEADERS,
+    "UnCoatedSpool ID Tbl": USID_HEADERS,
+    "As Received UnCoatedSpools Tbl": AR_HEADERS,
+    "Combined Spools Tbl": CS_HEADERS,
+    "Ardent Fiber Dimension QC Tbl": QC_HEADERS,
+})
+ufd_sheet = tabs["Uncoated Fiber Data Tbl"]
+usid_sheet = tabs["UnCoatedSpool ID Tbl"]
+ar_sheet = tabs["As Received UnCoatedSpools Tbl"]
+cs_sheet = tabs["Combined Spools Tbl"]
+qc_sheet = tabs["Ardent Fiber Dimension QC Tbl"]
 
 # === UNCOATED FIBER DATA ENTRY ===
 st.header("Uncoated Fiber Data Entry")
@@ -227,22 +207,49 @@ if st.button("Submit Fiber Data"):
             form_values["Notes"],
             now_str
         ]
-        ufd_sheet.append_row(row, value_input_option="USER_ENTERED")
+        enqueue_row(ufd_sheet, row, value_input_option="USER_ENTERED")
         st.success(f"Fiber data for Batch Fiber ID {batch_fiber_id} submitted successfully!")
 
+# === BULK IMPORT FROM SYENSQO ===
+if syensqo_sheet:
+    with st.expander("📥 Bulk import new Syensqo batches"):
+        st.caption("Adds every Syensqo batch whose Fiber ID is not yet in (or queued for) Uncoated Fiber Data Tbl. "
+                   "Only rows added to Syensqo since the last import are scanned.")
+        try:
+            bulk_df, watermark = new_batches(syensqo_sheet, ufd_sheet, UFD_HEADERS)
+        except Exception as e:
+            st.error(f"❌ Could not read the Syensqo tab: {e}")
+            bulk_df, watermark = pd.DataFrame(), None
+        if watermark is not None and bulk_df.empty:
+            st.info("No new Syensqo batches to import.")
+            # Nothing to write; remember how far the tab has been scanned
+            save_watermark(*watermark)
+        elif not bulk_df.empty:
+            st.dataframe(bulk_df, hide_index=True)
+            if st.button(f"Import {len(bulk_df)} batches", key="syensqo_bulk_import"):
+                try:
+                    enqueue_rows(ufd_sheet, bulk_df.values.tolist(), value_input_option="USER_ENTERED")
+                    save_watermark(*watermark)
+                    st.success(f"Queued {len(bulk_df)} Syensqo batches for Uncoated Fiber Data Tbl.")
+                except Exception as e:
+                    st.error(f"❌ No batches were imported: {e}")
+        if st.button("Rescan the whole Syensqo tab", key="syensqo_rescan"):
+            reset_watermark()
+            st.rerun()
+
 # === UNCOATED SPOOL ID TABLE ===
 st.header("UnCoatedSpool ID Entry")
 spool_type = st.selectbox("Type", ["As received", "Combined"], key="usid_type")
 c_length = st.number_input("C-Length (sum of batch lengths on the spool)", value=0.0, key="usid_c_length")
 usid_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-st.button("Submit UnCoatedSpool ID", on_click=lambda: usid_sheet.append_row(
-    [get_next_id(usid_sheet, "UncoatedSpool_ID"), spool_type, c_length, usid_now]
+st.button("Submit UnCoatedSpool ID", on_click=lambda: enqueue_row(usid_sheet,
+    [next_id(usid_sheet), spool_type, c_length, usid_now]
 ))
 
 # === AS RECEIVED UNCOATED SPOOLS TABLE ===
 st.header("As Received UnCoatedSpools Entry")
-uncoated_spool_ids = [str(record["UncoatedSpool_ID"]) for record in usid_sheet.get_all_records() if record.get("UncoatedSpool_ID")]
-batch_fiber_ids = [str(record["Batch_Fiber_ID"]) for record in ufd_sheet.get_all_records() if record.get("Batch_Fiber_ID")]
+uncoated_spool_ids = [str(record["UncoatedSpool_ID"]) for record in snapshot_records(usid_sheet) if record.get("UncoatedSpool_ID")]
+batch_fiber_ids = [str(record["Batch_Fiber_ID"]) for record in snapshot_records(ufd_sheet) if record.get("Batch_Fiber_ID")]
 ar_notes = st.text_area("Notes for As Received UnCoatedSpools", key="ar_notes")
 if not uncoated_spool_ids or not batch_fiber_ids:
     st.warning("⚠️ Please ensure both UncoatedSpool IDs and Batch Fiber IDs are available before submitting.")
@@ -253,14 +260,14 @@ else:
     selected_usid = st.selectbox("UncoatedSpool ID", uncoated_spool_ids, key="ar_usid")
     selected_bfid = st.selectbox("Batch Fiber ID", batch_fiber_ids, key="ar_bfid")
     if st.button("Submit As Received UnCoatedSpools"):
-        next_ar_pk = get_next_id(ar_sheet, "Received_Spool_PK")
+        next_ar_pk = next_id(ar_sheet)
         ar_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        ar_sheet.append_row([next_ar_pk, selected_usid, selected_bfid, ar_notes, ar_now])
+        enqueue_row(ar_sheet, [next_ar_pk, selected_usid, selected_bfid, ar_notes, ar_now])
         st.success(f"As Received UnCoatedSpools PK {next_ar_pk} submitted.")
 
 # === COMBINED SPOOLS TABLE ===
 st.header("Combined Spools Entry")
-received_spool_pks = [str(record["Received_Spool_PK"]) for record in ar_sheet.get_all_records() if record.get("Received_Spool_PK")]
+received_spool_pks = [str(record["Received_Spool_PK"]) for record in snapshot_records(ar_sheet) if record.get("Received_Spool_PK")]
 if not uncoated_spool_ids or not received_spool_pks:
     st.warning("⚠️ Please ensure both UncoatedSpool IDs and Received Spool PKs are available before submitting.")
     st.selectbox("UncoatedSpool ID for Combined", uncoated_spool_ids or ["No IDs available"], key="cs_usid", disabled=True)
@@ -270,9 +277,9 @@ else:
     selected_usid_c = st.selectbox("UncoatedSpool ID for Combined", uncoated_spool_ids, key="cs_usid")
     selected_rspk = st.selectbox("Received Spool PK", received_spool_pks, key="cs_rspk")
     if st.button("Submit Combined Spools"):
-        next_cs_pk = get_next_id(cs_sheet, "Combined_SpoolsPK")
+        next_cs_pk = next_id(cs_sheet)
         cs_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cs_sheet.append_row([next_cs_pk, selected_usid_c, selected_rspk, cs_now])
+        enqueue_row(cs_sheet, [next_cs_pk, selected_usid_c, selected_rspk, cs_now])
         st.success(f"Combined Spools PK {next_cs_pk} submitted.")
 
 # === ARDENT FIBER DIMENSION QC TABLE ===
@@ -304,9 +311,9 @@ else:
     inside_circ = st.number_input("Inside Circularity", value=0.0, key="qc_ic")
     outside_circ = st.number_input("Outside Circularity", value=0.0, key="qc_oc")
     if st.button("Submit Fiber Dimension QC"):
-        next_qc_id = get_next_id(qc_sheet, "Ardent_QC_ID")
+        next_qc_id = next_id(qc_sheet)
         qc_now = qc_date.strftime("%Y-%m-%d %H:%M:%S")
-        qc_sheet.append_row([
+        enqueue_row(qc_sheet, [
             next_qc_id, selected_bfid_qc, selected_usid_qc, ardent_qc_inside_d,
             ardent_qc_outside_d, measured_conc, wall_thick, operator_init,
             qc_notes, qc_now, inside_circ, outside_circ
@@ -316,33 +323,16 @@ else:
 # === 7 DAY PREVIEW ===
 from datetime import timedelta
 
-def parse_datetime_str(dt_str):
-    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%m/%d/%Y"):
-        try:
-            return datetime.strptime(str(dt_str).strip(), fmt)
-        except Exception:
-            continue
-    return None
-
 def filter_last_7_days(records, date_key="Date_Time"):
-    today = datetime.today()
-    filtered_records = []
-    for record in records:
-        if not isinstance(record, dict):
-            continue
-        dt_str = record.get(date_key, "")
-        if dt_str is None:
-            continue
-        dt_str = str(dt_str).strip()
-        parsed = parse_datetime_str(dt_str)
-        if parsed and parsed.date() >= (today - timedelta(days=7)).date():
-            filtered_records.append(record)
-    return filtered_records
+    records = [record for record in records if isinstance(record, dict)]
+    parsed = parse_dates([record.get(date_key, "") for record in records])
+    recent = parsed.dt.normalize() >= pd.Timestamp((datetime.today() - timedelta(days=7)).date())
+    return [record for record, keep in zip(records, recent) if keep]
 
 
 def show_table_preview(title, worksheet, date_col="Date_Time"):
     st.markdown(f"#### {title}")
-    records = worksheet.get_all_records()
+    records = read_recent(worksheet, date_col, 7)
     filtered = filter_last_7_days(records, date_col)
     if filtered:
         st.dataframe(pd.DataFrame(filtered))
@@ -355,3 +345,7 @@ show_table_preview("🧵 UnCoatedSpool ID", usid_sheet, "Date_Time")
 show_table_preview("📦 As Received UncoatedSpools", ar_sheet, "Date_Time")
 show_table_preview("🔗 Combined Spools", cs_sheet, "Date_Time")
 show_table_preview("🧪 Ardent Fiber Dimension QC", qc_sheet, "Date_Time")
+
+# === UPLOAD QUEUE ===
+show_queue_status()
+show_render_cost()
@@ -0,0 +1,320 @@
+# Durable write-behind queue for Sheets writes.
+#
+# Forms enqueue appends and range updates into a local SQLite journal, which
+# costs a disk write instead of an API round trip. A background flusher drains
+# the journal, coalescing consecutive writes to the same tab into one batched
+# request and retrying failures with exponential backoff and jitter. Entries
+# stay in the journal until Google confirms them, so nothing is lost on a
+# transient 429/5xx or a process restart. Appends are not idempotent: a
+# timeout or 5xx can arrive after Google applied the append, so before an
+# append is re-sent the tab's last rows are checked for its first key.
+# In-place updates are journaled by row key and resolved to a row number only
+# when they are sent, since rows can move (or still be queued) in the meantime.
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+from gspread.utils import rowcol_to_a1
+
+from gsheets import open_spreadsheet, get_worksheet, append_rows, update_ranges
+from row_index import locate
+from snapshots import invalidate, snapshot
+
+QUEUE_PATH = os.environ.get("RD_WRITE_QUEUE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "write_queue.sqlite3"))
+POLL_SECONDS = 2.0
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 300.0
+MAX_ATTEMPTS = 10
+# A 'sending' claim older than this is assumed to belong to a dead process
+STALE_CLAIM_SECONDS = 300.0
+# Rows at the end of a tab searched for a retried append that may have landed
+RETRY_CHECK_ROWS = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_writes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    spreadsheet_id TEXT NOT NULL,
+    tab TEXT NOT NULL,
+    op TEXT NOT NULL,
+    range TEXT,
+    payload TEXT NOT NULL,
+    value_input_option TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    claimed_at REAL,
+    created REAL NOT NULL
+)
+"""
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_flusher = None
+_last_flush = {}
+
+
+@contextmanager
+def _journal():
+    conn = sqlite3.connect(QUEUE_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _json_default(value):
+    # numpy scalars (e.g. from DataFrame cells) expose .item(); anything else goes in as text
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+# --- ENQUEUE ---
+def _enqueue(worksheet, op, payload, value_input_option, range_name=None):
+    started = time.perf_counter()
+    with _journal() as conn:
+        conn.execute(
+            "INSERT INTO pending_writes (spreadsheet_id, tab, op, range, payload, value_input_option, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (worksheet.spreadsheet.id, worksheet.title, op, range_name,
+             json.dumps(payload, default=_json_default), value_input_option, time.time()),
+        )
+    start_flusher()
+    _wakeup.set()
+    return time.perf_counter() - started
+
+
+def enqueue_rows(worksheet, rows, value_input_option="RAW"):
+    """Journal rows for appending and return the local write time in seconds.
+
+    Rows enqueued together are always sent in the same append request.
+    """
+    if not rows:
+        return 0.0
+    return _enqueue(worksheet, "append", [list(row) for row in rows], value_input_option)
+
+
+def enqueue_row(worksheet, row, value_input_option="RAW"):
+    return enqueue_rows(worksheet, [row], value_input_option)
+
+
+def enqueue_update(worksheet, key, values, column=1, key_column=None, value_input_option="RAW"):
+    """Journal an in-place write of the cells `values` into the row keyed `key`, starting at `column` (1-based).
+
+    The row is looked up when the write is sent, not now.
+    """
+    payload = {"key": key, "key_column": key_column, "column": column, "values": list(values)}
+    return _enqueue(worksheet, "update", payload, value_input_option)
+
+
+# --- FLUSHER ---
+def _backoff_seconds(attempts):
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempts))
+
+
+def _next_run(entries):
+    # Longest prefix of same-kind writes; never reorders writes to a tab
+    first = entries[0]
+    run = [first]
+    for entry in entries[1:]:
+        if entry["op"] != first["op"] or entry["value_input_option"] != first["value_input_option"]:
+            break
+        run.append(entry)
+    return run
+
+
+def _already_appended(worksheet, entries):
+    """Ids of retried append entries whose first key is already among the tab's last rows."""
+    keys = {}
+    for entry in entries:
+        rows = json.loads(entry["payload"])
+        key = str(rows[0][0]).strip() if rows and rows[0] else ""
+        if key:
+            keys[entry["id"]] = key
+    if not keys:
+        return set()
+    tail = snapshot(worksheet).values[1:][-RETRY_CHECK_ROWS:]
+    present = {str(row[0]).strip() for row in tail if row}
+    return {entry_id for entry_id, key in keys.items() if key in present}
+
+
+def _update_target(worksheet, entry):
+    payload = json.loads(entry["payload"])
+    if entry["range"]:
+        # Journaled before updates were keyed
+        return {"range": entry["range"], "values": payload}
+    rownum = locate(worksheet, payload["key"], payload["key_column"])
+    if rownum is None:
+        # Retried with backoff, so a row whose own append is still queued is found later
+        raise LookupError(f"{payload['key']} not found in {worksheet.title}")
+    last = payload["column"] + len(payload["values"]) - 1
+    return {
+        "range": f"{rowcol_to_a1(rownum, payload['column'])}:{rowcol_to_a1(rownum, last)}",
+        "values": [payload["values"]],
+    }
+
+
+def _write_run(run):
+    first = run[0]
+    worksheet = get_worksheet(open_spreadsheet(key=first["spreadsheet_id"]), first["tab"])
+    if first["op"] == "append":
+        # An earlier attempt may have been applied even though it reported an error
+        landed = _already_appended(worksheet, [entry for entry in run if entry["attempts"]])
+        rows = [row for entry in run if entry["id"] not in landed for row in json.loads(entry["payload"])]
+        elapsed = append_rows(worksheet, rows, value_input_option=first["value_input_option"])
+    else:
+        data = [_update_target(worksheet, entry) for entry in run]
+        rows = [row for item in data for row in item["values"]]
+        elapsed = update_ranges(worksheet, data, value_input_option=first["value_input_option"])
+        # In-place edits are invisible to a tail fetch
+        invalidate(worksheet)
+    return len(rows), elapsed
+
+
+def flush_once():
+    """Send every due journal entry; returns the number of entries written."""
+    now = time.time()
+    with _journal() as conn:
+        conn.execute(
+            "UPDATE pending_writes SET status = 'pending' WHERE status = 'sending' AND claimed_at < ?",
+            (now - STALE_CLAIM_SECONDS,),
+        )
+        entries = conn.execute("SELECT * FROM pending_writes WHERE status = 'pending' ORDER BY id").fetchall()
+    by_tab = {}
+    for entry in entries:
+        by_tab.setdefault((entry["spreadsheet_id"], entry["tab"]), []).append(entry)
+
+    written = 0
+    for (spreadsheet_id, tab), tab_entries in by_tab.items():
+        if tab_entries[0]["next_attempt"] > now:
+            continue
+        run = _next_run(tab_entries)
+        ids = [entry["id"] for entry in run]
+        marks = ",".join("?" * len(ids))
+        with _journal() as conn:
+            # Check and claim in one write transaction, so two flushers never share a run
+            conn.execute("BEGIN IMMEDIATE")
+            still_pending = conn.execute(
+                f"SELECT COUNT(*) FROM pending_writes WHERE id IN ({marks}) AND status = 'pending'", ids
+            ).fetchone()[0]
+            if still_pending != len(ids):
+                # Another process got there first; leave its claim alone and move on
+                continue
+            conn.execute(
+                f"UPDATE pending_writes SET status = 'sending', claimed_at = ? WHERE id IN ({marks})",
+                [time.time()] + ids,
+            )
+        try:
+            n_rows, elapsed = _write_run(run)
+        except Exception as e:
+            attempts = run[0]["attempts"] + 1
+            status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+            with _journal() as conn:
+                conn.execute(
+                    f"UPDATE pending_writes SET attempts = ?, next_attempt = ?, last_error = ?, status = ? WHERE id IN ({marks})",
+                    [attempts, time.time() + _backoff_seconds(attempts), str(e)[:500], status] + ids,
+                )
+            _last_flush[tab] = {"ok": False, "rows": 0, "seconds": 0.0, "at": time.time(), "error": str(e)[:500]}
+            continue
+        with _journal() as conn:
+            conn.execute(f"DELETE FROM pending_writes WHERE id IN ({marks})", ids)
+        _last_flush[tab] = {"ok": True, "rows": n_rows, "seconds": elapsed, "at": time.time(), "error": ""}
+        written += len(run)
+    return written
+
+
+def _flush_forever():
+    while True:
+        _wakeup.wait(POLL_SECONDS)
+        _wakeup.clear()
+        try:
+            # Keep draining while progress is made, so a burst empties quickly
+            while flush_once():
+                pass
+        except Exception:
+            time.sleep(POLL_SECONDS)
+
+
+def start_flusher():
+    """Start the background flusher once per process; safe to call on every rerun."""
+    global _flusher
+    with _lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_forever, name="sheets-write-flusher", daemon=True)
+            _flusher.start()
+
+
+# --- STATUS ---
+def queued_values(worksheet, col=1):
+    """Column `col` (1-based) of the rows journaled for appending to the tab and not yet written, in any state."""
+    with _journal() as conn:
+        payloads = conn.execute(
+            "SELECT payload FROM pending_writes WHERE spreadsheet_id = ? AND tab = ? AND op = 'append' ORDER BY id",
+            (worksheet.spreadsheet.id, worksheet.title),
+        ).fetchall()
+    return [row[col - 1] for (payload,) in payloads for row in json.loads(payload) if len(row) >= col]
+
+
+def queue_status():
+    with _journal() as conn:
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM pending_writes GROUP BY status").fetchall())
+        oldest = conn.execute("SELECT MIN(created) FROM pending_writes WHERE status = 'pending'").fetchone()[0]
+        failed = conn.execute(
+            "SELECT id, tab, op, attempts, last_error, created FROM pending_writes WHERE status = 'failed' ORDER BY id"
+        ).fetchall()
+        retrying = conn.execute(
+            "SELECT tab, COUNT(*), MAX(attempts), MAX(last_error) FROM pending_writes "
+            "WHERE status = 'pending' AND attempts > 0 GROUP BY tab"
+        ).fetchall()
+    return {
+        "pending": counts.get("pending", 0) + counts.get("sending", 0),
+        "failed": counts.get("failed", 0),
+        "oldest_age": time.time() - oldest if oldest else 0.0,
+        "failed_entries": [dict(row) for row in failed],
+        "retrying": [tuple(row) for row in retrying],
+        "last_flush": dict(_last_flush),
+    }
+
+
+def retry_failed():
+    with _journal() as conn:
+        conn.execute("UPDATE pending_writes SET status = 'pending', attempts = 0, next_attempt = 0 WHERE status = 'failed'")
+    start_flusher()
+    _wakeup.set()
+
+
+def show_queue_status():
+    """Sidebar panel with queue depth, retries and the latest batch per tab."""
+    start_flusher()
+    status = queue_status()
+    with st.sidebar.expander(f"📤 Upload queue ({status['pending']} pending)", expanded=bool(status["failed"])):
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Pending", status["pending"])
+        col2.metric("Failed", status["failed"])
+        col3.metric("Oldest (s)", f"{status['oldest_age']:.0f}")
+        for tab, n, attempts, error in status["retrying"]:
+            st.warning(f"`{tab}`: {n} write(s) retrying (attempt {attempts}): {error}")
+        if status["last_flush"]:
+            st.dataframe(pd.DataFrame([
+                {"Tab": tab, "OK": info["ok"], "Rows": info["rows"], "Latency (s)": round(info["seconds"], 2),
+                 "At": time.strftime("%H:%M:%S", time.localtime(info["at"])), "Error": info["error"]}
+                for tab, info in status["last_flush"].items()
+            ]))
+        if status["failed_entries"]:
+            st.dataframe(pd.DataFrame(status["failed_entries"]))
+            if st.button("🔁 Retry failed writes", key="retry_failed_writes"):
+                retry_failed()
+                st.rerun()